@@ -0,0 +1,157 @@
+import datetime
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+def normalize_preferences(preferences):
+    """
+    Canonical form of questionnaire answers: trimmed lowercase keys and
+    string values, multi-select answers sorted
+    """
+    def normalize(value):
+        if isinstance(value, str):
+            return value.strip().lower()
+        if isinstance(value, (list, tuple)):
+            return sorted((normalize(v) for v in value), key=str)
+        if isinstance(value, dict):
+            return {str(k).strip().lower(): normalize(v) for k, v in value.items()}
+        return value
+
+    return normalize(preferences or {})
+
+
+def cache_key(preferences, model, prompt_version):
+    """Content address of an analysis: normalized preferences + model + prompt version"""
+    canonical = json.dumps(
+        [normalize_preferences(preferences), model, prompt_version],
+        sort_keys=True, separators=(',', ':'), default=str
+    )
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class AnalysisCache:
+    """
+    Two-tier cache of AI style analyses: an in-process LRU with TTL in
+    front of the `analysis_cache` collection, both keyed by cache_key().
+
+    invalidate() also records when it ran in `<collection>_invalidations`
+    (per prompt version, or '*' for all). Every process re-reads those
+    markers at most every `invalidation_check_interval` seconds and drops
+    LRU entries remembered before them, so other workers stop serving
+    invalidated analyses within that interval rather than the LRU TTL.
+    """
+
+    def __init__(self, collection, max_entries=1024, ttl=3600, invalidation_check_interval=5):
+        self.collection = collection
+        self.invalidations = collection.database[f'{collection.name}_invalidations']
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.invalidation_check_interval = invalidation_check_interval
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._invalidations_checked = 0.0
+        self._counters = {'memory_hits': 0, 'db_hits': 0, 'misses': 0, 'stores': 0, 'invalidated': 0}
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def _remember(self, key, prompt_version, analysis):
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, prompt_version, analysis, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _drop(self, prompt_version=None, before=None):
+        """Forget LRU entries of one prompt version (or all), optionally only those remembered before a time"""
+        with self._lock:
+            stale = [
+                key for key, (_, version, _, remembered_at) in self._entries.items()
+                if (prompt_version is None or version == prompt_version)
+                and (before is None or remembered_at < before)
+            ]
+            for key in stale:
+                del self._entries[key]
+
+    def _check_invalidations(self):
+        """Apply invalidations made by other processes, at most every invalidation_check_interval seconds"""
+        now = time.time()
+        with self._lock:
+            if now - self._invalidations_checked < self.invalidation_check_interval:
+                return
+            self._invalidations_checked = now
+        for marker in self.invalidations.find({}):
+            self._drop(None if marker['_id'] == '*' else marker['_id'], before=marker['invalidated_at'])
+
+    def get(self, preferences, model, prompt_version):
+        """Cached analysis or None. Misses are counted by get_or_compute, where they cost an analysis"""
+        key = cache_key(preferences, model, prompt_version)
+        self._check_invalidations()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > time.time():
+                self._entries.move_to_end(key)
+                self._counters['memory_hits'] += 1
+                return entry[2]
+            if entry:
+                del self._entries[key]
+
+        document = self.collection.find_one({'_id': key})
+        if document:
+            self._count('db_hits')
+            self._remember(key, prompt_version, document['analysis'])
+            return document['analysis']
+
+        return None
+
+    def put(self, preferences, model, prompt_version, analysis):
+        key = cache_key(preferences, model, prompt_version)
+        self.collection.update_one(
+            {'_id': key},
+            {'$set': {
+                'analysis': analysis,
+                'model': model,
+                'prompt_version': prompt_version,
+                'created_at': datetime.datetime.now()
+            }},
+            upsert=True
+        )
+        self._remember(key, prompt_version, analysis)
+        self._count('stores')
+
+    def get_or_compute(self, preferences, model, prompt_version, compute):
+        """Return the cached analysis, or compute and store it; failed analyses are not cached"""
+        analysis = self.get(preferences, model, prompt_version)
+        if analysis is None:
+            self._count('misses')
+            analysis = compute(preferences)
+            if not analysis.get('error'):
+                self.put(preferences, model, prompt_version, analysis)
+        return analysis
+
+    def invalidate(self, prompt_version=None):
+        """Drop cached analyses for one prompt version, or all of them. Returns the number removed."""
+        query = {'prompt_version': prompt_version} if prompt_version else {}
+        removed = self.collection.delete_many(query).deleted_count
+        self.invalidations.update_one(
+            {'_id': prompt_version or '*'},
+            {'$set': {'invalidated_at': time.time()}},
+            upsert=True
+        )
+
+        self._drop(prompt_version)
+        self._count('invalidated', removed)
+        return removed
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['memory_entries'] = len(self._entries)
+        lookups = stats['memory_hits'] + stats['db_hits'] + stats['misses']
+        stats['hit_rate'] = (stats['memory_hits'] + stats['db_hits']) / lookups if lookups else 0.0
+        return stats
@@ -0,0 +1,183 @@
+import datetime
+import hashlib
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from pymongo.errors import DuplicateKeyError
+
+from identity import invalidate_identity
+
+logger = logging.getLogger(__name__)
+
+# Job states
+PENDING = 'pending'
+RUNNING = 'running'
+COMPLETED = 'completed'
+FAILED = 'failed'
+
+
+class QueueFull(Exception):
+    """Raised when the analysis backlog is at its limit"""
+
+
+def preferences_hash(preferences):
+    """Stable hash of a preferences dict, independent of key order"""
+    canonical = json.dumps(preferences, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class AnalysisJobQueue:
+    """
+    Runs AI style analyses on a bounded thread pool so request threads
+    never wait on the model. Every job is recorded in the `analysis_jobs`
+    collection; while a job is pending or running it holds a unique
+    `inflight_key` (user + preferences hash), so identical requests from
+    any process share the same job instead of starting a new one.
+
+    Jobs left pending or running by a crashed process are failed once they
+    have not been updated for `stale_after` seconds, by `sweep_stale` (run
+    from `start` and then every `sweep_interval` seconds).
+    """
+
+    def __init__(self, db, analyze, max_workers=4, max_pending=64, stale_after=300, sweep_interval=60):
+        self.db = db
+        self.analyze = analyze
+        self.stale_after = datetime.timedelta(seconds=stale_after)
+        self.sweep_interval = sweep_interval
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='style-analysis')
+        self._slots = threading.BoundedSemaphore(max_pending)
+        # Jobs queued or running in this process, which are never stale
+        self._active = set()
+        self._active_lock = threading.Lock()
+        self._thread = None
+
+    def submit(self, user_id, profile_id, preferences):
+        """
+        Queue an analysis for a saved profile. Returns (job document, deduplicated).
+        Raises QueueFull when max_pending jobs are already waiting in this process.
+        """
+        inflight_key = f"{user_id}:{preferences_hash(preferences)}"
+        now = datetime.datetime.now()
+        job = {
+            'user_id': user_id,
+            'profile_id': profile_id,
+            'preferences': preferences,
+            'inflight_key': inflight_key,
+            'status': PENDING,
+            'result': None,
+            'error': None,
+            'created_at': now,
+            'updated_at': now
+        }
+
+        for _ in range(2):
+            existing = self.db.analysis_jobs.find_one({'inflight_key': inflight_key})
+            if existing and now - existing['updated_at'] < self.stale_after:
+                return existing, True
+            if existing:
+                # Abandoned by a crashed worker: release its key and start over
+                self._finish(existing['_id'], FAILED, error='Job abandoned')
+
+            if not self._slots.acquire(blocking=False):
+                raise QueueFull('Style analysis queue is full')
+            try:
+                job['_id'] = self.db.analysis_jobs.insert_one(job).inserted_id
+            except DuplicateKeyError:
+                # An identical request won the race; share its job
+                self._slots.release()
+                job.pop('_id', None)
+                continue
+            except Exception:
+                self._slots.release()
+                raise
+
+            with self._active_lock:
+                self._active.add(job['_id'])
+            self._executor.submit(self._run, job['_id'], user_id, profile_id, preferences)
+            return job, False
+
+        existing = self.db.analysis_jobs.find_one({'inflight_key': inflight_key})
+        return existing, True
+
+    def get(self, job_id):
+        return self.db.analysis_jobs.find_one({'_id': job_id})
+
+    def sweep_stale(self):
+        """
+        Fail pending and running jobs not updated for stale_after, other than
+        this process's own, and release their inflight keys. Returns how many
+        jobs were failed.
+        """
+        with self._active_lock:
+            active = list(self._active)
+        result = self.db.analysis_jobs.update_many(
+            {
+                'status': {'$in': [PENDING, RUNNING]},
+                'updated_at': {'$lt': datetime.datetime.now() - self.stale_after},
+                '_id': {'$nin': active}
+            },
+            {
+                '$set': {'status': FAILED, 'error': 'Job abandoned', 'updated_at': datetime.datetime.now()},
+                '$unset': {'inflight_key': ''}
+            }
+        )
+        if result.modified_count:
+            logger.warning("Failed %d abandoned analysis jobs", result.modified_count)
+        return result.modified_count
+
+    # Background sweep
+
+    def start(self):
+        """Sweep abandoned jobs now and every sweep_interval seconds from a daemon thread"""
+        self._thread = threading.Thread(target=self._sweep, name='analysis-job-sweep', daemon=True)
+        self._thread.start()
+
+    def _sweep(self):
+        while True:
+            try:
+                self.sweep_stale()
+            except Exception:
+                logger.exception("Analysis job sweep failed")
+            time.sleep(self.sweep_interval)
+
+    def _run(self, job_id, user_id, profile_id, preferences):
+        try:
+            self.db.analysis_jobs.update_one(
+                {'_id': job_id},
+                {'$set': {'status': RUNNING, 'updated_at': datetime.datetime.now()}}
+            )
+            analysis = self.analyze(preferences)
+            if analysis.get('error'):
+                self._finish(job_id, FAILED, error=analysis['error'])
+                return
+
+            # Only apply the result if the profile still has these preferences
+            self.db.style_profiles.update_one(
+                {'_id': profile_id, 'preferences': preferences},
+                {'$set': {'ai_analysis': analysis, 'updated_at': datetime.datetime.now()}}
+            )
+            invalidate_identity(user_id)
+            self._finish(job_id, COMPLETED, result=analysis)
+        except Exception as e:
+            self._finish(job_id, FAILED, error=str(e))
+        finally:
+            with self._active_lock:
+                self._active.discard(job_id)
+            self._slots.release()
+
+    def _finish(self, job_id, status, result=None, error=None):
+        self.db.analysis_jobs.update_one(
+            {'_id': job_id},
+            {
+                '$set': {
+                    'status': status,
+                    'result': result,
+                    'error': error,
+                    'updated_at': datetime.datetime.now()
+                },
+                '$unset': {'inflight_key': ''}
+            }
+        )
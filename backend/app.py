@@ -7,31 +7,41 @@ import os
 from dotenv import load_dotenv
 from datetime import timedelta
 import logging
+import re
 from style_profile import style_bp
-from product import product_bp
- 
-# Set up logging
-logging.basicConfig(level=logging.DEBUG)
-logger = logging.getLogger(__name__)
+from product import product_bp, parse_projection, catalog_conditional, export_products
  
 # Load environment variables
 load_dotenv()
+
+# Set up logging: JSON records written from a background thread, level from LOG_LEVEL
+from structured_logging import configure_logging, register_request_ids
+configure_logging()
+logger = logging.getLogger(__name__)
  
 # Initialize Flask app
 app = Flask(__name__)
+register_request_ids(app)
+
+# Encode ObjectId/datetime natively so handlers can return MongoDB documents as-is
+from json_provider import BSONJSONProvider
+app.json = BSONJSONProvider(app)
 CORS(app)  # Enable CORS for all routes
+
+# Per-route latency, MongoDB command and dependency metrics, served at /metrics
+from metrics import instrument_app, MongoCommandListener
+instrument_app(app)
  
 # Configure MongoDB with better error handling
 try:
     app.config["MONGO_URI"] = os.environ.get("MONGO_URI", "mongodb://localhost:27017/personashop")
-    logger.debug(f"Attempting MongoDB connection with URI: {app.config['MONGO_URI']}")
-    mongo = PyMongo(app)
+    logger.debug("Attempting MongoDB connection", extra={'mongo_uri': re.sub(r'//[^@/]*@', '//***@', app.config['MONGO_URI'])})
+    mongo = PyMongo(app, event_listeners=[MongoCommandListener()])
     # Test connection
     mongo.db.command('ping')
     logger.info("MongoDB connected successfully!")
 except Exception as e:
-    logger.error(f"MongoDB connection error: {e}")
-    print(f"CRITICAL ERROR: MongoDB connection failed: {e}")
+    logger.critical("MongoDB connection failed: %s", e)
  
 # Configure JWT
 app.config["JWT_SECRET_KEY"] = os.environ.get("JWT_SECRET_KEY", "super-secret-key-change-in-production")
@@ -40,6 +50,15 @@ app.config["JWT_TOKEN_LOCATION"] = ["headers"]
 app.config["JWT_HEADER_NAME"] = "Authorization"
 app.config["JWT_HEADER_TYPE"] = "Bearer"
 jwt = JWTManager(app)
+
+# Resolve the user and style profile behind a token once per request
+from identity import register_identity_loader
+register_identity_loader(
+    jwt,
+    mongo.db,
+    ttl=float(os.environ.get("IDENTITY_CACHE_TTL_SECONDS", 5)),
+    max_entries=int(os.environ.get("IDENTITY_CACHE_MAX_ENTRIES", 10000))
+)
 bcrypt = Bcrypt(app)
  
 # Import and register blueprints
@@ -47,12 +66,128 @@ from auth import auth_bp
  
 # Add mongo to auth blueprint
 auth_bp.mongo = mongo
+
+# bcrypt runs on its own small process pool, away from request threads
+from password_hashing import PasswordHasher, DEFAULT_ROUNDS
+auth_bp.hasher = PasswordHasher(
+    workers=int(os.environ.get("BCRYPT_WORKERS", 2)),
+    max_queue=int(os.environ.get("BCRYPT_MAX_QUEUE", 32)),
+    rounds=int(os.environ.get("BCRYPT_LOG_ROUNDS", DEFAULT_ROUNDS))
+)
 style_bp.mongo = mongo
 product_bp.mongo = mongo
+
+# Server-side carts live in their own collection
+from cart import cart_bp
+cart_bp.mongo = mongo
+
+# Process-wide OpenAI client with concurrency limit and circuit breaker
+from openai_client import OpenAIClientManager
+style_bp.llm = OpenAIClientManager(
+    max_concurrency=int(os.environ.get("OPENAI_MAX_CONCURRENCY", 8)),
+    timeout=float(os.environ.get("OPENAI_TIMEOUT_SECONDS", 30)),
+    failure_threshold=int(os.environ.get("OPENAI_BREAKER_FAILURES", 5)),
+    reset_timeout=float(os.environ.get("OPENAI_BREAKER_RESET_SECONDS", 30))
+)
+
+# Two-tier cache of AI style analyses keyed by normalized preferences
+from analysis_cache import AnalysisCache
+style_bp.analysis_cache = AnalysisCache(
+    mongo.db.analysis_cache,
+    max_entries=int(os.environ.get("ANALYSIS_CACHE_SIZE", 1024)),
+    ttl=float(os.environ.get("ANALYSIS_CACHE_TTL_SECONDS", 3600)),
+    invalidation_check_interval=float(os.environ.get("ANALYSIS_CACHE_INVALIDATION_CHECK_SECONDS", 5))
+)
+
+# Background pool for AI style analyses
+from analysis_jobs import AnalysisJobQueue
+from style_profile import cached_ai_analysis
+style_bp.analysis_jobs = AnalysisJobQueue(
+    mongo.db,
+    cached_ai_analysis,
+    max_workers=int(os.environ.get("ANALYSIS_WORKERS", 4)),
+    max_pending=int(os.environ.get("ANALYSIS_MAX_PENDING", 64)),
+    sweep_interval=float(os.environ.get("ANALYSIS_SWEEP_SECONDS", 60))
+)
+try:
+    style_bp.analysis_jobs.start()
+except Exception as e:
+    logger.exception("Analysis job sweep failed to start")
+
+# Create or repair the declared MongoDB indexes
+try:
+    from indexes import ensure_indexes
+    index_changes = ensure_indexes(mongo.db)
+    logger.info("MongoDB indexes reconciled", extra={'changes': index_changes})
+except Exception as e:
+    logger.exception("Index reconciliation failed")
+
+# Catalog version behind the ETag/Last-Modified of listings and categories
+from http_cache import CatalogVersion
+product_bp.catalog_version = CatalogVersion(
+    mongo.db,
+    ttl=float(os.environ.get("CATALOG_VERSION_TTL_SECONDS", 5))
+)
+
+# Facet counts of listings without a search, computed once per catalog version
+from catalog_queries import FacetCountCache
+product_bp.facet_counts = FacetCountCache(max_entries=int(os.environ.get("FACET_CACHE_SIZE", 256)))
+
+# In-process inverted index for product text search, built and refreshed in the background
+from search_index import SearchIndex
+product_bp.search_index = SearchIndex(
+    mongo.db.products,
+    refresh_interval=float(os.environ.get("SEARCH_INDEX_REFRESH_SECONDS", 30))
+)
+try:
+    product_bp.search_index.start()
+except Exception as e:
+    logger.exception("Search index failed to start")
+
+# Hashed text embeddings for similar products and profile-to-product matching, saved as
+# memory-mapped snapshots that every worker shares. A missing snapshot is built in the
+# background by whichever worker takes the lock file (or ahead with similarity_index.py build)
+from similarity_index import SimilarityIndex, DEFAULT_DIMENSIONS
+product_bp.similarity_index = SimilarityIndex(
+    mongo.db.products,
+    path=os.environ.get("SIMILARITY_INDEX_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "similarity")),
+    dimensions=int(os.environ.get("SIMILARITY_DIMENSIONS", DEFAULT_DIMENSIONS)),
+    refresh_interval=float(os.environ.get("SIMILARITY_REFRESH_SECONDS", 30))
+)
+try:
+    product_bp.similarity_index.start()
+except Exception as e:
+    logger.exception("Similarity index failed to start")
+
+# Materialized per-user recommendations, re-ranked on profile saves and catalog changes
+from recommendations import RecommendationStore
+product_bp.recommendations = style_bp.recommendations = RecommendationStore(
+    mongo.db,
+    size=int(os.environ.get("RECOMMENDATIONS_SIZE", 12)),
+    check_interval=float(os.environ.get("RECOMMENDATIONS_CATALOG_CHECK_SECONDS", 60)),
+    bulk_refresh=os.environ.get("RECOMMENDATIONS_BULK_REFRESH", "true").lower() in ("1", "true", "yes")
+)
+try:
+    product_bp.recommendations.start()
+except Exception as e:
+    logger.exception("Recommendation tracking failed to start")
+
+# Optionally serve catalog reads from an in-process replica of the products collection
+if os.environ.get("CATALOG_REPLICA", "").lower() in ("1", "true", "yes"):
+    from catalog_replica import CatalogReplica
+    product_bp.replica = CatalogReplica(
+        mongo.db.products,
+        refresh_interval=float(os.environ.get("CATALOG_REPLICA_REFRESH_SECONDS", 30))
+    )
+    try:
+        product_bp.replica.start()
+    except Exception as e:
+        logger.exception("Catalog replica failed to start")
 # Register blueprints
 app.register_blueprint(auth_bp, url_prefix='/api/auth')
 app.register_blueprint(style_bp, url_prefix='/api/style')
 app.register_blueprint(product_bp, url_prefix='/api/products')
+app.register_blueprint(cart_bp, url_prefix='/api/cart')
 # Test route
 @app.route('/api/test', methods=['GET'])
 def test_route():
@@ -71,7 +206,7 @@ def test_db():
             "data": str(result)
         })
     except Exception as e:
-        logger.error(f"Database test failed: {e}")
+        logger.exception("Database test failed")
         return jsonify({
             "message": "Database connection failed",
             "error": str(e)
@@ -108,30 +243,33 @@ def create_test_data():
        
         return jsonify({
             "message": f"Created {len(result.inserted_ids)} test products",
-            "product_ids": [str(id) for id in result.inserted_ids]
+            "product_ids": result.inserted_ids
         })
     except Exception as e:
-        logger.error(f"Error creating test data: {e}")
+        logger.exception("Error creating test data")
         return jsonify({"error": str(e)}), 500
  
 # Get all products
 @app.route('/api/products', methods=['GET'])
+@catalog_conditional('listing')
 def get_products():
     try:
-        products = list(mongo.db.products.find())
-       
-        # Convert ObjectId to string for JSON serialization
-        for product in products:
-            product['_id'] = str(product['_id'])
-            product['created_at'] = product['created_at'].isoformat()
-            product['updated_at'] = product['updated_at'].isoformat()
+        # ?format=ndjson|json streams the collection instead of building one payload
+        if request.args.get('format'):
+            return export_products()
+        
+        try:
+            projection = parse_projection(request.args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        products = list(mongo.db.products.find({}, projection))
        
         return jsonify({
             "products": products,
             "count": len(products)
         })
     except Exception as e:
-        logger.error(f"Error fetching products: {e}")
+        logger.exception("Error fetching products")
         return jsonify({"error": str(e)}), 500
    
 # In app.py - modify the seed_products function
@@ -152,7 +290,7 @@ def seed_products():
        
         return jsonify({
             "message": f"Created {len(result.inserted_ids)} test products",
-            "product_ids": [str(id) for id in result.inserted_ids]
+            "product_ids": result.inserted_ids
         })
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -0,0 +1,84 @@
+"""
+ASGI entry point serving the catalog read endpoints (see async_catalog).
+
+    hypercorn async_app:app --bind 0.0.0.0:5001 --workers 1
+
+Put it next to the WSGI app and route GET /api/products/list, /categories,
+/recommendations and /api/products/<id> to it; everything else (writes,
+auth, imports, exports, style profiles) keeps going to app.py. Both read
+MONGO_URI and JWT_SECRET_KEY, so tokens issued by one work on the other.
+"""
+import logging
+import os
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import MongoClient
+from quart import Quart
+
+# Load environment variables
+load_dotenv()
+
+# JSON records written from a background thread, like the WSGI app
+from structured_logging import configure_logging
+configure_logging()
+logger = logging.getLogger(__name__)
+
+# Initialize Quart app
+app = Quart(__name__)
+
+# Encode ObjectId/datetime natively so handlers can return MongoDB documents as-is
+from json_provider import BSONJSONProvider
+app.json = BSONJSONProvider(app)
+
+from async_catalog import async_catalog_bp, configure
+
+MONGO_URI = os.environ.get("MONGO_URI", "mongodb://localhost:27017/personashop")
+
+
+# motor clients belong to the event loop they are created on, so connect once serving starts
+@app.before_serving
+async def connect():
+    app.motor = AsyncIOMotorClient(MONGO_URI, maxPoolSize=int(os.environ.get("ASYNC_MONGO_POOL_SIZE", 100)))
+    db = app.motor.get_default_database()
+    await db.command('ping')
+    logger.info("MongoDB connected successfully!")
+
+    # The in-process search index refreshes with the sync driver, off the event loop
+    search_index = None
+    if os.environ.get("ASYNC_SEARCH_INDEX", "true").lower() in ("1", "true", "yes"):
+        from search_index import SearchIndex
+        app.sync_mongo = MongoClient(MONGO_URI)
+        search_index = SearchIndex(
+            app.sync_mongo.get_default_database().products,
+            refresh_interval=float(os.environ.get("SEARCH_INDEX_REFRESH_SECONDS", 30))
+        )
+        search_index.start()
+
+    configure(
+        db,
+        search_index=search_index,
+        catalog_version_ttl=float(os.environ.get("CATALOG_VERSION_TTL_SECONDS", 5))
+    )
+
+
+@app.after_serving
+async def disconnect():
+    app.motor.close()
+    if getattr(app, 'sync_mongo', None) is not None:
+        app.sync_mongo.close()
+
+
+# Allow every origin, like CORS(app) on the WSGI app
+@app.after_request
+async def allow_cors(response):
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    return response
+
+
+app.register_blueprint(async_catalog_bp, url_prefix='/api/products')
+
+
+@app.route('/api/test', methods=['GET'])
+async def test_route():
+    return {"message": "Async catalog is working!"}
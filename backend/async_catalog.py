@@ -0,0 +1,323 @@
+"""
+Async (ASGI) variant of the catalog read endpoints, on Quart and motor.
+
+Serves GET /list, /categories, /recommendations and /<product_id> with the
+same arguments, results and cache headers as product.py: query building
+and response bodies come from catalog_queries, cache validators from
+http_cache and the identity lookup from identity. Only the I/O differs -
+every MongoDB round trip is awaited, so one process keeps many slow or
+idle connections open without a thread per connection.
+
+CPU-bound work (search index lookups, building the style feature index)
+runs in worker threads to keep the event loop responsive. Writes, and the
+maintenance of materialized recommendations, stay with the WSGI service.
+"""
+import asyncio
+import datetime
+import os
+import time
+from functools import wraps
+
+import jwt
+from bson.objectid import ObjectId
+from quart import Blueprint, request, jsonify, make_response
+
+from catalog_queries import parse_projection, project_document, parse_listing, listing_sort, listing_response
+from catalog_queries import keyset_find, keyset_page, order_by_ids, facet_pipeline, facet_results
+from catalog_queries import match_chunks, match_projection, page_matches, merge_facet_counts
+from catalog_queries import recommendations_response, RECOMMENDATION_COUNT, DEFAULT_RECOMMENDATIONS_SORT
+from catalog_queries import catalog_wide_facets, facet_page_sort, FacetCountCache
+from http_cache import make_etag, is_not_modified, set_cache_headers, source_validators
+from identity import identity_pipeline, split_identity
+from recommendations import catalog_version_key, is_current
+from style_matching import ProductFeatureIndex, INDEX_PROJECTION
+
+# Initialize blueprint; the app attaches `db` (a motor database) and optionally
+# `search_index`, `catalog_version`, `feature_index` and `facet_counts` before serving
+async_catalog_bp = Blueprint('async_catalog', __name__)
+
+
+async def catalog_state(db):
+    """motor counterpart of catalog_replica.catalog_state: (product count, newest updated_at)"""
+    newest = await db.products.find_one({}, {'updated_at': 1}, sort=[('updated_at', -1)])
+    updated_at = newest.get('updated_at') if newest else None
+    if not isinstance(updated_at, datetime.datetime):
+        updated_at = None
+    return await db.products.count_documents({}), updated_at
+
+
+class AsyncCatalogVersion:
+    """
+    Catalog fingerprint re-read at most every `ttl` seconds, like
+    http_cache.CatalogVersion. Concurrent refreshes are coalesced into one.
+    """
+
+    def __init__(self, db, ttl=5.0):
+        self.db = db
+        self.ttl = ttl
+        self._state = None
+        self._read_at = 0.0
+        self._refreshing = None
+
+    async def state(self):
+        """(count, newest updated_at) of the catalog"""
+        if self._state is None or time.time() - self._read_at > self.ttl:
+            if self._refreshing is None:
+                self._refreshing = asyncio.ensure_future(catalog_state(self.db))
+            refreshing = self._refreshing
+            try:
+                self._state = await refreshing
+                self._read_at = time.time()
+            finally:
+                if self._refreshing is refreshing:
+                    self._refreshing = None
+        return self._state
+
+    async def get(self):
+        """(etag, last_modified) of the catalog as a whole"""
+        count, updated_at = await self.state()
+        return make_etag('catalog', count, updated_at), updated_at
+
+    async def recommendations_key(self):
+        """Catalog version as stored on materialized recommendations"""
+        return catalog_version_key(*await self.state())
+
+
+class AsyncFeatureIndex:
+    """Style feature index of the whole catalog, rebuilt when older than max_age seconds"""
+
+    def __init__(self, db, max_age=60):
+        self.db = db
+        self.max_age = max_age
+        self._index = None
+        self._built_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def get(self):
+        async with self._lock:
+            if self._index is None or time.time() - self._built_at > self.max_age:
+                products = await self.db.products.find({}, INDEX_PROJECTION).to_list(None)
+                self._index = await asyncio.to_thread(ProductFeatureIndex, products)
+                self._built_at = time.time()
+            return self._index
+
+
+# Answer conditional GETs of catalog-wide responses from the catalog version
+# before any query runs; fresh 200s get ETag/Cache-Control headers
+def catalog_conditional(kind):
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(*args, **kwargs):
+            tracker = getattr(async_catalog_bp, 'catalog_version', None)
+            if tracker is None:
+                return await view(*args, **kwargs)
+            etag, last_modified = await tracker.get()
+            # Searches may be served from the in-process index, which lags the database
+            if request.args.get('search'):
+                etag, last_modified = source_validators(etag, last_modified,
+                                                        [getattr(async_catalog_bp, 'search_index', None)])
+            if is_not_modified(etag, last_modified, request):
+                return set_cache_headers(await make_response('', 304), etag, last_modified, kind)
+            response = await make_response(await view(*args, **kwargs))
+            if response.status_code == 200:
+                set_cache_headers(response, etag, last_modified, kind)
+            return response
+        return wrapper
+    return decorator
+
+
+# Verify the Bearer token issued by the WSGI service (same JWT_SECRET_KEY) and pass
+# its identity on; errors mirror flask_jwt_extended's
+def jwt_required(view):
+    @wraps(view)
+    async def wrapper(*args, **kwargs):
+        header = request.headers.get('Authorization', '')
+        if not header:
+            return jsonify({'msg': 'Missing Authorization Header'}), 401
+        scheme, _, token = header.partition(' ')
+        if scheme != 'Bearer' or not token:
+            return jsonify({'msg': "Missing 'Bearer' type in 'Authorization' header. Expected 'Authorization: Bearer <JWT>'"}), 422
+        try:
+            claims = jwt.decode(token, async_catalog_bp.jwt_secret, algorithms=['HS256'])
+        except jwt.ExpiredSignatureError:
+            return jsonify({'msg': 'Token has expired'}), 401
+        except jwt.InvalidTokenError as e:
+            return jsonify({'msg': str(e)}), 422
+        if claims.get('type', 'access') != 'access':
+            return jsonify({'msg': 'Only non-refresh tokens are allowed'}), 422
+        return await view(claims['sub'], *args, **kwargs)
+    return wrapper
+
+
+# Fetch products by id, keeping the order of the given ids
+async def find_products_by_ids(product_ids, projection=None):
+    products = await async_catalog_bp.db.products.find({'_id': {'$in': product_ids}}, projection).to_list(None)
+    return order_by_ids(products, product_ids)
+
+
+# Get all products with filtering, sorting, and pagination
+@async_catalog_bp.route('/list', methods=['GET'])
+@catalog_conditional('listing')
+async def list_products():
+    try:
+        # Search index lookups are CPU-bound and take the index lock, so they run off the loop
+        search_index = getattr(async_catalog_bp, 'search_index', None)
+        try:
+            if request.args.get('search') and search_index is not None:
+                listing = await asyncio.to_thread(parse_listing, request.args, search_index)
+            else:
+                listing = parse_listing(request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        products_collection = async_catalog_bp.db.products
+        total_products = None
+        next_cursor = None
+        facet_counts = None
+
+        if listing['facets'] and catalog_wide_facets(listing):
+            # Counts over the whole catalog come from the per-catalog-version cache; the page
+            # itself is an indexed find
+            version, _ = await async_catalog_bp.catalog_version.get()
+            cached = async_catalog_bp.facet_counts.get(version, listing)
+            if cached is None:
+                pipeline = facet_pipeline(listing, with_products=False)
+                total, _, counts = facet_results((await products_collection.aggregate(pipeline).to_list(1))[0])
+                cached = async_catalog_bp.facet_counts.put(version, listing, (total, counts))
+            total_products, facet_counts = cached
+            products = await (products_collection.find(listing['query'], listing['projection'])
+                              .sort(facet_page_sort(listing))
+                              .skip(listing['skip'])
+                              .limit(listing['per_page'])
+                              .to_list(None))
+        elif listing['matches'] is not None:
+            # Filter every search match, the chunks of ids concurrently, then sort and page here
+            chunks = list(match_chunks(listing))
+            filtered = [doc for docs in await asyncio.gather(*(
+                products_collection.find(chunk_query, match_projection(listing)).to_list(None)
+                for chunk_query in chunks
+            )) for doc in docs]
+            try:
+                total_products, page_ids, next_cursor = page_matches(listing, filtered)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            products = await find_products_by_ids(page_ids, listing['projection'])
+            if listing['facets']:
+                results = await asyncio.gather(*(
+                    products_collection.aggregate(facet_pipeline(dict(listing, query=chunk_query), with_products=False)).to_list(1)
+                    for chunk_query in chunks
+                ))
+                total_products, facet_counts = merge_facet_counts(facet_results(result[0]) for result in results)
+        elif listing['facets']:
+            result = (await products_collection.aggregate(facet_pipeline(listing)).to_list(1))[0]
+            total_products, products, facet_counts = facet_results(result)
+        elif listing['cursor'] is not None:
+            try:
+                query, cursor_projection, sort, limit = keyset_find(listing)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            products = await products_collection.find(query, cursor_projection).sort(sort).limit(limit).to_list(None)
+            products, next_cursor = keyset_page(products, listing)
+        else:
+            # Count and page concurrently
+            total_products, products = await asyncio.gather(
+                products_collection.count_documents(listing['query']),
+                products_collection.find(listing['query'], listing['projection'])
+                .sort(listing_sort(listing))
+                .skip(listing['skip'])
+                .limit(listing['per_page'])
+                .to_list(None)
+            )
+
+        return jsonify(listing_response(listing, products, total_products, next_cursor, facet_counts))
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+# Get all product categories
+@async_catalog_bp.route('/categories', methods=['GET'])
+@catalog_conditional('categories')
+async def get_categories():
+    try:
+        categories = await async_catalog_bp.db.products.distinct('categories')
+        return jsonify({'categories': categories})
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+# Get product recommendations based on style profile
+@async_catalog_bp.route('/recommendations', methods=['GET'])
+@jwt_required
+async def get_recommendations(user_id):
+    try:
+        db = async_catalog_bp.db
+        users = await db.users.aggregate(identity_pipeline(user_id)).to_list(1)
+        _, style_profile = split_identity(users)
+
+        try:
+            projection = parse_projection(request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        # Default recommendations if no style profile
+        if not style_profile:
+            products = await (db.products.find({}, projection)
+                              .sort(DEFAULT_RECOMMENDATIONS_SORT)
+                              .limit(RECOMMENDATION_COUNT)
+                              .to_list(None))
+            return jsonify(recommendations_response(products, personalized=False))
+
+        # Serve the materialized ranking when it is current (the WSGI service keeps it up to date)
+        preferences = style_profile.get('preferences', {})
+        materialized, version = await asyncio.gather(
+            db.user_recommendations.find_one({'user_id': style_profile['user_id']}),
+            async_catalog_bp.catalog_version.recommendations_key()
+        )
+        if is_current(materialized, preferences, version):
+            products = [project_document(item['product'], projection)
+                        for item in materialized['items'][:RECOMMENDATION_COUNT]]
+        else:
+            # Stale or missing: rank the whole catalog in one pass
+            index = await async_catalog_bp.feature_index.get()
+            ranked = await asyncio.to_thread(index.top_k, preferences, RECOMMENDATION_COUNT)
+            products = await find_products_by_ids([product_id for product_id, _, _ in ranked], projection)
+
+        return jsonify(recommendations_response(products, personalized=True))
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+# Get single product by ID
+@async_catalog_bp.route('/<product_id>', methods=['GET'])
+async def get_product(product_id):
+    try:
+        if not ObjectId.is_valid(product_id):
+            return jsonify({'error': 'Invalid product id'}), 400
+        product = await async_catalog_bp.db.products.find_one({'_id': ObjectId(product_id)})
+
+        if not product:
+            return jsonify({'error': 'Product not found'}), 404
+
+        # Validators come from the document itself, so a 304 skips serialization
+        etag = make_etag(product['_id'], product.get('updated_at'))
+        if is_not_modified(etag, product.get('updated_at'), request):
+            return set_cache_headers(await make_response('', 304), etag, product.get('updated_at'), 'product')
+
+        response = await make_response(jsonify({'product': product}))
+        return set_cache_headers(response, etag, product.get('updated_at'), 'product')
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+def configure(db, jwt_secret=None, search_index=None, catalog_version_ttl=5.0, feature_index_max_age=60):
+    """Attach the motor database and the per-process helpers to the blueprint"""
+    async_catalog_bp.db = db
+    async_catalog_bp.jwt_secret = jwt_secret or os.environ.get("JWT_SECRET_KEY", "super-secret-key-change-in-production")
+    async_catalog_bp.search_index = search_index
+    async_catalog_bp.catalog_version = AsyncCatalogVersion(db, ttl=catalog_version_ttl)
+    async_catalog_bp.feature_index = AsyncFeatureIndex(db, max_age=feature_index_max_age)
+    async_catalog_bp.facet_counts = FacetCountCache()
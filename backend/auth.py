@@ -1,13 +1,18 @@
 from flask import Blueprint, request, jsonify
-from flask_bcrypt import Bcrypt
-from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
+from flask_jwt_extended import create_access_token, jwt_required
 import datetime
 from models import create_user
-from bson.objectid import ObjectId  # Add this import
+from password_hashing import HashingPoolSaturated
+from identity import current_identity
 
-# Initialize blueprint and bcrypt
+# Initialize blueprint
 auth_bp = Blueprint('auth', __name__)
-bcrypt = Bcrypt()
+
+# Response when the password hashing pool cannot take more work
+def hashing_unavailable():
+    response = jsonify({"error": "Authentication is busy, please retry shortly"})
+    response.headers['Retry-After'] = '1'
+    return response, 503
 
 # User Registration
 @auth_bp.route('/register', methods=['POST'])
@@ -30,8 +35,8 @@ def register():
         if existing_username:
             return jsonify({"error": "Username already taken"}), 409
         
-        # Hash the password
-        hashed_password = bcrypt.generate_password_hash(data['password']).decode('utf-8')
+        # Hash the password on the dedicated hashing pool
+        hashed_password = auth_bp.hasher.hash(data['password'])
         
         # Create new user object
         new_user = create_user(
@@ -45,17 +50,15 @@ def register():
         
         # Remove password from response
         new_user.pop('password', None)
-        new_user['_id'] = str(user_id)
-        
-        # Convert datetime to string
-        if 'created_at' in new_user:
-            new_user['created_at'] = new_user['created_at'].isoformat()
+        new_user['_id'] = user_id
         
         return jsonify({
             "message": "User registered successfully",
             "user": new_user
         }), 201
         
+    except HashingPoolSaturated:
+        return hashing_unavailable()
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -74,7 +77,7 @@ def login():
         user = auth_bp.mongo.db.users.find_one({'email': data['email']})
         
         # Check if user exists and password is correct
-        if user and bcrypt.check_password_hash(user['password'], data['password']):
+        if user and auth_bp.hasher.verify(user['password'], data['password']):
             # Create access token (expires in 1 day)
             expires = datetime.timedelta(days=1)
             access_token = create_access_token(
@@ -85,13 +88,15 @@ def login():
             return jsonify({
                 "message": "Login successful",
                 "token": access_token,
-                "user_id": str(user['_id']),
+                "user_id": user['_id'],
                 "username": user['username'],
                 "email": user['email']  # Add email to response
             }), 200
         else:
             return jsonify({"error": "Invalid email or password"}), 401
             
+    except HashingPoolSaturated:
+        return hashing_unavailable()
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -100,22 +105,14 @@ def login():
 @jwt_required()
 def profile():
     try:
-        # Get current user ID from JWT token
-        current_user_id = get_jwt_identity()
-        
-        # Find user in database - convert string ID to ObjectId
-        user = auth_bp.mongo.db.users.find_one({'_id': ObjectId(current_user_id)})
+        # User loaded once per request by the identity loader
+        user = current_identity().user
         
         if not user:
             return jsonify({"error": "User not found"}), 404
         
         # Remove password from response
         user.pop('password', None)
-        user['_id'] = str(user['_id'])
-        
-        # Convert datetime objects to strings for JSON serialization
-        if 'created_at' in user:
-            user['created_at'] = user['created_at'].isoformat()
         
         return jsonify({
             "user": user
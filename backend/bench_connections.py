@@ -0,0 +1,167 @@
+"""
+Measure how many concurrent client connections one server process sustains on the catalog read routes.
+
+Run the WSGI app and the ASGI catalog with the same number of worker processes:
+
+    gunicorn --workers 1 --threads 8 --bind :5000 app:app
+    hypercorn --workers 1 --bind :5001 async_app:app
+    python bench_connections.py --target wsgi=http://localhost:5000 --target asgi=http://localhost:5001 \\
+        --workers 1 --levels 50,100,200,400,800,1600 --out connections.json
+
+At each level the given number of keep-alive connections is held open, each
+looping over list/categories/detail/recommendations with --think-time
+seconds between requests (clients that stay connected but are mostly idle,
+like browsers). A level is sustained when at most --max-error-rate of the
+requests fail and their p99 latency stays under --max-p99 seconds. The
+highest sustained level divided by --workers is the per-process figure.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import random
+import sys
+import time
+
+import httpx
+import numpy as np
+
+from bench_endpoints import HTTPClient, login, git_commit
+
+
+def catalog_paths(base_url, auth):
+    """Read routes served by both deployments, with real ids and categories"""
+    listing = httpx.get(f"{base_url}/api/products/list?per_page=100&view=card").json()
+    categories = httpx.get(f"{base_url}/api/products/categories").json().get('categories') or ['clothing']
+    product_ids = [product['_id'] for product in listing.get('products', [])]
+    if not product_ids:
+        sys.exit('The catalog is empty, seed it first (python seed_data.py --products N --users M)')
+
+    paths = [
+        lambda rng: '/api/products/list?view=card',
+        lambda rng: f"/api/products/list?category={rng.choice(categories)}&view=card",
+        lambda rng: '/api/products/categories',
+        lambda rng: f"/api/products/{rng.choice(product_ids)}",
+    ]
+    if auth:
+        paths.append(lambda rng: '/api/products/recommendations')
+    return paths
+
+
+async def connection(base_url, paths, auth, deadline, think_time, timeout, seed, outcomes):
+    """One keep-alive connection issuing requests until the deadline"""
+    rng = random.Random(seed)
+    limits = httpx.Limits(max_connections=1, max_keepalive_connections=1)
+    async with httpx.AsyncClient(base_url=base_url, headers=auth, limits=limits, timeout=timeout) as client:
+        # Spread the start of the connections over the first think-time interval
+        await asyncio.sleep(rng.random() * think_time)
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                response = await client.get(rng.choice(paths)(rng))
+                ok = response.status_code < 400
+            except httpx.HTTPError:
+                ok = False
+            outcomes.append((time.perf_counter() - started, ok))
+            await asyncio.sleep(think_time)
+
+
+async def run_level(base_url, paths, auth, connections, duration, think_time, timeout):
+    outcomes = []
+    started = time.perf_counter()
+    deadline = started + duration
+    await asyncio.gather(*(
+        connection(base_url, paths, auth, deadline, think_time, timeout, seed, outcomes)
+        for seed in range(connections)
+    ))
+    elapsed = time.perf_counter() - started
+
+    if not outcomes:
+        return {'connections': connections, 'requests': 0, 'errors': 0, 'error_rate': 1.0}
+    latencies = np.array([latency for latency, _ in outcomes]) * 1000
+    errors = sum(1 for _, ok in outcomes if not ok)
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {
+        'connections': connections,
+        'requests': len(outcomes),
+        'errors': errors,
+        'error_rate': round(errors / len(outcomes), 4),
+        'throughput_rps': round(len(outcomes) / elapsed, 1),
+        'p50_ms': round(float(p50), 2),
+        'p95_ms': round(float(p95), 2),
+        'p99_ms': round(float(p99), 2)
+    }
+
+
+def sustained(result, max_error_rate, max_p99):
+    return result['error_rate'] <= max_error_rate and result.get('p99_ms', float('inf')) <= max_p99 * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--target', action='append', required=True, metavar='NAME=URL',
+                        help='deployment to measure, e.g. wsgi=http://localhost:5000 (repeatable)')
+    parser.add_argument('--workers', type=int, default=1, help='worker processes per target')
+    parser.add_argument('--levels', default='50,100,200,400,800', help='comma-separated connection counts')
+    parser.add_argument('--duration', type=float, default=20, help='seconds per level')
+    parser.add_argument('--think-time', type=float, default=1.0, help='seconds each connection idles between requests')
+    parser.add_argument('--timeout', type=float, default=10, help='per-request timeout in seconds')
+    parser.add_argument('--max-error-rate', type=float, default=0.01)
+    parser.add_argument('--max-p99', type=float, default=1.0, help='p99 latency budget in seconds')
+    parser.add_argument('--seed', type=int, default=0, help='seed used by seed_data.py')
+    parser.add_argument('--no-auth', action='store_true', help='skip the recommendations route')
+    parser.add_argument('--out', help='write results to this JSON file')
+    args = parser.parse_args()
+
+    targets = dict(target.split('=', 1) for target in args.target)
+    levels = [int(level) for level in args.levels.split(',')]
+
+    # Tokens from the WSGI app are accepted by both deployments (shared JWT secret)
+    auth = None
+    if not args.no_auth:
+        _, auth = login(HTTPClient(next(iter(targets.values()))), args.seed)
+
+    results = {}
+    for name, base_url in targets.items():
+        base_url = base_url.rstrip('/')
+        paths = catalog_paths(base_url, auth)
+        levels_run = []
+        for connections in levels:
+            result = asyncio.run(run_level(base_url, paths, auth, connections,
+                                           args.duration, args.think_time, args.timeout))
+            result['sustained'] = sustained(result, args.max_error_rate, args.max_p99)
+            levels_run.append(result)
+            print(f"{name:8s} {connections:6d} conns {result.get('throughput_rps', 0):9.1f} rps "
+                  f"p99 {result.get('p99_ms', 0):9.1f}ms err {result['error_rate']:.2%}", file=sys.stderr)
+            if not result['sustained']:
+                break
+        best = max((level['connections'] for level in levels_run if level['sustained']), default=0)
+        results[name] = {
+            'url': base_url,
+            'max_sustained_connections': best,
+            'per_process': best / args.workers,
+            'levels': levels_run
+        }
+
+    print(f"{'target':8s} {'sustained':>10s} {'per process':>12s}")
+    for name, result in results.items():
+        print(f"{name:8s} {result['max_sustained_connections']:10d} {result['per_process']:12.1f}")
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump({
+                'meta': {
+                    'commit': git_commit(),
+                    'timestamp': datetime.datetime.now().isoformat(),
+                    'workers': args.workers,
+                    'duration': args.duration,
+                    'think_time': args.think_time,
+                    'max_error_rate': args.max_error_rate,
+                    'max_p99': args.max_p99
+                },
+                'results': results
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,262 @@
+"""
+Benchmark the app's user-facing routes against a local mongod, in-process or over HTTP.
+
+    python seed_data.py --products 100000 --users 1000 --drop
+    python bench_endpoints.py --requests 500 --concurrency 8 --out before.json
+    python bench_endpoints.py --requests 500 --concurrency 8 --compare before.json
+
+Covers auth, style profiles, catalog reads (listings, search, detail,
+batch, export), recommendations and similarity, and the cart. Admin,
+import and diagnostic routes (analysis cache, LLM metrics, test and seed
+endpoints) are left out. Results (throughput and p50/p95/p99 latency per
+route) are saved as JSON together with the git commit, so runs on
+different commits can be compared.
+"""
+import argparse
+import datetime
+import json
+import random
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from seed_data import SYNTHETIC_PASSWORD, SYNTHETIC_PREFERENCES
+
+# Routes that change data, left out by --skip-writes
+WRITE_ROUTES = {'save profile', 'merge guest cart', 'add item', 'update item', 'clear cart'}
+
+# Products per batch lookup
+BATCH_IDS = 20
+
+
+class InProcessClient:
+    """Calls the Flask app directly; needs MONGO_URI to point at the benchmark database"""
+
+    name = 'in-process'
+
+    def __init__(self):
+        from app import app
+        self.app = app
+
+    def request(self, method, path, body=None, headers=None):
+        response = self.app.test_client().open(path, method=method, json=body, headers=headers)
+        return response.status_code, response.get_json(silent=True)
+
+
+class HTTPClient:
+    """Calls a running server, one keep-alive session per thread"""
+
+    def __init__(self, base_url):
+        import requests
+        self.name = base_url
+        self.base_url = base_url.rstrip('/')
+        self._requests = requests
+        self._local = threading.local()
+
+    def request(self, method, path, body=None, headers=None):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = self._requests.Session()
+        response = session.request(method, self.base_url + path, json=body, headers=headers)
+        try:
+            return response.status_code, response.json()
+        except ValueError:
+            return response.status_code, None
+
+
+def login(client, seed):
+    """Log in as the first synthetic user, registering a benchmark user when there is none"""
+    email = f"synthetic{seed}_0@example.com"
+    status, body = client.request('POST', '/api/auth/login', {'email': email, 'password': SYNTHETIC_PASSWORD})
+    if status != 200:
+        email = 'bench@example.com'
+        client.request('POST', '/api/auth/register',
+                       {'username': 'bench', 'email': email, 'password': SYNTHETIC_PASSWORD})
+        status, body = client.request('POST', '/api/auth/login', {'email': email, 'password': SYNTHETIC_PASSWORD})
+    if status != 200:
+        sys.exit(f"Could not log in as {email}: {status} {body}")
+    return email, {'Authorization': f"Bearer {body['token']}"}
+
+
+def scenarios(client, seed):
+    """(blueprint, name, method, path(rng), body(rng), authenticated) for every benchmarked route"""
+    email, auth = login(client, seed)
+    _, listing = client.request('GET', '/api/products/list?per_page=100&view=card')
+    _, categories = client.request('GET', '/api/products/categories')
+    product_ids = [product['_id'] for product in (listing or {}).get('products', [])]
+    if not product_ids:
+        sys.exit('The catalog is empty, seed it first (python seed_data.py --products N --users M)')
+    categories = (categories or {}).get('categories') or ['clothing']
+    words = sorted({word.lower() for product in listing['products'] for word in product['name'].split()})
+    # Merged into the cart before they are updated, so updates find them
+    cart_ids = product_ids[:10]
+    batch_size = min(BATCH_IDS, len(product_ids))
+
+    def random_preferences(rng):
+        return {question: rng.choice(list(answers)) for question, answers in SYNTHETIC_PREFERENCES.items()}
+
+    fixed = lambda path: (lambda rng: path)
+    none = lambda rng: None
+    return auth, [
+        ('auth', 'login', 'POST', fixed('/api/auth/login'),
+         lambda rng: {'email': email, 'password': SYNTHETIC_PASSWORD}, False),
+        ('auth', 'profile', 'GET', fixed('/api/auth/profile'), none, True),
+        ('style', 'get profile', 'GET', fixed('/api/style/profile'), none, True),
+        ('style', 'save profile', 'POST', fixed('/api/style/profile'),
+         lambda rng: {'preferences': random_preferences(rng)}, True),
+        ('product', 'list newest', 'GET', fixed('/api/products/list'), none, False),
+        ('product', 'list card view', 'GET', fixed('/api/products/list?view=card'), none, False),
+        ('product', 'list deep page', 'GET', lambda rng: f"/api/products/list?page={rng.randint(50, 200)}", none, False),
+        ('product', 'list by category', 'GET',
+         lambda rng: f"/api/products/list?category={rng.choice(categories)}", none, False),
+        ('product', 'list by price range', 'GET',
+         lambda rng: f"/api/products/list?min_price=20&max_price={rng.randint(40, 200)}&sort_by=price&sort_order=asc",
+         none, False),
+        ('product', 'list cursor', 'GET', fixed('/api/products/list?cursor=&sort_by=price'), none, False),
+        ('product', 'list facets', 'GET',
+         lambda rng: f"/api/products/list?facets=true&category={rng.choice(categories)}", none, False),
+        ('product', 'search', 'GET', lambda rng: f"/api/products/list?search={rng.choice(words)}", none, False),
+        ('product', 'search by relevance', 'GET',
+         lambda rng: f"/api/products/list?search={rng.choice(words)}&sort_by=relevance", none, False),
+        ('product', 'categories', 'GET', fixed('/api/products/categories'), none, False),
+        ('product', 'product detail', 'GET', lambda rng: f"/api/products/{rng.choice(product_ids)}", none, False),
+        ('product', 'product style match', 'GET',
+         lambda rng: f"/api/products/{rng.choice(product_ids)}/with-style-match", none, True),
+        ('product', 'recommendations', 'GET', fixed('/api/products/recommendations'), none, True),
+        ('product', 'similar products', 'GET',
+         lambda rng: f"/api/products/{rng.choice(product_ids)}/similar?view=card", none, False),
+        ('product', 'profile matches', 'GET', fixed('/api/products/profile-matches?view=card'), none, True),
+        ('product', 'batch style match', 'POST', fixed('/api/products/style-match'),
+         lambda rng: {'limit': 10}, True),
+        ('product', 'batch by ids', 'GET',
+         lambda rng: f"/api/products/batch?view=card&ids={','.join(rng.sample(product_ids, batch_size))}", none, False),
+        ('product', 'batch by ids (POST)', 'POST', fixed('/api/products/batch'),
+         lambda rng: {'ids': rng.sample(product_ids, batch_size), 'view': 'card'}, False),
+        ('product', 'export ndjson', 'GET', fixed('/api/products/export?format=ndjson&view=card'), none, False),
+        ('app', 'all products', 'GET', fixed('/api/products?view=card'), none, False),
+        ('app', 'all products streamed', 'GET', fixed('/api/products?format=json&view=card'), none, False),
+        ('cart', 'get cart', 'GET', fixed('/api/cart'), none, True),
+        ('cart', 'merge guest cart', 'POST', fixed('/api/cart/merge'),
+         lambda rng: {'items': [{'product_id': pid, 'quantity': 1} for pid in rng.sample(cart_ids, min(3, len(cart_ids)))]}, True),
+        ('cart', 'add item', 'POST', fixed('/api/cart/items'),
+         lambda rng: {'product_id': rng.choice(product_ids), 'quantity': 1}, True),
+        ('cart', 'update item', 'PUT', lambda rng: f"/api/cart/items/{rng.choice(cart_ids)}",
+         lambda rng: {'quantity': rng.randint(1, 5)}, True),
+        ('cart', 'clear cart', 'DELETE', fixed('/api/cart'), none, True),
+    ]
+
+
+def run_scenario(client, scenario, auth, requests, concurrency, warmup, seed):
+    _, _, method, path, body, authenticated = scenario
+    headers = auth if authenticated else None
+    rng = random.Random(seed)
+    calls = [(path(rng), body(rng)) for _ in range(warmup + requests)]
+
+    for call_path, call_body in calls[:warmup]:
+        client.request(method, call_path, call_body, headers)
+
+    def timed(call):
+        started = time.perf_counter()
+        status, _ = client.request(method, call[0], call[1], headers)
+        return time.perf_counter() - started, status
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        outcomes = list(executor.map(timed, calls[warmup:]))
+    elapsed = time.perf_counter() - started
+
+    latencies = np.array([latency for latency, _ in outcomes]) * 1000
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {
+        'requests': requests,
+        'errors': sum(1 for _, status in outcomes if status >= 400),
+        'throughput_rps': round(requests / elapsed, 1),
+        'mean_ms': round(float(latencies.mean()), 2),
+        'p50_ms': round(float(p50), 2),
+        'p95_ms': round(float(p95), 2),
+        'p99_ms': round(float(p99), 2),
+        'max_ms': round(float(latencies.max()), 2)
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results, previous=None):
+    header = f"{'route':32s} {'rps':>9s} {'p50':>9s} {'p95':>9s} {'p99':>9s} {'err':>5s}"
+    print(header + ('   p50 vs base   p95 vs base' if previous else ''))
+    for name, result in results.items():
+        line = (f"{name:32s} {result['throughput_rps']:9.1f} {result['p50_ms']:8.1f}ms "
+                f"{result['p95_ms']:8.1f}ms {result['p99_ms']:8.1f}ms {result['errors']:5d}")
+        base = (previous or {}).get(name)
+        if base:
+            line += ''.join(f"   {(result[key] / base[key] - 1) * 100 if base[key] else 0:+10.1f}%"
+                            for key in ('p50_ms', 'p95_ms'))
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--base-url', help='benchmark a running server instead of the app in-process')
+    parser.add_argument('--requests', type=int, default=200, help='measured requests per route')
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=0, help='seed used by seed_data.py')
+    parser.add_argument('--only', help='comma-separated blueprints or route names to run')
+    parser.add_argument('--skip-writes', action='store_true', help='skip routes that write (profile saves, cart)')
+    parser.add_argument('--out', help='write results to this JSON file')
+    parser.add_argument('--compare', help='earlier results JSON to compare against')
+    args = parser.parse_args()
+
+    if not args.base_url:
+        from dotenv import load_dotenv
+        load_dotenv()
+    client = HTTPClient(args.base_url) if args.base_url else InProcessClient()
+    auth, routes = scenarios(client, args.seed)
+
+    selected = set(args.only.split(',')) if args.only else None
+    results = {}
+    for scenario in routes:
+        blueprint, name, method = scenario[:3]
+        if selected and blueprint not in selected and name not in selected:
+            continue
+        if args.skip_writes and name in WRITE_ROUTES:
+            continue
+        results[f"{blueprint}: {name}"] = run_scenario(
+            client, scenario, auth, args.requests, args.concurrency, args.warmup, args.seed
+        )
+        print(f"{blueprint}: {name} done", file=sys.stderr)
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)['results']
+    print_results(results, previous)
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump({
+                'meta': {
+                    'commit': git_commit(),
+                    'timestamp': datetime.datetime.now().isoformat(),
+                    'target': client.name,
+                    'requests': args.requests,
+                    'warmup': args.warmup,
+                    'concurrency': args.concurrency,
+                    'seed': args.seed
+                },
+                'results': results
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
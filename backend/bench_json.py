@@ -0,0 +1,82 @@
+"""
+Micro-benchmark: serializing product listings before and after BSONJSONProvider.
+
+    python bench_json.py [--products 10000] [--repeat 5]
+"""
+import argparse
+import time
+
+from bson.objectid import ObjectId
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+import json_provider
+from json_provider import BSONJSONProvider
+from seed_data import generate_test_products
+
+
+def make_products(count):
+    """`count` product documents as they come out of MongoDB"""
+    templates = generate_test_products()
+    products = []
+    for i in range(count):
+        product = dict(templates[i % len(templates)])
+        product['_id'] = ObjectId()
+        products.append(product)
+    return products
+
+
+def format_products(products):
+    """The per-document formatting loop handlers used before the custom provider"""
+    formatted = []
+    for product in products:
+        product = dict(product)
+        product['_id'] = str(product['_id'])
+        if 'created_at' in product:
+            product['created_at'] = product['created_at'].isoformat()
+        if 'updated_at' in product:
+            product['updated_at'] = product['updated_at'].isoformat()
+        formatted.append(product)
+    return formatted
+
+
+def best_of(repeat, fn):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--products', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    default_provider = DefaultJSONProvider(app)
+    bson_provider = BSONJSONProvider(app)
+    products = make_products(args.products)
+    compact = {'separators': (',', ':')}
+
+    cases = [
+        ('before: format loop + stdlib json',
+         lambda: default_provider.dumps({'products': format_products(products)}, **compact)),
+        ('after: BSONJSONProvider (stdlib)',
+         lambda: DefaultJSONProvider.dumps(bson_provider, {'products': products}, **compact)),
+    ]
+    if json_provider.orjson is not None:
+        cases.append(('after: BSONJSONProvider (orjson)',
+                      lambda: bson_provider.dumps({'products': products}, **compact)))
+
+    baseline = None
+    for name, fn in cases:
+        seconds = best_of(args.repeat, fn)
+        baseline = baseline or seconds
+        print(f"{name:40s} {seconds * 1000:8.1f} ms  {args.products / seconds:12,.0f} docs/s  x{baseline / seconds:.1f}")
+
+
+if __name__ == '__main__':
+    main()
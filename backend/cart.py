@@ -0,0 +1,246 @@
+from flask import Blueprint, request, jsonify
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from bson.objectid import ObjectId
+from bson.errors import InvalidId
+from pymongo.errors import DuplicateKeyError
+import datetime
+
+# Initialize blueprint
+cart_bp = Blueprint('cart', __name__)
+
+# Carts are bounded so a cart document never grows without limit
+MAX_CART_ITEMS = 100
+MAX_ITEM_QUANTITY = 99
+
+# Product fields a cart line needs
+CART_PRODUCT_PROJECTION = {'name': 1, 'price': 1, 'image_url': 1, 'description': 1}
+
+# Parse and validate a product id and quantity from a request
+def parse_item(product_id, quantity, allow_zero=False):
+    try:
+        product_id = ObjectId(product_id)
+    except (InvalidId, TypeError):
+        raise ValueError('Invalid product_id')
+    try:
+        quantity = int(quantity)
+    except (TypeError, ValueError):
+        raise ValueError('quantity must be an integer')
+    if quantity < (0 if allow_zero else 1) or quantity > MAX_ITEM_QUANTITY:
+        raise ValueError(f"quantity must be between {0 if allow_zero else 1} and {MAX_ITEM_QUANTITY}")
+    return product_id, quantity
+
+# Add quantity of a product to a cart: $inc an existing line or $push a new one
+# (creating the cart on first use). Returns False when the cart is full. A line never
+# goes past MAX_ITEM_QUANTITY: it is capped there with clamp, otherwise ValueError.
+def add_item(carts, user_id, product_id, quantity, clamp=False):
+    now = datetime.datetime.now()
+    for _ in range(2):
+        # Only matches while the line has room for the quantity
+        result = carts.update_one(
+            {'user_id': user_id, 'items': {'$elemMatch': {
+                'product_id': product_id,
+                'quantity': {'$lte': MAX_ITEM_QUANTITY - quantity}
+            }}},
+            {'$inc': {'items.$.quantity': quantity}, '$set': {'updated_at': now}}
+        )
+        if result.matched_count:
+            return True
+        try:
+            # Only matches when the line is still missing and the cart has room;
+            # otherwise the upsert collides with the unique user_id index
+            carts.update_one(
+                {
+                    'user_id': user_id,
+                    'items.product_id': {'$ne': product_id},
+                    f'items.{MAX_CART_ITEMS - 1}': {'$exists': False}
+                },
+                {
+                    '$push': {'items': {'product_id': product_id, 'quantity': quantity, 'added_at': now}},
+                    '$set': {'updated_at': now},
+                    '$setOnInsert': {'created_at': now}
+                },
+                upsert=True
+            )
+            return True
+        except DuplicateKeyError:
+            # The line exists without room for the quantity, another request added it
+            # first (retry the $inc), or the cart is full
+            cart = carts.find_one(
+                {'user_id': user_id, 'items.product_id': product_id},
+                {'items': {'$elemMatch': {'product_id': product_id}}}
+            )
+            if cart and cart['items'][0]['quantity'] + quantity > MAX_ITEM_QUANTITY:
+                if not clamp:
+                    raise ValueError(f"A cart holds at most {MAX_ITEM_QUANTITY} of each product")
+                carts.update_one(
+                    {'user_id': user_id, 'items.product_id': product_id},
+                    {'$set': {'items.$.quantity': MAX_ITEM_QUANTITY, 'updated_at': now}}
+                )
+                return True
+    return False
+
+# Price a cart with one $in lookup against the products collection
+def price_cart(cart):
+    items = cart.get('items', []) if cart else []
+    products = {
+        product['_id']: product
+        for product in cart_bp.mongo.db.products.find(
+            {'_id': {'$in': [item['product_id'] for item in items]}},
+            CART_PRODUCT_PROJECTION
+        )
+    } if items else {}
+
+    lines = []
+    unavailable = []
+    subtotal = 0.0
+    for item in items:
+        product = products.get(item['product_id'])
+        if not product:
+            unavailable.append(item['product_id'])
+            continue
+        line_total = round(product.get('price', 0) * item['quantity'], 2)
+        subtotal += line_total
+        lines.append(dict(product, quantity=item['quantity'], line_total=line_total))
+
+    return {
+        'items': lines,
+        'unavailable': unavailable,
+        'item_count': sum(line['quantity'] for line in lines),
+        'subtotal': round(subtotal, 2),
+        'updated_at': cart.get('updated_at') if cart else None
+    }
+
+# Current user's cart, priced
+def cart_response(user_id, status=200):
+    cart = cart_bp.mongo.db.carts.find_one({'user_id': user_id})
+    return jsonify({'cart': price_cart(cart)}), status
+
+# Get the current user's cart
+@cart_bp.route('', methods=['GET'])
+@jwt_required()
+def get_cart():
+    try:
+        return cart_response(ObjectId(get_jwt_identity()))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Add a product to the cart, or increase its quantity
+@cart_bp.route('/items', methods=['POST'])
+@jwt_required()
+def add_to_cart():
+    try:
+        user_id = ObjectId(get_jwt_identity())
+        data = request.get_json(silent=True) or {}
+        try:
+            product_id, quantity = parse_item(data.get('product_id'), data.get('quantity', 1))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        if not cart_bp.mongo.db.products.find_one({'_id': product_id}, {'_id': 1}):
+            return jsonify({'error': 'Product not found'}), 404
+
+        try:
+            added = add_item(cart_bp.mongo.db.carts, user_id, product_id, quantity)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if not added:
+            return jsonify({'error': f"Cart is limited to {MAX_CART_ITEMS} products"}), 409
+
+        return cart_response(user_id)
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Set the quantity of a product in the cart (0 removes it)
+@cart_bp.route('/items/<product_id>', methods=['PUT'])
+@jwt_required()
+def update_cart_item(product_id):
+    try:
+        user_id = ObjectId(get_jwt_identity())
+        data = request.get_json(silent=True) or {}
+        try:
+            product_id, quantity = parse_item(product_id, data.get('quantity'), allow_zero=True)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        now = datetime.datetime.now()
+        if quantity == 0:
+            result = cart_bp.mongo.db.carts.update_one(
+                {'user_id': user_id, 'items.product_id': product_id},
+                {'$pull': {'items': {'product_id': product_id}}, '$set': {'updated_at': now}}
+            )
+        else:
+            result = cart_bp.mongo.db.carts.update_one(
+                {'user_id': user_id, 'items.product_id': product_id},
+                {'$set': {'items.$.quantity': quantity, 'updated_at': now}}
+            )
+        if not result.matched_count:
+            return jsonify({'error': 'Product not in cart'}), 404
+
+        return cart_response(user_id)
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Remove a product from the cart
+@cart_bp.route('/items/<product_id>', methods=['DELETE'])
+@jwt_required()
+def remove_cart_item(product_id):
+    try:
+        user_id = ObjectId(get_jwt_identity())
+        try:
+            product_id = ObjectId(product_id)
+        except InvalidId:
+            return jsonify({'error': 'Invalid product_id'}), 400
+
+        cart_bp.mongo.db.carts.update_one(
+            {'user_id': user_id},
+            {'$pull': {'items': {'product_id': product_id}}, '$set': {'updated_at': datetime.datetime.now()}}
+        )
+        return cart_response(user_id)
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Empty the cart
+@cart_bp.route('', methods=['DELETE'])
+@jwt_required()
+def clear_cart():
+    try:
+        user_id = ObjectId(get_jwt_identity())
+        cart_bp.mongo.db.carts.update_one(
+            {'user_id': user_id},
+            {'$set': {'items': [], 'updated_at': datetime.datetime.now()}}
+        )
+        return cart_response(user_id)
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Merge a guest (browser) cart into the user's cart after login
+@cart_bp.route('/merge', methods=['POST'])
+@jwt_required()
+def merge_cart():
+    try:
+        user_id = ObjectId(get_jwt_identity())
+        data = request.get_json(silent=True) or {}
+        try:
+            items = [parse_item(item.get('product_id'), item.get('quantity', 1)) for item in data.get('items', [])]
+        except (ValueError, AttributeError) as e:
+            return jsonify({'error': str(e)}), 400
+
+        # Skip products that no longer exist
+        existing = {
+            product['_id'] for product in cart_bp.mongo.db.products.find(
+                {'_id': {'$in': [product_id for product_id, _ in items]}}, {'_id': 1}
+            )
+        } if items else set()
+        # Quantities already in the cart plus the guest's are capped at MAX_ITEM_QUANTITY
+        for product_id, quantity in items:
+            if product_id in existing:
+                add_item(cart_bp.mongo.db.carts, user_id, product_id, quantity, clamp=True)
+
+        return cart_response(user_id)
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
@@ -0,0 +1,83 @@
+import datetime
+import zlib
+
+# Documents fetched from MongoDB per round trip while exporting
+DEFAULT_BATCH_SIZE = 1000
+
+# Encoded output is buffered up to this size before it is written to the client
+CHUNK_SIZE = 64 * 1024
+
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'json': 'application/json',
+}
+
+
+def parse_updated_since(value):
+    """ISO 8601 timestamp -> naive local datetime like the stored updated_at values (ValueError if invalid)"""
+    try:
+        since = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except (AttributeError, ValueError):
+        raise ValueError(f"Invalid updated_since '{value}', expected an ISO 8601 timestamp")
+    if since.tzinfo is not None:
+        since = since.astimezone().replace(tzinfo=None)
+    return since
+
+
+def export_cursor(collection, updated_since=None, projection=None, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Products changed at or after updated_since (all without it), oldest change
+    first, so a consumer can resume from the last updated_at it received.
+    """
+    query = {'updated_at': {'$gte': updated_since}} if updated_since else {}
+    return (collection.find(query, projection)
+            .sort([('updated_at', 1), ('_id', 1)])
+            .batch_size(batch_size))
+
+
+def _buffered(pieces, chunk_size=CHUNK_SIZE):
+    buffer = []
+    size = 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= chunk_size:
+            yield b''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def iter_ndjson(documents, dumps):
+    """One JSON document per line"""
+    return _buffered(dumps(document).encode('utf-8') + b'\n' for document in documents)
+
+
+def iter_json_array(documents, dumps):
+    """A single JSON array, produced element by element"""
+    def pieces():
+        yield b'['
+        for index, document in enumerate(documents):
+            yield (b',' if index else b'') + dumps(document).encode('utf-8')
+        yield b']'
+    return _buffered(pieces())
+
+
+def gzip_chunks(chunks, level=6):
+    """
+    Gzip a stream of chunks. Each chunk is sync-flushed, so the client can
+    decode everything received so far instead of waiting for the end.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def encode_export(documents, data_format, dumps, compress=False):
+    """Byte chunks of the export in the given format, optionally gzipped"""
+    chunks = iter_ndjson(documents, dumps) if data_format == 'ndjson' else iter_json_array(documents, dumps)
+    return gzip_chunks(chunks) if compress else chunks
@@ -0,0 +1,287 @@
+"""
+Streaming bulk import of products, upserted by SKU.
+
+    python catalog_import.py products.ndjson
+    python catalog_import.py products.csv --batch-size 5000 --resume
+
+NDJSON rows are product objects; CSV rows use the product fields as
+columns, `|`-separated categories and `attributes.<name>` columns.
+"""
+import argparse
+import csv
+import datetime
+import io
+import json
+import os
+import sys
+import time
+
+from pymongo import UpdateOne
+
+from models import create_product
+
+DEFAULT_BATCH_SIZE = 1000
+
+# Largest batch_size the import endpoint accepts; each batch is one bulk write held in memory
+MAX_BATCH_SIZE = 10000
+
+# Keep the report readable on catalogs with many bad rows
+MAX_REPORTED_ERRORS = 50
+
+
+class InvalidRow(ValueError):
+    """Raised for a row that cannot be turned into a product"""
+
+
+# Readers: yield (line number, raw row) one at a time
+
+def read_ndjson(stream):
+    for line_number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except json.JSONDecodeError as e:
+            yield line_number, InvalidRow(f"Invalid JSON: {e.msg}")
+
+
+def read_csv(stream):
+    reader = csv.DictReader(stream)
+    for row in reader:
+        attributes = {}
+        product = {}
+        for column, value in row.items():
+            if column is None or value in (None, ''):
+                continue
+            if column.startswith('attributes.'):
+                attributes[column[len('attributes.'):]] = value
+            elif column == 'categories':
+                product['categories'] = [category.strip() for category in value.split('|') if category.strip()]
+            else:
+                product[column] = value
+        product['attributes'] = attributes
+        yield reader.line_num, product
+
+
+READERS = {
+    'ndjson': read_ndjson,
+    'csv': read_csv
+}
+
+
+def detect_format(filename):
+    return 'csv' if filename.lower().endswith('.csv') else 'ndjson'
+
+
+def validate_product(row):
+    """Shape a raw row like models.create_product (plus its SKU), or raise InvalidRow"""
+    if isinstance(row, InvalidRow):
+        raise row
+    if not isinstance(row, dict):
+        raise InvalidRow('Row is not an object')
+
+    sku = str(row.get('sku') or '').strip()
+    name = str(row.get('name') or '').strip()
+    if not sku:
+        raise InvalidRow('Missing sku')
+    if not name:
+        raise InvalidRow('Missing name')
+
+    try:
+        price = float(row.get('price'))
+    except (TypeError, ValueError):
+        raise InvalidRow(f"Invalid price: {row.get('price')!r}")
+    if price < 0 or price != price:
+        raise InvalidRow(f"Invalid price: {row.get('price')!r}")
+
+    categories = row.get('categories') or []
+    if isinstance(categories, str):
+        categories = [categories]
+    if not isinstance(categories, list) or not all(isinstance(c, str) for c in categories):
+        raise InvalidRow('categories must be a list of strings')
+
+    attributes = row.get('attributes') or {}
+    if not isinstance(attributes, dict):
+        raise InvalidRow('attributes must be an object')
+
+    product = create_product(
+        name=name,
+        description=str(row.get('description') or ''),
+        price=price,
+        image_url=str(row.get('image_url') or ''),
+        categories=categories,
+        attributes=attributes
+    )
+    product['sku'] = sku
+    return product
+
+
+def upsert_operations(products):
+    """One upsert per SKU (the last row wins), keeping created_at of existing products"""
+    latest = {}
+    for product in products:
+        latest[product['sku']] = product
+    operations = []
+    for sku, product in latest.items():
+        fields = dict(product)
+        created_at = fields.pop('created_at')
+        operations.append(UpdateOne(
+            {'sku': sku},
+            {'$set': fields, '$setOnInsert': {'created_at': created_at}},
+            upsert=True
+        ))
+    return operations
+
+
+class FileCheckpoint:
+    """Last committed line number, kept next to the imported file"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f).get('line', 0)
+        except FileNotFoundError:
+            return 0
+
+    def save(self, line_number):
+        with open(self.path, 'w') as f:
+            json.dump({'line': line_number, 'saved_at': datetime.datetime.now().isoformat()}, f)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class MongoCheckpoint:
+    """Last committed line number of a named import, in the `catalog_imports` collection"""
+
+    def __init__(self, collection, import_id):
+        self.collection = collection
+        self.import_id = import_id
+
+    def load(self):
+        checkpoint = self.collection.find_one({'_id': self.import_id})
+        return checkpoint.get('line', 0) if checkpoint else 0
+
+    def save(self, line_number):
+        self.collection.update_one(
+            {'_id': self.import_id},
+            {'$set': {'line': line_number, 'saved_at': datetime.datetime.now()}},
+            upsert=True
+        )
+
+    def clear(self):
+        self.collection.delete_one({'_id': self.import_id})
+
+
+def import_products(collection, rows, batch_size=DEFAULT_BATCH_SIZE, checkpoint=None, progress=None):
+    """
+    Validate and upsert (line number, row) pairs in unordered bulk writes of
+    batch_size. Rows at or before the checkpoint's line are skipped, and the
+    checkpoint advances after every committed batch, so a failed import can
+    be resumed. progress(report) is called after each batch. Returns the report.
+    """
+    resume_after = checkpoint.load() if checkpoint else 0
+    report = {
+        'resumed_after_line': resume_after,
+        'read': 0,
+        'skipped': 0,
+        'invalid': 0,
+        'written': 0,
+        'upserted': 0,
+        'modified': 0,
+        'errors': [],
+        'last_line': resume_after,
+        'seconds': 0.0,
+        'docs_per_second': 0.0
+    }
+    started = time.perf_counter()
+
+    def write(batch, last_line):
+        if batch:
+            result = collection.bulk_write(upsert_operations(batch), ordered=False)
+            report['written'] += len(batch)
+            report['upserted'] += result.upserted_count
+            report['modified'] += result.modified_count
+        report['last_line'] = last_line
+        if checkpoint:
+            checkpoint.save(last_line)
+        report['seconds'] = time.perf_counter() - started
+        report['docs_per_second'] = round(report['written'] / report['seconds'], 1) if report['seconds'] else 0.0
+        if progress:
+            progress(report)
+
+    batch = []
+    line_number = resume_after
+    for line_number, row in rows:
+        if line_number <= resume_after:
+            report['skipped'] += 1
+            continue
+        report['read'] += 1
+        try:
+            batch.append(validate_product(row))
+        except InvalidRow as e:
+            report['invalid'] += 1
+            if len(report['errors']) < MAX_REPORTED_ERRORS:
+                report['errors'].append({'line': line_number, 'error': str(e)})
+        if len(batch) >= batch_size:
+            write(batch, line_number)
+            batch = []
+
+    write(batch, line_number)
+    if checkpoint:
+        checkpoint.clear()
+    return report
+
+
+def import_stream(collection, stream, data_format, **kwargs):
+    """Import a text stream in the given format ('ndjson' or 'csv')"""
+    if data_format not in READERS:
+        raise ValueError(f"Unknown format '{data_format}', expected one of: {', '.join(READERS)}")
+    return import_products(collection, READERS[data_format](stream), **kwargs)
+
+
+def text_stream(binary_stream):
+    """Decode a binary stream (e.g. a request body) lazily as UTF-8 lines"""
+    return io.TextIOWrapper(binary_stream, encoding='utf-8', newline='')
+
+
+def print_progress(report):
+    print(f"line {report['last_line']:>10,}  written {report['written']:>10,}  upserted {report['upserted']:>10,}  "
+          f"modified {report['modified']:>10,}  invalid {report['invalid']:>6,}  "
+          f"{report['docs_per_second']:>10,.0f} docs/s", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+
+    parser = argparse.ArgumentParser(description='Stream an NDJSON or CSV catalog into the products collection')
+    parser.add_argument('path', help="file to import, '-' for stdin")
+    parser.add_argument('--format', choices=sorted(READERS), default=None)
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--resume', action='store_true', help='continue after the last committed line')
+    args = parser.parse_args()
+
+    load_dotenv()
+    db = MongoClient(os.environ.get('MONGO_URI', 'mongodb://localhost:27017/personashop')).get_default_database()
+
+    data_format = args.format or detect_format(args.path)
+    checkpoint = None
+    if args.path != '-':
+        checkpoint = FileCheckpoint(args.path + '.checkpoint')
+        if not args.resume:
+            checkpoint.clear()
+
+    stream = sys.stdin if args.path == '-' else open(args.path, encoding='utf-8', newline='')
+    with stream:
+        report = import_stream(db.products, stream, data_format,
+                               batch_size=args.batch_size, checkpoint=checkpoint, progress=print_progress)
+
+    for error in report['errors']:
+        print(f"line {error['line']}: {error['error']}", file=sys.stderr)
+    print(json.dumps({key: value for key, value in report.items() if key != 'errors'}, indent=2))
@@ -0,0 +1,511 @@
+"""
+Query building and response shaping for catalog reads.
+
+Nothing in here talks to MongoDB: the functions turn request arguments into
+filters, sorts, cursors and aggregation pipelines, and turn query results
+into response bodies. The WSGI blueprint (product.py, pymongo) and the ASGI
+one (async_catalog.py, motor) run them against their own driver, so both
+serve identical results for identical requests.
+"""
+import base64
+import binascii
+import re
+import threading
+from collections import OrderedDict
+
+from bson import json_util
+
+DEFAULT_PER_PAGE = 12
+
+# Products in a recommendations response
+RECOMMENDATION_COUNT = 6
+
+# Order of the fallback recommendations for users without a style profile
+DEFAULT_RECOMMENDATIONS_SORT = [('created_at', -1)]
+
+# Named field sets for ?view=; 'card' is what ProductCard renders
+PRODUCT_VIEWS = {
+    'card': ['name', 'price', 'image_url'],
+    'full': None
+}
+
+FIELD_NAME_RE = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)*$')
+
+# Facets returned by ?facets=true: response key -> product field
+FACET_FIELDS = {
+    'categories': 'categories',
+    'color': 'attributes.color',
+    'material': 'attributes.material'
+}
+
+# Search matches per `_id $in` query: the other filters are applied to every match,
+# one chunk of ids at a time, so the query size stays bounded for broad searches
+MATCH_CHUNK_SIZE = 1000
+
+# Lower bounds of the price histogram buckets; the last bucket is open-ended
+PRICE_BUCKETS = [0, 25, 50, 100, 200, 500]
+
+
+def parse_projection(args):
+    """MongoDB projection from ?fields=a,b.c or ?view=card|full (None means every field)"""
+    fields = args.get('fields', None)
+    view = args.get('view', None)
+
+    if fields:
+        names = [name.strip() for name in fields.split(',') if name.strip()]
+        invalid = [name for name in names if not FIELD_NAME_RE.match(name)]
+        if invalid:
+            raise ValueError(f"Invalid fields: {', '.join(invalid)}")
+    elif view:
+        if view not in PRODUCT_VIEWS:
+            raise ValueError(f"Unknown view '{view}', expected one of: {', '.join(PRODUCT_VIEWS)}")
+        names = PRODUCT_VIEWS[view]
+    else:
+        names = None
+
+    return {name: 1 for name in names} if names else None
+
+
+def project_document(document, projection):
+    """Apply a projection to an in-memory document (e.g. from the catalog replica)"""
+    if not projection:
+        return document
+    projected = {'_id': document['_id']}
+    for path in projection:
+        keys = path.split('.')
+        source, target = document, projected
+        for key in keys[:-1]:
+            source = source.get(key) if isinstance(source, dict) else None
+            if not isinstance(source, dict):
+                break
+            target = target.setdefault(key, {})
+        else:
+            if keys[-1] in source:
+                target[keys[-1]] = source[keys[-1]]
+    return projected
+
+
+def get_field(document, path):
+    """Read a possibly dotted field (e.g. attributes.color) from a document"""
+    value = document
+    for key in path.split('.'):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+
+def encode_cursor(last_value, last_id, sort_by, sort_direction):
+    """Encode the (sort value, _id) of the last product on a page as an opaque cursor"""
+    payload = json_util.dumps([sort_by, sort_direction, last_value, last_id])
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor, sort_by, sort_direction):
+    """Decode a cursor, checking it was issued for the same sort"""
+    try:
+        payload = json_util.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        cursor_sort_by, cursor_direction, last_value, last_id = payload
+    except (ValueError, TypeError, binascii.Error):
+        raise ValueError('Invalid cursor')
+    if cursor_sort_by != sort_by or cursor_direction != sort_direction:
+        raise ValueError('Cursor does not match sort_by/sort_order')
+    return last_value, last_id
+
+
+def keyset_filter(sort_by, sort_direction, last_value, last_id):
+    """Filter for documents that come after (last_value, last_id) in the given sort"""
+    id_op = '$lt' if sort_direction == -1 else '$gt'
+    # Missing/null values sort lowest: first when ascending, last when descending
+    if last_value is None:
+        # Ascending moves on to any non-null value; descending has only the rest of the null group left
+        after = [] if sort_direction == -1 else [{sort_by: {'$ne': None}}]
+    elif sort_direction == -1:
+        # Comparisons never match null, so the null group that follows is listed explicitly
+        after = [{sort_by: {'$lt': last_value}}, {sort_by: None}]
+    else:
+        after = [{sort_by: {'$gt': last_value}}]
+    return {'$or': after + [{sort_by: last_value, '_id': {id_op: last_id}}]}
+
+
+def _float_arg(args, name):
+    value = args.get(name, None)
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError(f"{name} must be a number")
+
+
+def _int_arg(args, name, default, minimum=1):
+    try:
+        value = int(args.get(name, default))
+    except ValueError:
+        raise ValueError(f"{name} must be an integer")
+    if value < minimum:
+        raise ValueError(f"{name} must be at least {minimum}")
+    return value
+
+
+def parse_listing(args, search_index=None):
+    """
+    Everything a /list request asks for, as a dict: the MongoDB filter,
+    sort, paging mode and projection. Text search goes through the
+    inverted index when one is given and built, otherwise it falls back to
+    a regex. Index matches are not part of the MongoDB filter: they are
+    filtered in chunks (match_chunks) and paged by page_matches. Raises
+    ValueError for malformed arguments.
+    """
+    listing = {
+        'category': args.get('category', None),
+        'min_price': _float_arg(args, 'min_price'),
+        'max_price': _float_arg(args, 'max_price'),
+        'color': args.get('color', None),
+        'material': args.get('material', None),
+        'search': args.get('search', None),
+        'page': _int_arg(args, 'page', 1),
+        'per_page': _int_arg(args, 'per_page', DEFAULT_PER_PAGE),
+        # Faceted mode adds per-facet counts to the page
+        'facets': args.get('facets', '').lower() in ('1', 'true', 'yes'),
+        # Keyset pagination: an opaque cursor replaces page, an empty one starts at the top
+        'cursor': args.get('cursor', None),
+        'projection': parse_projection(args),
+        'matches': None
+    }
+    listing['skip'] = (listing['page'] - 1) * listing['per_page']
+
+    query = {}
+    if listing['category']:
+        query['categories'] = listing['category']
+    if listing['color']:
+        query['attributes.color'] = listing['color']
+    if listing['material']:
+        query['attributes.material'] = listing['material']
+    if listing['min_price'] is not None or listing['max_price'] is not None:
+        price_query = {}
+        if listing['min_price'] is not None:
+            price_query['$gte'] = listing['min_price']
+        if listing['max_price'] is not None:
+            price_query['$lte'] = listing['max_price']
+        query['price'] = price_query
+
+    search = listing['search']
+    if search and search_index is not None:
+        listing['matches'] = search_index.search(search)
+    if listing['matches'] is None and search:
+        query['$or'] = [
+            {'name': {'$regex': search, '$options': 'i'}},
+            {'description': {'$regex': search, '$options': 'i'}}
+        ]
+    listing['query'] = query
+
+    # Relevance only means something for a search, otherwise use the default order
+    sort_by = args.get('sort_by', 'created_at')
+    if sort_by == 'relevance' and listing['matches'] is None:
+        sort_by = 'created_at'
+    listing['sort_by'] = sort_by
+    listing['sort_direction'] = -1 if args.get('sort_order', 'desc') == 'desc' else 1
+    return listing
+
+
+def listing_sort(listing):
+    """Sort specification for an offset-paginated listing"""
+    return [(listing['sort_by'], listing['sort_direction'])]
+
+
+def keyset_find(listing):
+    """
+    (filter, projection, sort, limit) for a cursor-paginated listing. _id breaks
+    ties so every product is returned exactly once; the sort field stays in
+    the projection because the next cursor is built from it. One extra
+    document is fetched to tell whether there is a next page.
+    """
+    sort_by, sort_direction = listing['sort_by'], listing['sort_direction']
+    query = listing['query']
+    if listing['cursor']:
+        last_value, last_id = decode_cursor(listing['cursor'], sort_by, sort_direction)
+        keyset = keyset_filter(sort_by, sort_direction, last_value, last_id)
+        query = {'$and': [query, keyset]} if query else keyset
+    projection = dict(listing['projection'], **{sort_by: 1}) if listing['projection'] else None
+    return query, projection, [(sort_by, sort_direction), ('_id', sort_direction)], listing['per_page'] + 1
+
+
+def keyset_page(products, listing):
+    """Trim the extra document fetched by keyset_find. Returns (products, next cursor)"""
+    per_page = listing['per_page']
+    if len(products) <= per_page:
+        return products, None
+    products = products[:per_page]
+    return products, encode_cursor(get_field(products[-1], listing['sort_by']), products[-1]['_id'],
+                                   listing['sort_by'], listing['sort_direction'])
+
+
+def match_chunks(listing):
+    """
+    The listing's filter restricted to each chunk of MATCH_CHUNK_SIZE search
+    matches; together they select every match that passes the other filters
+    """
+    product_ids = [product_id for product_id, _ in listing['matches']]
+    for start in range(0, len(product_ids), MATCH_CHUNK_SIZE):
+        yield dict(listing['query'], _id={'$in': product_ids[start:start + MATCH_CHUNK_SIZE]})
+
+
+def match_projection(listing):
+    """Fields page_matches needs from each filtered match"""
+    if listing['sort_by'] == 'relevance':
+        return {'_id': 1}
+    return {'_id': 1, listing['sort_by']: 1}
+
+
+def _sort_key(value, product_id):
+    # Missing/null values sort lowest, like in MongoDB
+    return (value is not None, value if value is not None else 0, product_id)
+
+
+def page_matches(listing, filtered):
+    """
+    Page through the search matches that passed the other filters
+    (`filtered`, documents with match_projection). Returns (total, page of
+    product ids, next cursor); pages by cursor when the listing has one
+    and is not faceted.
+    """
+    if listing['sort_by'] == 'relevance':
+        return rank_matches(listing, {doc['_id'] for doc in filtered})
+
+    sort_by, sort_direction, per_page = listing['sort_by'], listing['sort_direction'], listing['per_page']
+    keyed = sorted(((_sort_key(get_field(doc, sort_by), doc['_id']), doc) for doc in filtered),
+                   key=lambda item: item[0], reverse=sort_direction == -1)
+
+    next_cursor = None
+    cursor = listing['cursor'] if not listing['facets'] else None
+    if cursor is not None:
+        if cursor:
+            last_value, last_id = decode_cursor(cursor, sort_by, sort_direction)
+            last = _sort_key(last_value, last_id)
+            if sort_direction == -1:
+                keyed = [(key, doc) for key, doc in keyed if key < last]
+            else:
+                keyed = [(key, doc) for key, doc in keyed if key > last]
+        ordered = [doc for _, doc in keyed]
+        page = ordered[:per_page]
+        if len(ordered) > per_page:
+            next_cursor = encode_cursor(get_field(page[-1], sort_by), page[-1]['_id'], sort_by, sort_direction)
+    else:
+        ordered = [doc for _, doc in keyed]
+        page = ordered[listing['skip']:listing['skip'] + per_page]
+
+    return len(ordered), [doc['_id'] for doc in page], next_cursor
+
+
+def rank_matches(listing, filtered_ids):
+    """
+    Order search matches by relevance, keeping those that passed the other
+    filters (`filtered_ids`). Returns (total, page of product ids, next
+    cursor); pages by cursor when the listing has one and is not faceted.
+    """
+    ranked = [(product_id, score) for product_id, score in listing['matches'] if product_id in filtered_ids]
+    sort_direction, per_page = listing['sort_direction'], listing['per_page']
+    if sort_direction == 1:
+        ranked.reverse()
+
+    next_cursor = None
+    cursor = listing['cursor'] if not listing['facets'] else None
+    if cursor is not None:
+        if cursor:
+            last_score, last_id = decode_cursor(cursor, 'relevance', sort_direction)
+            if sort_direction == -1:
+                ranked = [(p, s) for p, s in ranked if (s, p) < (last_score, last_id)]
+            else:
+                ranked = [(p, s) for p, s in ranked if (s, p) > (last_score, last_id)]
+        page = ranked[:per_page]
+        if len(ranked) > per_page:
+            next_cursor = encode_cursor(page[-1][1], page[-1][0], 'relevance', sort_direction)
+    else:
+        page = ranked[listing['skip']:listing['skip'] + per_page]
+
+    return len(ranked), [product_id for product_id, _ in page], next_cursor
+
+
+def order_by_ids(products, product_ids):
+    """Documents in the order of the given ids, dropping ids that were not found"""
+    by_id = {product['_id']: product for product in products}
+    return [by_id[product_id] for product_id in product_ids if product_id in by_id]
+
+
+def _split_facet_query(query):
+    """(filters applied before $facet, filters each facet applies except its own)"""
+    filtered = set(FACET_FIELDS.values()) | {'price'}
+    base = {key: value for key, value in query.items() if key not in filtered}
+    narrowing = {key: value for key, value in query.items() if key in filtered}
+    return base, narrowing
+
+
+def catalog_wide_facets(listing):
+    """
+    Whether the facet counts of a listing span the whole catalog: nothing
+    but a search narrows the documents before $facet, and the stages
+    inside $facet cannot use indexes
+    """
+    base, _ = _split_facet_query(listing['query'])
+    return not base and listing['matches'] is None
+
+
+def facet_page_sort(listing):
+    """Sort of the product page in faceted mode, _id breaking ties like facet_pipeline"""
+    return [(listing['sort_by'], listing['sort_direction']), ('_id', listing['sort_direction'])]
+
+
+def facet_pipeline(listing, with_products=True):
+    """
+    A single $facet aggregation for a page of products together with the
+    total and per-facet counts (only the counts without `with_products`).
+    Each facet ignores its own filter so its other values stay selectable;
+    the remaining filters (search) run before $facet where indexes apply.
+    Search index matches are counted per chunk (match_chunks) without
+    products and added up with merge_facet_counts.
+    """
+    query, sort_by, sort_direction = listing['query'], listing['sort_by'], listing['sort_direction']
+    projection = listing['projection']
+    base, narrowing = _split_facet_query(query)
+
+    def excluding(field):
+        return {'$match': {key: value for key, value in narrowing.items() if key != field}}
+
+    page = [
+        {'$match': narrowing},
+        {'$sort': {sort_by: sort_direction, '_id': sort_direction}},
+        {'$skip': listing['skip']},
+        {'$limit': listing['per_page']}
+    ]
+    if projection:
+        page.append({'$project': projection})
+
+    facets = {
+        'total': [{'$match': narrowing}, {'$count': 'count'}],
+        'price': [
+            excluding('price'),
+            {'$bucket': {
+                'groupBy': '$price',
+                'boundaries': _price_boundaries(),
+                'default': 'other',
+                'output': {'count': {'$sum': 1}}
+            }}
+        ]
+    }
+    for name, field in FACET_FIELDS.items():
+        facets[name] = [
+            excluding(field),
+            {'$unwind': f'${field}'},
+            {'$group': {'_id': f'${field}', 'count': {'$sum': 1}}},
+            {'$sort': {'count': -1, '_id': 1}}
+        ]
+    if with_products:
+        facets['products'] = page
+
+    return ([{'$match': base}] if base else []) + [{'$facet': facets}]
+
+
+def _price_boundaries():
+    return [float(bound) for bound in PRICE_BUCKETS] + [float('inf')]
+
+
+def facet_results(result):
+    """Unpack the document produced by facet_pipeline. Returns (total, products, facets)"""
+    total = result['total'][0]['count'] if result['total'] else 0
+    counts = {
+        name: [{'value': bucket['_id'], 'count': bucket['count']} for bucket in result[name] if bucket['_id'] is not None]
+        for name in FACET_FIELDS
+    }
+    boundaries = _price_boundaries()
+    upper_bounds = dict(zip(boundaries, boundaries[1:-1]))
+    counts['price'] = [
+        {'min': bucket['_id'], 'max': upper_bounds.get(bucket['_id']), 'count': bucket['count']}
+        for bucket in result['price'] if bucket['_id'] != 'other'
+    ]
+    return total, result.get('products', []), counts
+
+
+def merge_facet_counts(results):
+    """Add up the (total, products, facets) of facet_results over chunks of matches. Returns (total, facets)"""
+    total = 0
+    merged = {name: {} for name in list(FACET_FIELDS) + ['price']}
+    for chunk_total, _, counts in results:
+        total += chunk_total
+        for name, buckets in counts.items():
+            for bucket in buckets:
+                key = bucket['min'] if name == 'price' else bucket['value']
+                if key in merged[name]:
+                    merged[name][key]['count'] += bucket['count']
+                else:
+                    merged[name][key] = dict(bucket)
+    facets = {
+        name: sorted(buckets.values(), key=lambda bucket: (-bucket['count'], bucket['value']))
+        for name, buckets in merged.items() if name != 'price'
+    }
+    facets['price'] = sorted(merged['price'].values(), key=lambda bucket: bucket['min'])
+    return total, facets
+
+
+class FacetCountCache:
+    """
+    (total, facet counts) of catalog-wide faceted listings, per catalog
+    version and filter combination. Each one costs a full collection scan,
+    so it is computed once per catalog change instead of once per request;
+    the least recently used combinations are evicted past max_entries.
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(version, listing):
+        _, narrowing = _split_facet_query(listing['query'])
+        return version, json_util.dumps(narrowing, sort_keys=True)
+
+    def get(self, version, listing):
+        key = self._key(version, listing)
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, version, listing, value):
+        with self._lock:
+            self._entries[self._key(version, listing)] = value
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+
+def listing_response(listing, products, total_products=None, next_cursor=None, facets=None):
+    """Response body of a listing: cursor pages carry next_cursor, offset pages carry totals"""
+    if listing['cursor'] is not None and not listing['facets']:
+        return {
+            'products': products,
+            'per_page': listing['per_page'],
+            'next_cursor': next_cursor
+        }
+
+    per_page = listing['per_page']
+    response = {
+        'products': products,
+        'page': listing['page'],
+        'per_page': per_page,
+        'total_products': total_products,
+        'total_pages': (total_products + per_page - 1) // per_page
+    }
+    if facets is not None:
+        response['facets'] = facets
+    return response
+
+
+def recommendations_response(products, personalized):
+    return {
+        'products': products,
+        'message': ('Personalized recommendations based on style profile' if personalized
+                    else 'Default recommendations (no style profile)')
+    }
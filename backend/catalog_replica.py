@@ -0,0 +1,238 @@
+import datetime
+import logging
+import sys
+import threading
+import time
+
+import numpy as np
+
+# Numeric/string columns the replica can sort by
+SORTABLE_COLUMNS = ('created_at', 'updated_at', 'price', 'name')
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+logger = logging.getLogger(__name__)
+
+
+def changed_products(collection, since=None, projection=None):
+    """
+    Iterate over products updated at or after `since`, oldest change first.
+    Re-reading the boundary timestamp is harmless because applying a change
+    twice is idempotent, and it avoids missing writes made in the same
+    millisecond as the previous watermark.
+    """
+    query = {'updated_at': {'$gte': since}} if since else {}
+    return collection.find(query, projection).sort('updated_at', 1)
+
+
+def catalog_state(db):
+    """
+    (product count, newest updated_at): changes whenever a product is
+    added, updated or removed. Two indexed reads.
+    """
+    newest = db.products.find_one({}, {'updated_at': 1}, sort=[('updated_at', -1)])
+    updated_at = newest.get('updated_at') if newest else None
+    if not isinstance(updated_at, datetime.datetime):
+        updated_at = None
+    return db.products.count_documents({}), updated_at
+
+
+def _timestamp(value):
+    """Datetime to integer microseconds, missing values sort first"""
+    if isinstance(value, datetime.datetime):
+        return (value.replace(tzinfo=None) - EPOCH) // datetime.timedelta(microseconds=1)
+    return np.iinfo(np.int64).min
+
+
+class CatalogReplica:
+    """
+    Read-mostly, column-oriented copy of the products collection.
+
+    Filtering and sorting run on NumPy columns (price, created_at,
+    updated_at, interned names) and per-category packed bitmaps; only the
+    documents of the requested page are copied out. The replica follows the
+    collection incrementally by `updated_at`; deletions are only picked up
+    by the periodic full reload.
+
+    Loading happens on the start()ed daemon thread: a full reload is built
+    into a separate replica and its columns swapped in under the lock, and
+    incremental changes are fetched before the lock is taken, so queries
+    never wait for MongoDB.
+    """
+
+    # Attributes replaced wholesale when a full reload is swapped in
+    STATE = ('_docs', '_row_by_id', '_price', '_created_at', '_updated_at', '_name',
+             '_category_bitmaps', 'watermark', 'last_refresh', 'last_full_reload')
+
+    def __init__(self, collection, refresh_interval=30, full_reload_interval=600):
+        self.collection = collection
+        self.refresh_interval = refresh_interval
+        self.full_reload_interval = full_reload_interval
+        self._lock = threading.RLock()
+        self._refresh_lock = threading.Lock()
+        self._thread = None
+        self._reset()
+
+    def _reset(self):
+        self._docs = []
+        self._row_by_id = {}
+        self._price = np.empty(0, dtype=np.float64)
+        self._created_at = np.empty(0, dtype=np.int64)
+        self._updated_at = np.empty(0, dtype=np.int64)
+        self._name = np.empty(0, dtype=object)
+        self._category_bitmaps = {}
+        self.watermark = None
+        self.last_refresh = 0.0
+        self.last_full_reload = 0.0
+
+    def __len__(self):
+        return len(self._docs)
+
+    @property
+    def loaded(self):
+        return self.last_full_reload > 0
+
+    @property
+    def version(self):
+        """Changes whenever the content may have (deletions only show up at a full reload)"""
+        return self.watermark, len(self), self.last_full_reload
+
+    # Loading
+
+    def reload(self):
+        """Rebuild the replica from scratch off-lock and swap it in"""
+        fresh = CatalogReplica(self.collection)
+        fresh._apply(changed_products(self.collection))
+        fresh.last_full_reload = fresh.last_refresh
+        with self._lock:
+            for name in self.STATE:
+                setattr(self, name, getattr(fresh, name))
+
+    def refresh(self):
+        """Pull documents changed since the last refresh (or reload, when one is due)"""
+        with self._refresh_lock:
+            if time.time() - self.last_full_reload > self.full_reload_interval:
+                self.reload()
+                return
+            documents = list(changed_products(self.collection, self.watermark))
+            with self._lock:
+                self._apply(documents)
+
+    def _apply(self, documents):
+        new_rows = []
+        updated = []
+        for doc in documents:
+            row = self._row_by_id.get(doc['_id'])
+            if row is None:
+                self._row_by_id[doc['_id']] = len(self._docs) + len(new_rows)
+                new_rows.append(doc)
+            else:
+                updated.append((row, doc))
+            if doc.get('updated_at') and (self.watermark is None or doc['updated_at'] > self.watermark):
+                self.watermark = doc['updated_at']
+
+        if new_rows:
+            start = len(self._docs)
+            self._docs.extend(new_rows)
+            self._price = np.concatenate([self._price, np.empty(len(new_rows))])
+            self._created_at = np.concatenate([self._created_at, np.empty(len(new_rows), dtype=np.int64)])
+            self._updated_at = np.concatenate([self._updated_at, np.empty(len(new_rows), dtype=np.int64)])
+            self._name = np.concatenate([self._name, np.empty(len(new_rows), dtype=object)])
+            nbytes = (len(self._docs) + 7) // 8
+            for category, bitmap in self._category_bitmaps.items():
+                self._category_bitmaps[category] = np.concatenate(
+                    [bitmap, np.zeros(nbytes - len(bitmap), dtype=np.uint8)]
+                )
+            for offset, doc in enumerate(new_rows):
+                self._set_row(start + offset, doc, previous=None)
+
+        for row, doc in updated:
+            previous = self._docs[row]
+            self._docs[row] = doc
+            self._set_row(row, doc, previous)
+
+        self.last_refresh = time.time()
+
+    def _set_row(self, row, doc, previous):
+        price = doc.get('price')
+        self._price[row] = float(price) if isinstance(price, (int, float)) else np.nan
+        self._created_at[row] = _timestamp(doc.get('created_at'))
+        self._updated_at[row] = _timestamp(doc.get('updated_at'))
+        self._name[row] = sys.intern(doc['name']) if isinstance(doc.get('name'), str) else ''
+
+        byte, bit = row >> 3, np.uint8(1 << (row & 7))
+        if previous is not None:
+            for category in previous.get('categories') or []:
+                self._category_bitmaps[category][byte] &= ~bit
+        for category in doc.get('categories') or []:
+            category = sys.intern(category)
+            if category not in self._category_bitmaps:
+                self._category_bitmaps[category] = np.zeros((len(self._docs) + 7) // 8, dtype=np.uint8)
+            self._category_bitmaps[category][byte] |= bit
+
+    # Background refresh
+
+    def start(self):
+        """Load the replica and keep it fresh from a daemon thread; it is not `loaded` until the first load lands"""
+        self._thread = threading.Thread(target=self._run, name='catalog-replica', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("Catalog replica refresh failed")
+            time.sleep(self.refresh_interval)
+
+    def ensure_fresh(self):
+        """Refresh inline when no background thread keeps the replica current"""
+        if self._thread is None and time.time() - self.last_refresh > self.refresh_interval:
+            self.refresh()
+
+    # Queries
+
+    def can_sort_by(self, sort_by):
+        return sort_by in SORTABLE_COLUMNS
+
+    def categories(self):
+        """Distinct categories currently carried by at least one product"""
+        with self._lock:
+            self.ensure_fresh()
+            return sorted(c for c, bitmap in self._category_bitmaps.items() if bitmap.any())
+
+    def query(self, category=None, min_price=None, max_price=None,
+              sort_by='created_at', sort_direction=-1, skip=0, limit=12, product_ids=None):
+        """
+        Answer the list_products filters from memory, optionally restricted
+        to a candidate set of product ids (e.g. search matches).
+        Returns (total matching products, copies of the page documents).
+        """
+        with self._lock:
+            self.ensure_fresh()
+            count = len(self._docs)
+            if product_ids is None:
+                mask = np.ones(count, dtype=bool)
+            else:
+                mask = np.zeros(count, dtype=bool)
+                mask[[self._row_by_id[pid] for pid in product_ids if pid in self._row_by_id]] = True
+
+            if category:
+                bitmap = self._category_bitmaps.get(category)
+                if bitmap is None:
+                    return 0, []
+                mask &= np.unpackbits(bitmap, count=count, bitorder='little').astype(bool)
+            if min_price is not None:
+                mask &= self._price >= min_price
+            if max_price is not None:
+                mask &= self._price <= max_price
+
+            rows = np.flatnonzero(mask)
+            column = getattr(self, '_' + sort_by)[rows]
+            if sort_direction == -1:
+                # Descending, but ties keep their natural (insertion) order
+                order = (len(column) - 1 - np.argsort(column[::-1], kind='stable'))[::-1]
+            else:
+                order = np.argsort(column, kind='stable')
+            page = rows[order[skip:skip + limit]]
+            return len(rows), [dict(self._docs[row]) for row in page]
@@ -0,0 +1,105 @@
+import datetime
+import hashlib
+import os
+import threading
+import time
+
+from flask import Response, request
+
+from catalog_replica import catalog_state
+
+# Cache-Control per kind of response, overridable with CACHE_CONTROL_<KIND>
+DEFAULT_CACHE_CONTROL = {
+    'product': 'public, max-age=60',
+    'listing': 'public, max-age=30',
+    'categories': 'public, max-age=300',
+}
+
+
+def cache_control(kind):
+    return os.environ.get(f"CACHE_CONTROL_{kind.upper()}", DEFAULT_CACHE_CONTROL[kind])
+
+
+def make_etag(*parts):
+    """Weak ETag over the given parts (the same data may be encoded by either JSON backend)"""
+    digest = hashlib.sha1('|'.join(str(part) for part in parts).encode('utf-8')).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+
+def http_datetime(value):
+    """Stored (naive, local) datetimes as aware UTC, truncated to HTTP's one-second precision"""
+    if value is None:
+        return None
+    return value.astimezone(datetime.timezone.utc).replace(microsecond=0)
+
+
+def is_not_modified(etag, last_modified=None, req=None):
+    """
+    Evaluate the request's conditional headers: If-None-Match wins when
+    present, otherwise If-Modified-Since is compared to last_modified.
+    Defaults to Flask's current request; pass `req` for any other
+    Werkzeug-style request object (e.g. Quart's).
+    """
+    if req is None:
+        req = request
+    if req.if_none_match:
+        return req.if_none_match.contains_weak(etag.removeprefix('W/').strip('"'))
+    if last_modified is not None and req.if_modified_since is not None:
+        return http_datetime(last_modified) <= req.if_modified_since
+    return False
+
+
+def set_cache_headers(response, etag, last_modified, kind):
+    response.headers['ETag'] = etag
+    response.headers['Cache-Control'] = cache_control(kind)
+    if last_modified is not None:
+        response.last_modified = http_datetime(last_modified)
+    return response
+
+
+def source_validators(etag, last_modified, sources):
+    """
+    Fold the state of in-process copies a response may be served from (search
+    index, catalog replica) into the catalog's validators. They lag the
+    database, so a body built from them must not be validated by the database
+    version alone; Last-Modified is capped at their watermark.
+    """
+    sources = [source for source in sources if source is not None]
+    if not sources:
+        return etag, last_modified
+    etag = make_etag(etag, *(source.version for source in sources))
+    for source in sources:
+        if source.loaded and source.watermark is not None and (last_modified is None or source.watermark < last_modified):
+            last_modified = source.watermark
+    return etag, last_modified
+
+
+def not_modified_response(etag, last_modified, kind):
+    return set_cache_headers(Response(status=304), etag, last_modified, kind)
+
+
+class CatalogVersion:
+    """
+    Catalog fingerprint (see catalog_state) re-read at most every `ttl`
+    seconds, so conditional requests cost no database work in between.
+    """
+
+    def __init__(self, db, ttl=5.0):
+        self.db = db
+        self.ttl = ttl
+        self._state = None
+        self._read_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        """(etag, last_modified) of the catalog as a whole"""
+        with self._lock:
+            if self._state is None or time.time() - self._read_at > self.ttl:
+                count, updated_at = catalog_state(self.db)
+                self._state = (make_etag('catalog', count, updated_at), updated_at)
+                self._read_at = time.time()
+            return self._state
+
+    def invalidate(self):
+        with self._lock:
+            self._state = None
@@ -0,0 +1,125 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from bson.objectid import ObjectId
+from flask_jwt_extended import current_user
+from flask_jwt_extended.config import config as jwt_config
+
+
+def identity_pipeline(user_id):
+    """Aggregation over users that joins in the user's style profile"""
+    return [
+        {'$match': {'_id': ObjectId(user_id)}},
+        {'$limit': 1},
+        # Carts live in their own collection; skip any legacy embedded cart
+        {'$project': {'cart': 0}},
+        {'$lookup': {
+            'from': 'style_profiles',
+            'localField': 'style_profile',
+            'foreignField': '_id',
+            'as': 'style_profile_docs'
+        }}
+    ]
+
+
+def split_identity(users):
+    """(user, style profile) from the result of identity_pipeline"""
+    if not users:
+        return None, None
+    user = users[0]
+    profiles = user.pop('style_profile_docs', [])
+    return user, profiles[0] if profiles else None
+
+
+def load_identity(db, user_id):
+    """Fetch a user and their style profile in a single aggregation"""
+    return split_identity(list(db.users.aggregate(identity_pipeline(user_id))))
+
+
+class IdentityCache:
+    """
+    Short-TTL, per-process LRU cache of (user, style profile) pairs. Writers
+    call invalidate() so the process that saved a profile sees it at once;
+    other processes see it after at most `ttl` seconds. At most
+    `max_entries` users are kept, least recently used evicted first.
+    """
+
+    def __init__(self, ttl=5.0, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry and entry[0] > time.time():
+                self._entries.move_to_end(user_id)
+                return entry[1]
+            self._entries.pop(user_id, None)
+            return None
+
+    def put(self, user_id, identity):
+        with self._lock:
+            self._entries[user_id] = (time.time() + self.ttl, identity)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(str(user_id), None)
+
+
+identity_cache = IdentityCache()
+
+
+class Identity:
+    """
+    The current user and style profile, loaded on first access and then
+    reused for the rest of the request. Handlers get their own copies,
+    so formatting them for a response never touches the cache.
+    """
+
+    def __init__(self, db, user_id):
+        self.db = db
+        self.user_id = user_id
+        self._loaded = None
+
+    def _load(self):
+        if self._loaded is None:
+            loaded = identity_cache.get(self.user_id)
+            if loaded is None:
+                loaded = load_identity(self.db, self.user_id)
+                identity_cache.put(self.user_id, loaded)
+            self._loaded = copy.deepcopy(loaded)
+        return self._loaded
+
+    @property
+    def user(self):
+        return self._load()[0]
+
+    @property
+    def style_profile(self):
+        return self._load()[1]
+
+
+def register_identity_loader(jwt, db, ttl=5.0, max_entries=10000):
+    """Make flask_jwt_extended's current_user an Identity for the token's user"""
+    identity_cache.ttl = ttl
+    identity_cache.max_entries = max_entries
+
+    @jwt.user_lookup_loader
+    def user_lookup(_jwt_header, jwt_data):
+        return Identity(db, jwt_data[jwt_config.identity_claim_key])
+
+
+def current_identity():
+    """Identity of the user making the current (JWT-authenticated) request"""
+    return current_user
+
+
+def invalidate_identity(user_id):
+    identity_cache.invalidate(user_id)
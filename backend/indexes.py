@@ -0,0 +1,289 @@
+"""
+Declared MongoDB indexes and query-plan checks.
+
+    python indexes.py ensure                    # create/repair the declared indexes
+    python indexes.py verify                    # explain() every hot query shape, exit 1 on COLLSCAN
+    python indexes.py dedupe-profiles [--apply] # list (or delete) duplicate style profiles
+"""
+import datetime
+import logging
+import os
+import sys
+
+from bson.objectid import ObjectId
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+# Indexes every collection needs, keyed by collection name
+INDEXES = {
+    'users': [
+        IndexModel([('email', ASCENDING)], name='email_unique', unique=True),
+        IndexModel([('username', ASCENDING)], name='username_unique', unique=True),
+    ],
+    'style_profiles': [
+        # One profile per user; saves upsert on it
+        IndexModel([('user_id', ASCENDING)], name='user_id_unique', unique=True),
+    ],
+    'analysis_jobs': [
+        # Held only while a job is pending/running, deduplicates identical requests
+        IndexModel([('inflight_key', ASCENDING)], name='inflight_key_unique', unique=True, sparse=True),
+    ],
+    'analysis_cache': [
+        IndexModel([('prompt_version', ASCENDING)], name='prompt_version'),
+    ],
+    'carts': [
+        IndexModel([('user_id', ASCENDING)], name='user_id_unique', unique=True),
+    ],
+    'user_recommendations': [
+        IndexModel([('user_id', ASCENDING)], name='user_id_unique', unique=True),
+    ],
+    'products': [
+        # list_products sorts; _id makes them usable for cursor pagination too
+        IndexModel([('created_at', DESCENDING), ('_id', DESCENDING)], name='created_at_id'),
+        IndexModel([('price', ASCENDING), ('_id', ASCENDING)], name='price_id'),
+        IndexModel([('name', ASCENDING), ('_id', ASCENDING)], name='name_id'),
+        # Category filter: equality first, then sort, then the price range
+        IndexModel([('categories', ASCENDING), ('created_at', DESCENDING), ('price', ASCENDING)],
+                   name='categories_created_at_price'),
+        IndexModel([('categories', ASCENDING), ('price', ASCENDING)], name='categories_price'),
+        # Bulk import upserts by SKU; seeded products have none
+        IndexModel([('sku', ASCENDING)], name='sku_unique', unique=True, sparse=True),
+        # Incremental refresh of the catalog replica and search index
+        IndexModel([('updated_at', ASCENDING)], name='updated_at'),
+    ],
+}
+
+# Indexes replaced by a declared one: dropped once their replacement exists, or
+# right before it is built when both are on the same key (MongoDB refuses a
+# second index on a key under another name)
+RETIRED_INDEXES = {
+    'style_profiles': ['user_id'],
+}
+
+
+def _duplicate_profile_groups(db):
+    return db.style_profiles.aggregate([
+        {'$sort': {'updated_at': -1}},
+        {'$group': {'_id': '$user_id', 'profile_ids': {'$push': '$_id'}}},
+        {'$match': {'profile_ids.1': {'$exists': True}}}
+    ], allowDiskUse=True)
+
+
+def has_duplicate_profiles(db):
+    return next(iter(_duplicate_profile_groups(db)), None) is not None
+
+
+def remove_duplicate_profiles(db, apply=False):
+    """
+    Plan (and with apply=True carry out) keeping one style profile per user
+    so the unique user_id index can be built: the one the user document
+    references, else the most recently updated. The user is pointed at the
+    kept profile. Returns [(user_id, kept_id, [removed_ids])].
+    """
+    plan = []
+    for group in _duplicate_profile_groups(db):
+        profile_ids = group['profile_ids']
+        user = db.users.find_one({'_id': group['_id']}, {'style_profile': 1})
+        referenced = user.get('style_profile') if user else None
+        keep = referenced if referenced in profile_ids else profile_ids[0]
+        removed = [pid for pid in profile_ids if pid != keep]
+        if apply:
+            db.style_profiles.delete_many({'_id': {'$in': removed}})
+            db.users.update_one({'_id': group['_id']}, {'$set': {'style_profile': keep}})
+        plan.append((group['_id'], keep, removed))
+    return plan
+
+
+# Unique indexes that existing data may violate: (check, migration to run first).
+# ensure_indexes skips them while the check finds violations.
+UNIQUE_PREREQUISITES = {
+    ('style_profiles', 'user_id_unique'): (has_duplicate_profiles, 'python indexes.py dedupe-profiles --apply'),
+}
+
+# Hot query shapes: (collection, description, filter, sort)
+HOT_QUERIES = [
+    ('users', 'register/login by email', {'email': 'user@example.com'}, None),
+    ('users', 'register username check', {'username': 'user'}, None),
+    ('style_profiles', 'profile by user', {'user_id': ObjectId()}, None),
+    ('user_recommendations', 'recommendations by user', {'user_id': ObjectId()}, None),
+    ('carts', 'cart by user', {'user_id': ObjectId()}, None),
+    ('products', 'list newest', {}, [('created_at', DESCENDING)]),
+    ('products', 'list by price', {}, [('price', ASCENDING)]),
+    ('products', 'list by name', {}, [('name', ASCENDING)]),
+    ('products', 'list by category, newest', {'categories': 'clothing'}, [('created_at', DESCENDING)]),
+    ('products', 'list by category and price range, newest',
+     {'categories': 'clothing', 'price': {'$gte': 10.0, '$lte': 100.0}}, [('created_at', DESCENDING)]),
+    ('products', 'list by category and price range, by price',
+     {'categories': 'clothing', 'price': {'$gte': 10.0, '$lte': 100.0}}, [('price', ASCENDING)]),
+    ('products', 'list by price range, by price',
+     {'price': {'$gte': 10.0, '$lte': 100.0}}, [('price', ASCENDING)]),
+    ('products', 'import upsert by sku', {'sku': 'SKU-1'}, None),
+    ('products', 'catalog changes since watermark',
+     {'updated_at': {'$gte': datetime.datetime(2000, 1, 1)}}, [('updated_at', ASCENDING)]),
+]
+
+
+def _index_spec(document):
+    """Comparable (key, unique, sparse) triple of an index"""
+    key = document['key'].items() if isinstance(document['key'], dict) else document['key']
+    return (
+        [(field, int(direction) if isinstance(direction, float) else direction) for field, direction in key],
+        bool(document.get('unique', False)),
+        bool(document.get('sparse', False))
+    )
+
+
+def _same_key_retired(collection_name, existing, declared):
+    """Existing retired indexes of a collection on the same key as a declared one"""
+    key = _index_spec(declared)[0]
+    return [name for name in RETIRED_INDEXES.get(collection_name, [])
+            if name in existing and _index_spec(existing[name])[0] == key]
+
+
+def _failed(changes, collection_name, name, error):
+    logger.error("Index reconciliation failed",
+                 extra={'collection': collection_name, 'index': name, 'error': str(error)})
+    changes['failed'].append({'index': name, 'error': str(error)})
+
+
+def ensure_indexes(db, drop_unknown=False):
+    """
+    Reconcile the declared indexes with the database: create missing ones,
+    rebuild ones whose definition changed, drop retired ones and
+    optionally drop undeclared ones. Unique indexes whose data migration
+    has not run yet are skipped (and the indexes they retire kept). An
+    index that cannot be built (e.g. a unique index over duplicate values)
+    is logged and listed under 'failed' without stopping the others.
+    Returns {collection: {'created': [...], 'rebuilt': [...], 'dropped': [...],
+    'skipped': [...], 'failed': [{'index': name, 'error': message}]}}.
+    """
+    report = {}
+    for collection_name, models in INDEXES.items():
+        collection = db[collection_name]
+        changes = {'created': [], 'rebuilt': [], 'dropped': [], 'skipped': [], 'failed': []}
+        report[collection_name] = changes
+
+        try:
+            existing = collection.index_information()
+        except OperationFailure as e:
+            _failed(changes, collection_name, None, e)
+            continue
+
+        for model in models:
+            declared = model.document
+            name = declared['name']
+            needs_build = name not in existing or _index_spec(existing[name]) != _index_spec(declared)
+            prerequisite = UNIQUE_PREREQUISITES.get((collection_name, name))
+            if needs_build and prerequisite and prerequisite[0](db):
+                logger.warning("Skipping index until existing documents are migrated",
+                               extra={'collection': collection_name, 'index': name, 'migration': prerequisite[1]})
+                changes['skipped'].append(name)
+                continue
+            replaced = _same_key_retired(collection_name, existing, declared) if needs_build else []
+            try:
+                for retired_name in replaced:
+                    collection.drop_index(retired_name)
+                if name not in existing:
+                    collection.create_indexes([model])
+                    changes['created'].append(name)
+                elif _index_spec(existing[name]) != _index_spec(declared):
+                    collection.drop_index(name)
+                    collection.create_indexes([model])
+                    changes['rebuilt'].append(name)
+                changes['dropped'] += replaced
+                for retired_name in replaced:
+                    del existing[retired_name]
+            except OperationFailure as e:
+                _failed(changes, collection_name, name, e)
+                # Put back the retired index the failed build was meant to replace
+                restore = [IndexModel(existing[retired_name]['key'], name=retired_name,
+                                      unique=existing[retired_name].get('unique', False),
+                                      sparse=existing[retired_name].get('sparse', False))
+                           for retired_name in replaced]
+                if restore:
+                    try:
+                        collection.create_indexes(restore)
+                    except OperationFailure as restore_error:
+                        _failed(changes, collection_name, replaced[0], restore_error)
+
+        # Retired indexes stay while their replacement is skipped or failed
+        retired = RETIRED_INDEXES.get(collection_name, [])
+        kept = set(retired) if changes['skipped'] or changes['failed'] else set()
+        dropping = [name for name in retired if name in existing and name not in kept]
+        if drop_unknown:
+            declared_names = {model.document['name'] for model in models}
+            dropping += [name for name in existing
+                         if name != '_id_' and name not in declared_names and name not in retired]
+        for name in dropping:
+            try:
+                collection.drop_index(name)
+                changes['dropped'].append(name)
+            except OperationFailure as e:
+                _failed(changes, collection_name, name, e)
+
+    return report
+
+
+def index_failures(report):
+    """[(collection, index, error)] of everything ensure_indexes could not do"""
+    return [(collection_name, failure['index'], failure['error'])
+            for collection_name, changes in report.items() for failure in changes['failed']]
+
+
+def _plan_stages(plan):
+    """All stage names in an explain() plan tree"""
+    stages = [plan.get('stage')]
+    for child in plan.get('inputStages', []) + [plan[key] for key in ('inputStage', 'queryPlan') if key in plan]:
+        stages.extend(_plan_stages(child))
+    return stages
+
+
+def verify_query_plans(db):
+    """
+    Explain every hot query shape. Returns a list of
+    (collection, description, stages, ok) where ok is False for COLLSCAN plans.
+    """
+    results = []
+    for collection_name, description, query, sort in HOT_QUERIES:
+        cursor = db[collection_name].find(query).limit(1)
+        if sort:
+            cursor = cursor.sort(sort)
+        winning_plan = cursor.explain()['queryPlanner']['winningPlan']
+        stages = _plan_stages(winning_plan)
+        results.append((collection_name, description, stages, 'COLLSCAN' not in stages))
+    return results
+
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+
+    load_dotenv()
+    db = MongoClient(os.environ.get('MONGO_URI', 'mongodb://localhost:27017/personashop')).get_default_database()
+    command = sys.argv[1] if len(sys.argv) > 1 else 'verify'
+
+    if command == 'ensure':
+        report = ensure_indexes(db, drop_unknown='--drop-unknown' in sys.argv)
+        for collection_name, changes in report.items():
+            print(f"{collection_name}: {changes}")
+        sys.exit(1 if index_failures(report) else 0)
+    elif command == 'verify':
+        ensure_indexes(db)
+        failed = False
+        for collection_name, description, stages, ok in verify_query_plans(db):
+            print(f"{'OK  ' if ok else 'FAIL'} {collection_name}: {description} -> {' > '.join(filter(None, stages))}")
+            failed = failed or not ok
+        sys.exit(1 if failed else 0)
+    elif command == 'dedupe-profiles':
+        apply = '--apply' in sys.argv
+        plan = remove_duplicate_profiles(db, apply=apply)
+        for user_id, keep, removed in plan:
+            print(f"user {user_id}: keep {keep}, {'deleted' if apply else 'would delete'} "
+                  f"{', '.join(str(pid) for pid in removed)}")
+        print(f"{'Deleted' if apply else 'Would delete'} {sum(len(removed) for _, _, removed in plan)} "
+              f"profiles of {len(plan)} users" + ('' if apply or not plan else '; re-run with --apply'))
+    else:
+        print(__doc__)
+        sys.exit(2)
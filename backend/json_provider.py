@@ -0,0 +1,56 @@
+import base64
+import datetime
+import decimal
+import uuid
+
+from bson import Binary, Decimal128, ObjectId, Timestamp
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, the standard library encoder is used without it
+    orjson = None
+
+
+def bson_default(value):
+    """Encode the BSON/Python types the json module does not know about"""
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, Decimal128):
+        return str(value.to_decimal())
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    if isinstance(value, Timestamp):
+        return value.as_datetime().isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, (Binary, bytes)):
+        return base64.b64encode(bytes(value)).decode('ascii')
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class BSONJSONProvider(DefaultJSONProvider):
+    """
+    JSON provider that encodes ObjectId, datetime and other BSON types
+    directly, so handlers can return documents straight from MongoDB.
+    Uses orjson when it is installed and compact output is requested
+    (always, outside debug mode); other options go to the stdlib encoder.
+    """
+
+    default = staticmethod(bson_default)
+
+    def dumps(self, obj, **kwargs):
+        if orjson is not None and kwargs in ({}, {'separators': (',', ':')}):
+            option = orjson.OPT_NON_STR_KEYS
+            if self.sort_keys:
+                option |= orjson.OPT_SORT_KEYS
+            try:
+                return orjson.dumps(obj, default=bson_default, option=option).decode('utf-8')
+            except orjson.JSONEncodeError:
+                # e.g. integers beyond 64 bits, which the stdlib encoder handles
+                pass
+        return super().dumps(obj, **kwargs)
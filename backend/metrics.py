@@ -0,0 +1,245 @@
+import bisect
+import threading
+import time
+
+from flask import Response, g, has_request_context, request
+from pymongo import monitoring
+
+# Latency buckets in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# MongoDB commands issued by a single request; high counts point at N+1 patterns
+COMMAND_COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + (list(extra.items()) if extra else [])
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """A named metric with one value (or histogram) per label combination"""
+
+    type = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            items = sorted(self._values.items())
+            for key, value in items:
+                lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_number(value)}"]
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def time(self, **labels):
+        """Context manager observing the duration of its block"""
+        return _Timer(self, labels)
+
+    def _render_value(self, key, value):
+        counts, total, count = value
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, {'le': _format_number(bound)})} "
+                         f"{cumulative}")
+        lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, {'le': '+Inf'})} {count}")
+        lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_number(total)}")
+        lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+
+class MetricsRegistry:
+    """Process-wide set of metrics rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, *args, **kwargs):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = cls(name, *args, **kwargs)
+            return self._metrics[name]
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._register(Counter, name, help_text, labelnames)
+
+    def gauge(self, name, help_text, labelnames=()):
+        return self._register(Gauge, name, help_text, labelnames)
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, help_text, labelnames, buckets=buckets)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+REQUESTS = registry.counter(
+    'http_requests_total', 'HTTP requests by route and status', ('blueprint', 'route', 'method', 'status'))
+REQUEST_LATENCY = registry.histogram(
+    'http_request_duration_seconds', 'HTTP request latency', ('blueprint', 'route', 'method'))
+REQUESTS_IN_FLIGHT = registry.gauge(
+    'http_requests_in_flight', 'HTTP requests being handled', ('blueprint', 'route'))
+REQUEST_MONGO_COMMANDS = registry.histogram(
+    'http_request_mongo_commands', 'MongoDB commands issued per HTTP request', ('blueprint', 'route'),
+    buckets=COMMAND_COUNT_BUCKETS)
+REQUEST_MONGO_TIME = registry.histogram(
+    'http_request_mongo_duration_seconds', 'Time per HTTP request spent in MongoDB commands', ('blueprint', 'route'))
+MONGO_COMMANDS = registry.counter(
+    'mongo_commands_total', 'MongoDB commands by name and outcome', ('command', 'outcome'))
+MONGO_COMMAND_LATENCY = registry.histogram(
+    'mongo_command_duration_seconds', 'MongoDB command latency', ('command',))
+BCRYPT_LATENCY = registry.histogram(
+    'bcrypt_duration_seconds', 'Password hash/verify latency including pool queueing', ('operation',))
+OPENAI_LATENCY = registry.histogram(
+    'openai_request_duration_seconds', 'OpenAI chat completion latency', ('outcome',),
+    buckets=(0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0))
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Counts and times every MongoDB command and charges it to the current request, if any"""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._record(event, 'success')
+
+    def failed(self, event):
+        self._record(event, 'failure')
+
+    def _record(self, event, outcome):
+        seconds = event.duration_micros / 1e6
+        MONGO_COMMANDS.inc(command=event.command_name, outcome=outcome)
+        MONGO_COMMAND_LATENCY.observe(seconds, command=event.command_name)
+        # pymongo publishes events on the thread that ran the command
+        if has_request_context() and 'metrics_started' in g:
+            g.mongo_commands += 1
+            g.mongo_seconds += seconds
+
+
+def _route_labels():
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    return request.blueprint or 'app', route
+
+
+def instrument_app(app, endpoint='/metrics'):
+    """Time every request and serve the registry at `endpoint`"""
+
+    @app.before_request
+    def start_request_metrics():
+        g.metrics_started = time.perf_counter()
+        g.mongo_commands = 0
+        g.mongo_seconds = 0.0
+        blueprint, route = _route_labels()
+        REQUESTS_IN_FLIGHT.inc(blueprint=blueprint, route=route)
+
+    @app.after_request
+    def count_request(response):
+        blueprint, route = _route_labels()
+        REQUESTS.inc(blueprint=blueprint, route=route, method=request.method, status=response.status_code)
+        return response
+
+    @app.teardown_request
+    def finish_request_metrics(_exc):
+        if 'metrics_started' not in g:
+            return
+        blueprint, route = _route_labels()
+        REQUESTS_IN_FLIGHT.dec(blueprint=blueprint, route=route)
+        REQUEST_LATENCY.observe(time.perf_counter() - g.metrics_started,
+                                blueprint=blueprint, route=route, method=request.method)
+        REQUEST_MONGO_COMMANDS.observe(g.mongo_commands, blueprint=blueprint, route=route)
+        REQUEST_MONGO_TIME.observe(g.mongo_seconds, blueprint=blueprint, route=route)
+
+    def metrics_view():
+        return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+    app.add_url_rule(endpoint, 'metrics', metrics_view)
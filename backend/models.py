@@ -8,7 +8,6 @@ def create_user(username, email, password_hash):
         "password": password_hash,
         "created_at": datetime.now(),
         "style_profile": None,
-        "cart": [],
         "orders": []
     }
 
@@ -0,0 +1,179 @@
+import os
+import threading
+import time
+
+import httpx
+import openai
+
+from metrics import OPENAI_LATENCY
+
+# States of the circuit breaker
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# Errors that say the upstream is unhealthy (as opposed to a bad request)
+UPSTREAM_ERRORS = (
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+    openai.RateLimitError,
+)
+
+
+class LLMUnavailable(Exception):
+    """The call was rejected without reaching the model (breaker open or too many in flight)"""
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive upstream failures and
+    rejects calls for `reset_timeout` seconds, then lets a single trial
+    call through (half-open) to decide whether to close again.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.consecutive_failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            self._trial_in_flight = False
+            if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.times_opened += 1
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+
+class OpenAIClientManager:
+    """
+    Process-wide OpenAI client: one keep-alive connection pool shared by
+    all threads, a cap on concurrent in-flight calls and a circuit breaker
+    so a degraded upstream fails fast instead of holding callers for the
+    full timeout.
+    """
+
+    def __init__(self, max_concurrency=8, acquire_timeout=1.0, timeout=30.0, max_retries=1,
+                 failure_threshold=5, reset_timeout=30):
+        self.max_concurrency = max_concurrency
+        self.acquire_timeout = acquire_timeout
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._client = None
+        self._client_config = None
+        self._lock = threading.Lock()
+        self._counters = {'calls': 0, 'successes': 0, 'failures': 0, 'rejected': 0, 'in_flight': 0}
+        self._total_latency = 0.0
+
+    def client(self):
+        """Shared client, rebuilt only when the API key or base URL change"""
+        config = (os.environ.get('OPENAI_API_KEY'), os.environ.get('OPENAI_BASE_URL') or None)
+        if not config[0]:
+            raise ValueError("OpenAI API key not found")
+
+        with self._lock:
+            if self._client is None or self._client_config != config:
+                if self._client is not None:
+                    self._client.close()
+                self._client = openai.OpenAI(
+                    api_key=config[0],
+                    base_url=config[1],
+                    timeout=self.timeout,
+                    max_retries=self.max_retries,
+                    http_client=httpx.Client(
+                        limits=httpx.Limits(
+                            max_connections=self.max_concurrency,
+                            max_keepalive_connections=self.max_concurrency
+                        ),
+                        timeout=self.timeout
+                    )
+                )
+                self._client_config = config
+            return self._client
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def chat_completion(self, **kwargs):
+        """
+        client.chat.completions.create() behind the concurrency limit and
+        circuit breaker. Raises LLMUnavailable when the call is rejected.
+        """
+        client = self.client()
+
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            self._count('rejected')
+            raise LLMUnavailable('Too many concurrent model calls')
+        if not self.breaker.allow():
+            self._slots.release()
+            self._count('rejected')
+            raise LLMUnavailable('Circuit breaker is open')
+
+        self._count('calls')
+        self._count('in_flight')
+        started = time.monotonic()
+        outcome = 'success'
+        try:
+            response = client.chat.completions.create(**kwargs)
+        except UPSTREAM_ERRORS:
+            outcome = 'upstream_error'
+            self._count('failures')
+            self.breaker.record_failure()
+            raise
+        except Exception:
+            # The upstream answered (e.g. a 4xx), so it is not unhealthy
+            outcome = 'error'
+            self.breaker.record_success()
+            raise
+        finally:
+            elapsed = time.monotonic() - started
+            OPENAI_LATENCY.observe(elapsed, outcome=outcome)
+            with self._lock:
+                self._counters['in_flight'] -= 1
+                self._total_latency += elapsed
+            self._slots.release()
+
+        self._count('successes')
+        self.breaker.record_success()
+        return response
+
+    def metrics(self):
+        with self._lock:
+            metrics = dict(self._counters)
+            finished = metrics['calls'] - metrics['in_flight']
+            metrics['avg_latency_seconds'] = self._total_latency / finished if finished else 0.0
+        metrics['max_concurrency'] = self.max_concurrency
+        metrics['pool_utilization'] = metrics['in_flight'] / self.max_concurrency
+        metrics['breaker_state'] = self.breaker.state
+        metrics['breaker_consecutive_failures'] = self.breaker.consecutive_failures
+        metrics['breaker_times_opened'] = self.breaker.times_opened
+        return metrics
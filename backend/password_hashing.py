@@ -0,0 +1,144 @@
+"""
+bcrypt hashing on a dedicated, size-limited process pool.
+
+    python password_hashing.py --target-ms 250   # pick BCRYPT_LOG_ROUNDS for this host
+"""
+import argparse
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+
+from flask_bcrypt import generate_password_hash, check_password_hash
+
+from metrics import BCRYPT_LATENCY
+
+DEFAULT_ROUNDS = 12
+
+
+class HashingPoolSaturated(Exception):
+    """Raised when the hashing pool queue is full or a hash does not finish in time"""
+
+
+# Executed in the worker processes
+def _hash_password(password, rounds):
+    return generate_password_hash(password, rounds).decode('utf-8')
+
+
+def _verify_password(pw_hash, password):
+    return check_password_hash(pw_hash, password)
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt on `workers` processes so authentication bursts cannot
+    starve request threads of CPU. At most `max_queue` operations wait
+    behind the busy workers; beyond that calls fail fast with
+    HashingPoolSaturated.
+    """
+
+    def __init__(self, workers=2, max_queue=32, rounds=DEFAULT_ROUNDS, timeout=10.0):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.rounds = rounds
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(workers + max_queue)
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._counters = {'hashed': 0, 'verified': 0, 'rejected': 0, 'pending': 0}
+
+    def _get_executor(self):
+        # Created lazily (and again after a fork) so each server worker owns its pool.
+        # Hash workers are forked from a single-threaded forkserver that only preloads
+        # this module, never from the multi-threaded server process, whose locks (logging,
+        # MongoDB pools, background indexes) could be held mid-fork.
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                context = multiprocessing.get_context('forkserver')
+                context.set_forkserver_preload([__name__])
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+                self._pid = os.getpid()
+            return self._executor
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def _release(self, _future):
+        self._count('pending', -1)
+        self._slots.release()
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            self._count('rejected')
+            raise HashingPoolSaturated('Password hashing queue is full')
+        self._count('pending')
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except Exception:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            self._count('rejected')
+            raise HashingPoolSaturated('Password hashing timed out')
+
+    def hash(self, password):
+        with BCRYPT_LATENCY.time(operation='hash'):
+            pw_hash = self._run(_hash_password, password, self.rounds)
+        self._count('hashed')
+        return pw_hash
+
+    def verify(self, pw_hash, password):
+        with BCRYPT_LATENCY.time(operation='verify'):
+            result = self._run(_verify_password, pw_hash, password)
+        self._count('verified')
+        return result
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        stats.update(workers=self.workers, max_queue=self.max_queue, rounds=self.rounds)
+        return stats
+
+
+def measure_rounds(rounds, samples=3):
+    """Average seconds for one bcrypt hash at the given cost factor"""
+    started = time.perf_counter()
+    for _ in range(samples):
+        _hash_password('calibration-password', rounds)
+    return (time.perf_counter() - started) / samples
+
+
+def calibrate(target_ms=250, min_rounds=10, max_rounds=16, samples=3):
+    """
+    Highest cost factor whose hash time stays within target_ms on this
+    host (never below min_rounds). Returns (rounds, {rounds: ms}).
+    """
+    timings = {}
+    chosen = min_rounds
+    for rounds in range(min_rounds, max_rounds + 1):
+        timings[rounds] = measure_rounds(rounds, samples) * 1000
+        if timings[rounds] > target_ms:
+            break
+        chosen = rounds
+    return chosen, timings
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Pick a bcrypt cost factor for a target per-hash latency')
+    parser.add_argument('--target-ms', type=float, default=250)
+    parser.add_argument('--min-rounds', type=int, default=10)
+    parser.add_argument('--max-rounds', type=int, default=16)
+    parser.add_argument('--samples', type=int, default=3)
+    args = parser.parse_args()
+
+    rounds, timings = calibrate(args.target_ms, args.min_rounds, args.max_rounds, args.samples)
+    for cost, ms in timings.items():
+        print(f"rounds={cost:2d}  {ms:8.1f} ms/hash")
+    print(f"\nBCRYPT_LOG_ROUNDS={rounds}")
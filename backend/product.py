@@ -1,121 +1,307 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, current_app, request, jsonify, make_response, stream_with_context
 from bson.objectid import ObjectId
 import datetime
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from functools import wraps
+from flask_jwt_extended import jwt_required
+from identity import current_identity
+from style_matching import get_catalog_index, invalidate_catalog_index, match_product, ProductFeatureIndex, INDEX_PROJECTION
+from style_profile import admin_required
+from catalog_import import import_stream, text_stream, MongoCheckpoint, DEFAULT_BATCH_SIZE, MAX_BATCH_SIZE
+from http_cache import make_etag, is_not_modified, not_modified_response, set_cache_headers, source_validators
+from catalog_export import export_cursor, encode_export, parse_updated_since, FORMATS as EXPORT_FORMATS
+from catalog_export import DEFAULT_BATCH_SIZE as EXPORT_BATCH_SIZE
+from catalog_queries import parse_projection, project_document, parse_listing, listing_sort, listing_response
+from catalog_queries import keyset_find, keyset_page, order_by_ids, facet_pipeline, facet_results
+from catalog_queries import match_chunks, match_projection, page_matches, merge_facet_counts
+from catalog_queries import recommendations_response, RECOMMENDATION_COUNT, DEFAULT_RECOMMENDATIONS_SORT
+from catalog_queries import catalog_wide_facets, facet_page_sort
+from search_index import INDEX_PROJECTION as TEXT_PROJECTION
+from similarity_index import profile_text, SimilarityIndexUnavailable
 
 # Initialize blueprint
 product_bp = Blueprint('product', __name__)
 
+# In-process copies of the catalog a response may be served from
+def catalog_sources():
+    sources = [getattr(product_bp, 'replica', None)]
+    if request.args.get('search'):
+        sources.append(getattr(product_bp, 'search_index', None))
+    return sources
+
+# Answer conditional GETs of catalog-wide responses (listings, categories) from the
+# catalog version before any query runs; fresh 200s get ETag/Cache-Control headers
+def catalog_conditional(kind):
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            tracker = getattr(product_bp, 'catalog_version', None)
+            if tracker is None:
+                return view(*args, **kwargs)
+            etag, last_modified = source_validators(*tracker.get(), catalog_sources())
+            if is_not_modified(etag, last_modified):
+                return not_modified_response(etag, last_modified, kind)
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200:
+                set_cache_headers(response, etag, last_modified, kind)
+            return response
+        return wrapper
+    return decorator
+
+# Fetch products by id, keeping the order of the given ids
+def find_products_by_ids(product_ids, projection=None):
+    products = product_bp.mongo.db.products.find({'_id': {'$in': product_ids}}, projection)
+    return order_by_ids(products, product_ids)
+
 # Get all products with filtering, sorting, and pagination
 @product_bp.route('/list', methods=['GET'])
+@catalog_conditional('listing')
 def list_products():
     try:
-        # Parse query parameters
-        # Category filter
-        category = request.args.get('category', None)
-        
-        # Price range filter
-        min_price = request.args.get('min_price', None)
-        max_price = request.args.get('max_price', None)
-        
-        # Text search
-        search = request.args.get('search', None)
-        
-        # Sorting
-        sort_by = request.args.get('sort_by', 'created_at')
-        sort_order = request.args.get('sort_order', 'desc')
-        
-        # Pagination
-        page = int(request.args.get('page', 1))
-        per_page = int(request.args.get('per_page', 12))
-        
-        # Build query filters
-        query = {}
-        
-        if category:
-            query['categories'] = category
-            
-        if min_price or max_price:
-            price_query = {}
-            if min_price:
-                price_query['$gte'] = float(min_price)
-            if max_price:
-                price_query['$lte'] = float(max_price)
-            query['price'] = price_query
-            
-        if search:
-            query['$or'] = [
-                {'name': {'$regex': search, '$options': 'i'}},
-                {'description': {'$regex': search, '$options': 'i'}}
-            ]
-        
-        # Set up sorting
-        sort_direction = -1 if sort_order == 'desc' else 1
-        sort_options = {sort_by: sort_direction}
-        
-        # Calculate skip value for pagination
-        skip = (page - 1) * per_page
-        
-        # Execute query with pagination
-        total_products = product_bp.mongo.db.products.count_documents(query)
-        products = list(product_bp.mongo.db.products.find(query)
-                        .sort(list(sort_options.items()))
-                        .skip(skip)
-                        .limit(per_page))
-        
-        # Format products for response
-        formatted_products = []
-        for product in products:
-            product['_id'] = str(product['_id'])
-            # Convert datetime objects
-            if 'created_at' in product:
-                product['created_at'] = product['created_at'].isoformat()
-            if 'updated_at' in product:
-                product['updated_at'] = product['updated_at'].isoformat()
-            formatted_products.append(product)
-        
-        # Calculate total pages
-        total_pages = (total_products + per_page - 1) // per_page
-        
-        return jsonify({
-            'products': formatted_products,
-            'page': page,
-            'per_page': per_page,
-            'total_products': total_products,
-            'total_pages': total_pages
-        })
+        # Filters, sort, paging and projection (fields= or view=) come from the shared
+        # parser; text search goes through the inverted index when one is attached
+        try:
+            listing = parse_listing(request.args, getattr(product_bp, 'search_index', None))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        products_collection = product_bp.mongo.db.products
+        projection = listing['projection']
+        matches = listing['matches']
+        total_products = None
+        next_cursor = None
+        facet_counts = None
+        
+        # Serve from the in-memory catalog replica when it is loaded and can answer the filters
+        replica = getattr(product_bp, 'replica', None)
+        if replica is not None and not replica.loaded:
+            replica = None
+        use_replica = (replica is not None and not listing['facets'] and listing['cursor'] is None
+                       and (not listing['search'] or matches is not None)
+                       and not (listing['color'] or listing['material']) and replica.can_sort_by(listing['sort_by']))
+        facet_cache = getattr(product_bp, 'facet_counts', None)
+        tracker = getattr(product_bp, 'catalog_version', None)
+        if listing['facets'] and catalog_wide_facets(listing) and facet_cache is not None and tracker is not None:
+            # Counts over the whole catalog come from the per-catalog-version cache; the page
+            # itself is an indexed find
+            version, _ = tracker.get()
+            cached = facet_cache.get(version, listing)
+            if cached is None:
+                result = next(products_collection.aggregate(facet_pipeline(listing, with_products=False)))
+                total, _, counts = facet_results(result)
+                cached = facet_cache.put(version, listing, (total, counts))
+            total_products, facet_counts = cached
+            products = list(products_collection.find(listing['query'], projection)
+                            .sort(facet_page_sort(listing))
+                            .skip(listing['skip'])
+                            .limit(listing['per_page']))
+        elif use_replica:
+            total_products, products = replica.query(
+                product_ids=[product_id for product_id, _ in matches] if matches is not None else None,
+                category=listing['category'],
+                min_price=listing['min_price'],
+                max_price=listing['max_price'],
+                sort_by=listing['sort_by'],
+                sort_direction=listing['sort_direction'],
+                skip=listing['skip'],
+                limit=listing['per_page']
+            )
+            products = [project_document(product, projection) for product in products]
+        elif matches is not None:
+            # Apply the remaining filters to every search match, a chunk of ids at a time,
+            # then sort and page the survivors here
+            filtered = []
+            for chunk_query in match_chunks(listing):
+                filtered += products_collection.find(chunk_query, match_projection(listing))
+            try:
+                total_products, page_ids, next_cursor = page_matches(listing, filtered)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            products = find_products_by_ids(page_ids, projection)
+            if listing['facets']:
+                total_products, facet_counts = merge_facet_counts(
+                    facet_results(next(products_collection.aggregate(
+                        facet_pipeline(dict(listing, query=chunk_query), with_products=False)
+                    )))
+                    for chunk_query in match_chunks(listing)
+                )
+        elif listing['facets']:
+            result = next(products_collection.aggregate(facet_pipeline(listing)))
+            total_products, products, facet_counts = facet_results(result)
+        elif listing['cursor'] is not None:
+            try:
+                query, cursor_projection, sort, limit = keyset_find(listing)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            products = list(products_collection.find(query, cursor_projection).sort(sort).limit(limit))
+            products, next_cursor = keyset_page(products, listing)
+        else:
+            # Execute query with pagination
+            total_products = products_collection.count_documents(listing['query'])
+            products = list(products_collection.find(listing['query'], projection)
+                            .sort(listing_sort(listing))
+                            .skip(listing['skip'])
+                            .limit(listing['per_page']))
+        
+        return jsonify(listing_response(listing, products, total_products, next_cursor, facet_counts))
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 # Get all product categories
 @product_bp.route('/categories', methods=['GET'])
+@catalog_conditional('categories')
 def get_categories():
     try:
         # Aggregate all unique categories
-        categories = product_bp.mongo.db.products.distinct('categories')
+        replica = getattr(product_bp, 'replica', None)
+        if replica is not None and replica.loaded:
+            categories = replica.categories()
+        else:
+            categories = product_bp.mongo.db.products.distinct('categories')
         return jsonify({'categories': categories})
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# Bulk import an NDJSON or CSV catalog from the request body, upserting by SKU.
+# Pass the same import_id again to resume after the last committed batch.
+@product_bp.route('/import', methods=['POST'])
+@admin_required
+def import_catalog():
+    try:
+        data_format = request.args.get('format') or ('csv' if 'csv' in (request.content_type or '') else 'ndjson')
+        try:
+            batch_size = int(request.args.get('batch_size', DEFAULT_BATCH_SIZE))
+        except ValueError:
+            return jsonify({'error': 'batch_size must be an integer'}), 400
+        if batch_size < 1 or batch_size > MAX_BATCH_SIZE:
+            return jsonify({'error': f"batch_size must be between 1 and {MAX_BATCH_SIZE}"}), 400
+        import_id = request.args.get('import_id', None)
+        checkpoint = MongoCheckpoint(product_bp.mongo.db.catalog_imports, import_id) if import_id else None
+        
+        report = import_stream(
+            product_bp.mongo.db.products,
+            text_stream(request.stream),
+            data_format,
+            batch_size=batch_size,
+            checkpoint=checkpoint
+        )
+        invalidate_catalog_index()
+        if getattr(product_bp, 'catalog_version', None) is not None:
+            product_bp.catalog_version.invalidate()
+        return jsonify(report)
+    
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Stream the catalog (or products changed since ?updated_since=) as NDJSON or a JSON
+# array, gzipped when the client accepts it. Records come oldest change first and
+# X-Export-Started-At is a safe updated_since for the next incremental export.
+@product_bp.route('/export', methods=['GET'])
+def export_products():
+    try:
+        data_format = request.args.get('format', 'ndjson')
+        if data_format not in EXPORT_FORMATS:
+            return jsonify({'error': f"Unknown format '{data_format}', expected one of: {', '.join(EXPORT_FORMATS)}"}), 400
+        
+        try:
+            projection = parse_projection(request.args)
+            updated_since = request.args.get('updated_since', None)
+            updated_since = parse_updated_since(updated_since) if updated_since else None
+            batch_size = int(request.args.get('batch_size', EXPORT_BATCH_SIZE))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        started_at = datetime.datetime.now()
+        cursor = export_cursor(product_bp.mongo.db.products, updated_since, projection, batch_size)
+        compress = request.accept_encodings['gzip'] > 0 and request.args.get('gzip', 'true') != 'false'
+        
+        response = Response(
+            stream_with_context(encode_export(cursor, data_format, current_app.json.dumps, compress)),
+            mimetype=EXPORT_FORMATS[data_format]
+        )
+        response.headers['X-Export-Started-At'] = started_at.isoformat()
+        response.headers['Vary'] = 'Accept-Encoding'
+        if compress:
+            response.headers['Content-Encoding'] = 'gzip'
+        return response
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Largest number of ids /batch resolves in one call
+MAX_BATCH_IDS = 500
+
+# Fetch many products at once: GET ?ids=a,b,c or POST {"ids": [...]}, with the same
+# fields=/view= projection as listings. Products come back in request order.
+@product_bp.route('/batch', methods=['GET', 'POST'])
+def get_products_batch():
+    try:
+        options = dict(request.args.items())
+        if request.method == 'POST':
+            data = request.get_json(silent=True) or {}
+            ids = data.get('ids', [])
+            for key in ('fields', 'view'):
+                if key in data:
+                    value = data[key]
+                    options[key] = ','.join(value) if isinstance(value, list) else value
+        else:
+            ids = [pid for pid in request.args.get('ids', '').split(',') if pid]
+        
+        if not isinstance(ids, list):
+            return jsonify({'error': 'ids must be a list'}), 400
+        if len(ids) > MAX_BATCH_IDS:
+            return jsonify({'error': f"At most {MAX_BATCH_IDS} ids per request"}), 400
+        
+        try:
+            projection = parse_projection(options)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        # Invalid ids are reported as missing; duplicates are resolved once
+        object_ids = []
+        seen = set()
+        missing = []
+        for pid in ids:
+            if isinstance(pid, str) and ObjectId.is_valid(pid):
+                object_id = ObjectId(pid)
+                if object_id not in seen:
+                    seen.add(object_id)
+                    object_ids.append(object_id)
+            else:
+                missing.append(pid)
+        
+        products = find_products_by_ids(object_ids, projection) if object_ids else []
+        found = {product['_id'] for product in products}
+        missing += [str(object_id) for object_id in object_ids if object_id not in found]
+        
+        return jsonify({
+            'products': products,
+            'missing': missing
+        })
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 # Get single product by ID
 @product_bp.route('/<product_id>', methods=['GET'])
 def get_product(product_id):
     try:
+        if not ObjectId.is_valid(product_id):
+            return jsonify({'error': 'Invalid product id'}), 400
         product = product_bp.mongo.db.products.find_one({'_id': ObjectId(product_id)})
         
         if not product:
             return jsonify({'error': 'Product not found'}), 404
         
-        # Format product for response
-        product['_id'] = str(product['_id'])
-        if 'created_at' in product:
-            product['created_at'] = product['created_at'].isoformat()
-        if 'updated_at' in product:
-            product['updated_at'] = product['updated_at'].isoformat()
-            
-        return jsonify({'product': product})
+        # Validators come from the document itself, so a 304 skips serialization
+        etag = make_etag(product['_id'], product.get('updated_at'))
+        if is_not_modified(etag, product.get('updated_at')):
+            return not_modified_response(etag, product.get('updated_at'), 'product')
+        
+        return set_cache_headers(jsonify({'product': product}), etag, product.get('updated_at'), 'product')
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -125,88 +311,166 @@ def get_product(product_id):
 @jwt_required()
 def get_recommendations():
     try:
-        # Get user ID from JWT
-        current_user_id = get_jwt_identity()
+        # User and style profile come from the request's identity (one lookup)
+        identity = current_identity()
+        style_profile = identity.style_profile
         
-        # Find user's style profile
-        user = product_bp.mongo.db.users.find_one({
-            '_id': ObjectId(current_user_id)
-        })
+        try:
+            projection = parse_projection(request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
         # Default recommendations if no style profile
-        if not user or not user.get('style_profile'):
+        if not style_profile:
             # Just return some newest products
-            products = list(product_bp.mongo.db.products.find()
-                            .sort('created_at', -1)
-                            .limit(6))
-            
-            # Format products
-            for product in products:
-                product['_id'] = str(product['_id'])
-                if 'created_at' in product:
-                    product['created_at'] = product['created_at'].isoformat()
-                if 'updated_at' in product:
-                    product['updated_at'] = product['updated_at'].isoformat()
+            products = list(product_bp.mongo.db.products.find({}, projection)
+                            .sort(DEFAULT_RECOMMENDATIONS_SORT)
+                            .limit(RECOMMENDATION_COUNT))
             
-            return jsonify({
-                'products': products,
-                'message': 'Default recommendations (no style profile)'
-            })
+            return jsonify(recommendations_response(products, personalized=False))
+        
+        # Serve the user's materialized ranking when it is current
+        preferences = style_profile.get('preferences', {})
+        user_id = style_profile['user_id']
+        store = product_bp.recommendations
+        materialized = store.get(user_id, preferences)
+        if materialized:
+            products = [project_document(item['product'], projection)
+                        for item in materialized['items'][:RECOMMENDATION_COUNT]]
+        else:
+            # Stale or missing: rank the whole catalog in one pass and rematerialize in the background
+            index = get_catalog_index(product_bp.mongo.db)
+            ranked = index.top_k(preferences, RECOMMENDATION_COUNT)
+            products = find_products_by_ids([product_id for product_id, _, _ in ranked], projection)
+            store.refresh(user_id, preferences)
+        
+        return jsonify(recommendations_response(products, personalized=True))
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Largest number of results the similarity endpoints return
+MAX_SIMILAR = 50
+
+# Response while no similarity index snapshot has been loaded yet
+def similarity_unavailable():
+    response = jsonify({'error': 'Similar products are not available yet, please retry shortly'})
+    response.headers['Retry-After'] = '30'
+    return response, 503
+
+# Pair similarity results with their products (in the requested projection)
+def similarity_results(ranked, projection=None):
+    products = {p['_id']: p for p in find_products_by_ids([product_id for product_id, _ in ranked], projection)}
+    return [
+        {'product': products[product_id], 'similarity': similarity}
+        for product_id, similarity in ranked if product_id in products
+    ]
+
+# Products whose text (name, description, categories, attributes) is closest to the user's
+# style profile: its AI analysis description and keywords plus the questionnaire answers
+@product_bp.route('/profile-matches', methods=['GET'])
+@jwt_required()
+def get_profile_matches():
+    try:
+        try:
+            limit = min(int(request.args.get('limit', 12)), MAX_SIMILAR)
+            projection = parse_projection(request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        style_profile = current_identity().style_profile
+        if not style_profile:
+            return jsonify({'results': [], 'has_style_profile': False})
         
-        # Get the style profile
-        style_profile = product_bp.mongo.db.style_profiles.find_one({
-            '_id': user['style_profile']
+        ranked = product_bp.similarity_index.search(profile_text(style_profile), limit)
+        return jsonify({
+            'results': similarity_results(ranked, projection),
+            'has_style_profile': True
         })
+    
+    except SimilarityIndexUnavailable:
+        return similarity_unavailable()
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Products most similar to the given one by text, from the local similarity index
+@product_bp.route('/<product_id>/similar', methods=['GET'])
+def get_similar_products(product_id):
+    try:
+        if not ObjectId.is_valid(product_id):
+            return jsonify({'error': 'Invalid product id'}), 400
+        try:
+            limit = min(int(request.args.get('limit', 10)), MAX_SIMILAR)
+            projection = parse_projection(request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        product = product_bp.mongo.db.products.find_one({'_id': ObjectId(product_id)}, TEXT_PROJECTION)
+        if not product:
+            return jsonify({'error': 'Product not found'}), 404
         
-        # Use style preferences to find matching products
-        preferences = style_profile.get('preferences', {})
+        ranked = product_bp.similarity_index.similar(product, limit)
+        return jsonify({
+            'product_id': product['_id'],
+            'results': similarity_results(ranked, projection)
+        })
+    
+    except SimilarityIndexUnavailable:
+        return similarity_unavailable()
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Score a batch of products (or the whole catalog) against the user's style profile
+@product_bp.route('/style-match', methods=['POST'])
+@jwt_required()
+def batch_style_match():
+    try:
+        # Candidate ids are optional, without them the whole catalog is ranked
+        data = request.get_json(silent=True) or {}
+        product_ids = data.get('product_ids')
+        try:
+            limit = int(data.get('limit', 10))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'limit must be an integer'}), 400
+        if product_ids is not None and not isinstance(product_ids, list):
+            return jsonify({'error': 'product_ids must be a list'}), 400
+        if product_ids and len(product_ids) > MAX_BATCH_IDS:
+            return jsonify({'error': f"At most {MAX_BATCH_IDS} product_ids per request"}), 400
+        invalid = [pid for pid in product_ids or [] if not (isinstance(pid, str) and ObjectId.is_valid(pid))]
+        if invalid:
+            return jsonify({'error': 'Invalid product ids', 'invalid_ids': invalid}), 400
         
-        # Build a query based on preferences
-        query = {}
-        
-        # Example: Filter by occasion if it exists in the profile
-        if 'occasion' in preferences:
-            occasion = preferences['occasion']
-            if occasion == 'formal':
-                query['categories'] = {'$in': ['formal', 'business']}
-            elif occasion == 'casual':
-                query['categories'] = {'$in': ['casual', 'everyday']}
-            # Add more occasion mappings as needed
-        
-        # Match colors if specified
-        if 'color_palette' in preferences:
-            color = preferences['color_palette']
-            if color == 'neutrals':
-                query['attributes.color'] = {'$in': ['black', 'white', 'gray', 'beige']}
-            elif color == 'earth_tones':
-                query['attributes.color'] = {'$in': ['brown', 'olive', 'rust']}
-            # Add more color mappings as needed
-        
-        # Find matching products
-        products = list(product_bp.mongo.db.products.find(query).limit(6))
-        
-        # If not enough matches, supplement with general products
-        if len(products) < 6:
-            additional_count = 6 - len(products)
-            existing_ids = [p['_id'] for p in products]
-            additional_products = list(
-                product_bp.mongo.db.products.find({'_id': {'$nin': existing_ids}})
-                .sort('created_at', -1)
-                .limit(additional_count)
+        # Find user's style profile
+        style_profile = current_identity().style_profile
+        preferences = style_profile.get('preferences', {}) if style_profile else {}
+        
+        # Score every candidate in a single matrix operation
+        if product_ids:
+            candidates = product_bp.mongo.db.products.find(
+                {'_id': {'$in': [ObjectId(pid) for pid in product_ids]}},
+                INDEX_PROJECTION
             )
-            products.extend(additional_products)
-        
-        # Format products for response
-        for product in products:
-            product['_id'] = str(product['_id'])
-            if 'created_at' in product:
-                product['created_at'] = product['created_at'].isoformat()
-            if 'updated_at' in product:
-                product['updated_at'] = product['updated_at'].isoformat()
+            index = ProductFeatureIndex(candidates)
+        else:
+            index = get_catalog_index(product_bp.mongo.db)
+        ranked = index.top_k(preferences, limit)
+        products = {p['_id']: p for p in find_products_by_ids([product_id for product_id, _, _ in ranked])}
+        
+        # Pair products with their scores
+        results = []
+        for product_id, match_score, match_reasons in ranked:
+            product = products.get(product_id)
+            if not product:
+                continue
+            results.append({
+                'product': product,
+                'match_score': match_score,
+                'match_reasons': match_reasons
+            })
         
         return jsonify({
-            'products': products,
-            'message': 'Personalized recommendations based on style profile'
+            'results': results,
+            'has_style_profile': bool(preferences)
         })
         
     except Exception as e:
@@ -217,26 +481,16 @@ def get_recommendations():
 @jwt_required()
 def get_product_with_style_match(product_id):
     try:
-        # Get current user ID from JWT token
-        current_user_id = get_jwt_identity()
-        
+        if not ObjectId.is_valid(product_id):
+            return jsonify({'error': 'Invalid product id'}), 400
         # Find the product
         product = product_bp.mongo.db.products.find_one({'_id': ObjectId(product_id)})
         
         if not product:
             return jsonify({'error': 'Product not found'}), 404
         
-        # Format product for response
-        product['_id'] = str(product['_id'])
-        if 'created_at' in product:
-            product['created_at'] = product['created_at'].isoformat()
-        if 'updated_at' in product:
-            product['updated_at'] = product['updated_at'].isoformat()
-        
         # Get user's style profile if available
-        user = product_bp.mongo.db.users.find_one({
-            '_id': ObjectId(current_user_id)
-        })
+        style_profile = current_identity().style_profile
         
         style_match = {
             'has_style_profile': False,
@@ -244,43 +498,11 @@ def get_product_with_style_match(product_id):
             'match_reasons': []
         }
         
-        if user and user.get('style_profile'):
-            # Get the style profile
-            style_profile = product_bp.mongo.db.style_profiles.find_one({
-                '_id': user['style_profile']
-            })
-            
-            if style_profile and style_profile.get('preferences'):
-                style_match['has_style_profile'] = True
-                preferences = style_profile['preferences']
-                
-                # Calculate match score and reasons
-                match_score = 0
-                match_reasons = []
-                
-                # Example matching logic - customize based on your preferences and product attributes
-                # Match by category
-                if 'occasion' in preferences and product.get('categories'):
-                    if preferences['occasion'] == 'formal' and any(c in ['formal', 'business'] for c in product['categories']):
-                        match_score += 25
-                        match_reasons.append('Matches your formal style preference')
-                    elif preferences['occasion'] == 'casual' and any(c in ['casual', 'everyday'] for c in product['categories']):
-                        match_score += 25
-                        match_reasons.append('Perfect for your casual style')
-                
-                # Match by color
-                if 'color_palette' in preferences and product.get('attributes', {}).get('color'):
-                    color = product['attributes']['color']
-                    if preferences['color_palette'] == 'neutrals' and color in ['black', 'white', 'gray', 'beige']:
-                        match_score += 25
-                        match_reasons.append('Fits your neutral color palette')
-                    elif preferences['color_palette'] == 'earth_tones' and color in ['brown', 'olive', 'rust']:
-                        match_score += 25
-                        match_reasons.append('Complements your earth tone preference')
-                
-                # Set final match info
-                style_match['match_score'] = min(match_score, 100)  # Cap at 100%
-                style_match['match_reasons'] = match_reasons
+        if style_profile and style_profile.get('preferences'):
+            style_match['has_style_profile'] = True
+            match_score, match_reasons = match_product(product, style_profile['preferences'])
+            style_match['match_score'] = match_score
+            style_match['match_reasons'] = match_reasons
         
         return jsonify({
             'product': product,
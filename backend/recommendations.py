@@ -0,0 +1,234 @@
+import datetime
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from pymongo import ReplaceOne
+from pymongo.errors import DuplicateKeyError
+
+from analysis_jobs import preferences_hash
+from catalog_replica import catalog_state
+from style_matching import get_catalog_index, invalidate_catalog_index
+
+logger = logging.getLogger(__name__)
+
+
+def catalog_version(db):
+    """Cheap fingerprint of the catalog: product count and newest updated_at"""
+    return catalog_version_key(*catalog_state(db))
+
+
+def catalog_version_key(count, updated_at):
+    return f"{count}:{updated_at.isoformat() if updated_at else ''}"
+
+
+def acquire_lease(collection, name, owner, ttl):
+    """
+    Take (or extend) the named lease for `owner` unless another owner holds
+    an unexpired one. The upsert collides on _id when the lease is held.
+    """
+    now = datetime.datetime.now()
+    try:
+        collection.find_one_and_update(
+            {'_id': name, '$or': [{'owner': owner}, {'expires_at': {'$lt': now}}]},
+            {'$set': {'owner': owner, 'expires_at': now + datetime.timedelta(seconds=ttl)}},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        return False
+
+
+def release_lease(collection, name, owner):
+    collection.delete_one({'_id': name, 'owner': owner})
+
+
+def is_current(document, preferences, version):
+    """Whether a materialized document was ranked for these preferences against this catalog version"""
+    return bool(document
+                and document.get('preferences_hash') == preferences_hash(preferences)
+                and document.get('catalog_version') == version)
+
+
+class RecommendationStore:
+    """
+    Materialized top-N recommendations per user in `user_recommendations`.
+
+    Each document carries the ranked product snapshots, the hash of the
+    preferences they were ranked for and the catalog version they were
+    ranked against, so serving them is one indexed read. A saved profile
+    refreshes its user in the background; a catalog change (new count or
+    newest updated_at) refreshes every user in bulk. Documents that do not
+    match the current preferences or catalog version are treated as missing.
+
+    Every process tracks the catalog version, but only the one holding the
+    `recommendations-refresh` lease runs the bulk pass; the others serve
+    live rankings until it lands. With bulk_refresh=False a process never
+    takes the lease, leaving the bulk pass to `python recommendations.py
+    refresh` from cron.
+    """
+
+    LEASE = 'recommendations-refresh'
+
+    def __init__(self, db, size=12, max_workers=2, check_interval=60, batch_size=500,
+                 bulk_refresh=True, lease_ttl=900):
+        self.db = db
+        self.size = size
+        self.check_interval = check_interval
+        self.batch_size = batch_size
+        self.bulk_refresh = bulk_refresh
+        self.lease_ttl = lease_ttl
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.catalog_version = None
+        self.last_check = 0.0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='recommendations')
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _document(self, index, products, user_id, preferences, version):
+        items = []
+        for product_id, score, reasons in index.top_k(preferences, self.size):
+            product = products.get(product_id)
+            if product:
+                items.append({'product': product, 'match_score': score, 'match_reasons': reasons})
+        return {
+            'user_id': user_id,
+            'preferences_hash': preferences_hash(preferences),
+            'catalog_version': version,
+            'items': items,
+            'computed_at': datetime.datetime.now()
+        }
+
+    def _snapshots(self, product_ids):
+        return {p['_id']: p for p in self.db.products.find({'_id': {'$in': list(product_ids)}})}
+
+    def compute(self, user_id, preferences):
+        """Rank the catalog for one user and store the result"""
+        version = self.catalog_version or catalog_version(self.db)
+        index = get_catalog_index(self.db, wait=True)
+        ranked = index.top_k(preferences, self.size)
+        products = self._snapshots(product_id for product_id, _, _ in ranked)
+        document = self._document(index, products, user_id, preferences, version)
+        self.db.user_recommendations.replace_one({'user_id': user_id}, document, upsert=True)
+        return document
+
+    def get(self, user_id, preferences):
+        """The materialized document if it is current, else None"""
+        self.ensure_fresh()
+        document = self.db.user_recommendations.find_one({'user_id': user_id})
+        return document if is_current(document, preferences, self.catalog_version) else None
+
+    def refresh(self, user_id, preferences):
+        """Recompute one user in the background; repeated calls while queued are coalesced"""
+        with self._lock:
+            if user_id in self._pending:
+                return
+            self._pending.add(user_id)
+        self._executor.submit(self._refresh, user_id, preferences)
+
+    def _refresh(self, user_id, preferences):
+        with self._lock:
+            self._pending.discard(user_id)
+        try:
+            self.compute(user_id, preferences)
+        except Exception:
+            logger.exception("Recommendation refresh failed", extra={'user_id': user_id})
+
+    def refresh_all(self):
+        """Recompute every user with a style profile, in bulk batches. Returns the number refreshed"""
+        version = self.catalog_version or catalog_version(self.db)
+        index = get_catalog_index(self.db, wait=True)
+        profiles = self.db.style_profiles.find({}, {'user_id': 1, 'preferences': 1})
+        refreshed = 0
+        batch = []
+        for profile in profiles:
+            batch.append(profile)
+            if len(batch) >= self.batch_size:
+                refreshed += self._write_batch(index, batch, version)
+                batch = []
+        if batch:
+            refreshed += self._write_batch(index, batch, version)
+        return refreshed
+
+    def _write_batch(self, index, profiles, version):
+        rankings = [(p, index.top_k(p.get('preferences', {}), self.size)) for p in profiles]
+        products = self._snapshots({product_id for _, ranked in rankings for product_id, _, _ in ranked})
+        operations = []
+        for profile, _ in rankings:
+            document = self._document(index, products, profile['user_id'], profile.get('preferences', {}), version)
+            operations.append(ReplaceOne({'user_id': profile['user_id']}, document, upsert=True))
+        self.db.user_recommendations.bulk_write(operations, ordered=False)
+        return len(operations)
+
+    def check_catalog(self):
+        """
+        Track the catalog version and, when it changed since the last check,
+        run the bulk refresh if this process wins the lease. Returns True if
+        the version changed.
+        """
+        self.last_check = time.time()
+        version = catalog_version(self.db)
+        if version == self.catalog_version:
+            return False
+        self.catalog_version = version
+        invalidate_catalog_index()
+        if self.bulk_refresh:
+            self.refresh_stale()
+        return True
+
+    def refresh_stale(self):
+        """
+        Bulk refresh under the lease when some document was ranked against
+        another catalog version. Returns the number refreshed, or None when
+        nothing was stale or another process holds the lease.
+        """
+        version = self.catalog_version or catalog_version(self.db)
+        if not self.db.user_recommendations.count_documents({'catalog_version': {'$ne': version}}, limit=1):
+            return None
+        if not acquire_lease(self.db.leases, self.LEASE, self.owner, self.lease_ttl):
+            return None
+        try:
+            return self.refresh_all()
+        finally:
+            release_lease(self.db.leases, self.LEASE, self.owner)
+
+    def start(self):
+        """Track catalog changes from a daemon thread, starting with an immediate check"""
+        self._thread = threading.Thread(target=self._run, name='recommendations', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.check_catalog()
+            except Exception:
+                logger.exception("Recommendation catalog check failed")
+            time.sleep(self.check_interval)
+
+    def ensure_fresh(self):
+        """Check the catalog inline when no background thread is doing it"""
+        if self._thread is None and time.time() - self.last_check > self.check_interval:
+            self.check_catalog()
+
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+
+    load_dotenv()
+    db = MongoClient(os.environ.get('MONGO_URI', 'mongodb://localhost:27017/personashop')).get_default_database()
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+
+    if command == 'refresh':
+        # Bulk pass for deployments that run the app with RECOMMENDATIONS_BULK_REFRESH=false
+        store = RecommendationStore(db, size=int(os.environ.get("RECOMMENDATIONS_SIZE", 12)))
+        refreshed = store.refresh_all() if '--all' in sys.argv else store.refresh_stale()
+        print(f"refreshed: {refreshed or 0}")
+    else:
+        print("usage: python recommendations.py refresh [--all]")
+        sys.exit(2)
@@ -0,0 +1,266 @@
+import bisect
+import heapq
+import logging
+import math
+import re
+import threading
+import time
+
+from catalog_replica import changed_products
+
+# Relative weight of a term occurrence in each product field
+FIELD_WEIGHTS = {
+    'name': 3.0,
+    'categories': 2.0,
+    'attributes': 1.5,
+    'description': 1.0
+}
+
+# Fields needed to build the search index from the products collection
+INDEX_PROJECTION = {'name': 1, 'description': 1, 'categories': 1, 'attributes': 1, 'updated_at': 1}
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+# Prefix expansion of the last query term (search-as-you-type)
+MIN_PREFIX_LENGTH = 2
+MAX_PREFIX_EXPANSIONS = 50
+
+TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+logger = logging.getLogger(__name__)
+
+
+def _later(watermark, updated_at):
+    if updated_at and (watermark is None or updated_at > watermark):
+        return updated_at
+    return watermark
+
+
+def stem(token):
+    """Light suffix stripping so plurals and simple inflections share a term"""
+    if len(token) <= 3:
+        return token
+    if token.endswith('sses'):
+        return token[:-2]
+    if token.endswith('ies') and len(token) > 4:
+        return token[:-3] + 'y'
+    if token.endswith('ing') and len(token) > 5:
+        return token[:-3]
+    if token.endswith('ed') and len(token) > 4:
+        return token[:-2]
+    if token.endswith('s') and not token.endswith(('ss', 'us')):
+        return token[:-1]
+    return token
+
+
+def tokenize(text):
+    """Lowercase, split on non-alphanumerics and stem"""
+    return [stem(token) for token in TOKEN_RE.findall(text.lower())]
+
+
+def product_terms(product):
+    """Return {term: weighted frequency} for a product document"""
+    fields = {
+        'name': product.get('name') or '',
+        'description': product.get('description') or '',
+        'categories': ' '.join(product.get('categories') or []),
+        'attributes': ' '.join(str(v) for v in (product.get('attributes') or {}).values())
+    }
+    terms = {}
+    for field, text in fields.items():
+        for term in tokenize(text):
+            terms[term] = terms.get(term, 0.0) + FIELD_WEIGHTS[field]
+    return terms
+
+
+class _Postings:
+    """Inverted index data: built off-lock by full reloads and swapped in whole"""
+
+    def __init__(self):
+        self.postings = {}
+        self.doc_terms = {}
+        self.doc_length = {}
+        self.total_length = 0.0
+        self.sorted_terms = None
+
+    def add(self, product):
+        self.remove(product['_id'])
+        terms = product_terms(product)
+        for term, frequency in terms.items():
+            self.postings.setdefault(term, {})[product['_id']] = frequency
+        length = sum(terms.values())
+        self.doc_terms[product['_id']] = list(terms)
+        self.doc_length[product['_id']] = length
+        self.total_length += length
+        self.sorted_terms = None
+
+    def remove(self, product_id):
+        for term in self.doc_terms.pop(product_id, []):
+            postings = self.postings[term]
+            postings.pop(product_id, None)
+            if not postings:
+                del self.postings[term]
+        self.total_length -= self.doc_length.pop(product_id, 0.0)
+        self.sorted_terms = None
+
+
+class SearchIndex:
+    """
+    In-process inverted index over the products collection with BM25
+    ranking. Query cost depends on the posting lists of the query terms,
+    not on catalog size. The index follows the collection incrementally
+    by `updated_at`, like the catalog replica.
+
+    Once start()ed, a daemon thread does every build and refresh: full
+    reloads are built without the lock and swapped in, and incremental
+    changes are read before the lock is taken, so searches only ever wait
+    for a pointer swap or a small batch of updates.
+    """
+
+    def __init__(self, collection, refresh_interval=30, full_reload_interval=600):
+        self.collection = collection
+        self.refresh_interval = refresh_interval
+        self.full_reload_interval = full_reload_interval
+        self._lock = threading.RLock()
+        self._refresh_lock = threading.Lock()
+        self._thread = None
+        self._data = _Postings()
+        self.watermark = None
+        self.last_refresh = 0.0
+        self.last_full_reload = 0.0
+
+    def __len__(self):
+        return len(self._data.doc_length)
+
+    @property
+    def loaded(self):
+        return self.last_full_reload > 0
+
+    @property
+    def version(self):
+        """Changes whenever the content may have (deletions only show up at a full reload)"""
+        return self.watermark, len(self), self.last_full_reload
+
+    # Maintenance
+
+    def add(self, product):
+        """Index (or re-index) a single product document"""
+        with self._lock:
+            self._data.add(product)
+
+    def remove(self, product_id):
+        with self._lock:
+            self._data.remove(product_id)
+
+    def reload(self):
+        """Rebuild the index from scratch and swap it in"""
+        data = _Postings()
+        watermark = None
+        for doc in changed_products(self.collection, projection=INDEX_PROJECTION):
+            data.add(doc)
+            watermark = _later(watermark, doc.get('updated_at'))
+        with self._lock:
+            self._data = data
+            self.watermark = watermark
+            self.last_refresh = self.last_full_reload = time.time()
+
+    def refresh(self):
+        """Index documents changed since the last refresh (or reload, when one is due)"""
+        with self._refresh_lock:
+            if time.time() - self.last_full_reload > self.full_reload_interval:
+                self.reload()
+                return
+            documents = list(changed_products(self.collection, self.watermark, INDEX_PROJECTION))
+            with self._lock:
+                for doc in documents:
+                    self._data.add(doc)
+                    self.watermark = _later(self.watermark, doc.get('updated_at'))
+                self.last_refresh = time.time()
+
+    def start(self):
+        """Build and refresh the index from a daemon thread; searches return None until the first build"""
+        self._thread = threading.Thread(target=self._run, name='search-index', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("Search index refresh failed")
+            time.sleep(self.refresh_interval)
+
+    def ensure_fresh(self):
+        """Refresh inline when no background thread keeps the index current"""
+        if self._thread is None and time.time() - self.last_refresh > self.refresh_interval:
+            self.refresh()
+
+    # Queries
+
+    def _expand_prefix(self, prefix):
+        data = self._data
+        if data.sorted_terms is None:
+            data.sorted_terms = sorted(data.postings)
+        start = bisect.bisect_left(data.sorted_terms, prefix)
+        expansions = []
+        for term in data.sorted_terms[start:start + MAX_PREFIX_EXPANSIONS]:
+            if not term.startswith(prefix):
+                break
+            expansions.append(term)
+        return expansions
+
+    def query_terms(self, text):
+        """
+        One set of index terms per query word: its stem, plus prefix
+        expansions for the last word
+        """
+        words = TOKEN_RE.findall(text.lower())
+        groups = [{stem(word)} for word in words]
+        if words and len(words[-1]) >= MIN_PREFIX_LENGTH:
+            groups[-1].update(self._expand_prefix(words[-1]))
+        return groups
+
+    def search(self, text, limit=None):
+        """
+        Return [(product_id, score)] for products matching every query word,
+        best match first, at most `limit` of them; None while the background
+        build has not finished
+        """
+        self.ensure_fresh()
+        with self._lock:
+            if not self.loaded:
+                return None
+            data = self._data
+            doc_count = len(data.doc_length)
+            groups = self.query_terms(text)
+            if not doc_count or not groups:
+                return []
+            average_length = data.total_length / doc_count
+
+            scores = {}
+            matched_words = {}
+            for group in groups:
+                matched = set()
+                for term in group:
+                    postings = data.postings.get(term)
+                    if not postings:
+                        continue
+                    idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+                    for product_id, frequency in postings.items():
+                        norm = K1 * (1 - B + B * data.doc_length[product_id] / average_length)
+                        scores[product_id] = scores.get(product_id, 0.0) + idf * frequency * (K1 + 1) / (frequency + norm)
+                        matched.add(product_id)
+                for product_id in matched:
+                    matched_words[product_id] = matched_words.get(product_id, 0) + 1
+
+        # Highest score first, newest id first among equal scores
+        results = [
+            (product_id, score) for product_id, score in scores.items()
+            if matched_words[product_id] == len(groups)
+        ]
+        key = lambda item: (item[1], item[0])
+        if limit is not None and limit < len(results):
+            return heapq.nlargest(limit, results, key=key)
+        return sorted(results, key=key, reverse=True)
@@ -1,5 +1,9 @@
-from models import create_product
+from models import create_product, create_user, create_style_profile
+from bson.objectid import ObjectId
 import datetime
+import itertools
+import math
+import random
 
 def generate_test_products():
     products = [
@@ -100,4 +104,162 @@ def generate_test_products():
             attributes={"color": "brown", "material": "leather", "gender": "unisex"}
         )
     ]
-    return products
\ No newline at end of file
+    return products
+
+# Synthetic catalogs for load testing. Everything is drawn from a seeded
+# random.Random, so the same (seed, count) always yields the same data.
+
+# department: (share of the catalog, median price, {subcategory: item noun}, materials)
+SYNTHETIC_DEPARTMENTS = {
+    "clothing": (0.55, 55.0,
+                 {"shirts": "Shirt", "t-shirts": "T-Shirt", "pants": "Pants", "jeans": "Jeans",
+                  "knitwear": "Sweater", "outerwear": "Jacket", "dresses": "Dress", "skirts": "Skirt"},
+                 {"cotton": 40, "denim": 12, "wool": 10, "polyester": 14, "linen": 8, "cashmere": 3, "silk": 4}),
+    "footwear": (0.2, 95.0,
+                 {"sneakers": "Sneakers", "boots": "Boots", "loafers": "Loafers", "sandals": "Sandals", "heels": "Heels"},
+                 {"leather": 50, "canvas": 20, "suede": 15, "synthetic": 15}),
+    "accessories": (0.25, 40.0,
+                    {"bags": "Bag", "belts": "Belt", "watches": "Watch", "scarves": "Scarf", "hats": "Hat",
+                     "jewelry": "Necklace"},
+                    {"leather": 35, "canvas": 15, "wool": 10, "metal": 20, "cotton": 10, "silk": 10}),
+}
+
+# Occasion tags with relative weights; a product gets one or two
+SYNTHETIC_OCCASIONS = {"casual": 45, "everyday": 15, "formal": 20, "business": 10, "athletic": 10}
+
+# Neutrals dominate real catalogs
+SYNTHETIC_COLORS = {
+    "black": 18, "white": 14, "gray": 10, "navy": 9, "beige": 7, "brown": 8, "blue": 8,
+    "olive": 4, "rust": 2, "red": 5, "green": 4, "pink": 3, "yellow": 2, "natural": 3, "burgundy": 3,
+}
+
+SYNTHETIC_GENDERS = {"unisex": 40, "women": 35, "men": 25}
+
+SYNTHETIC_ADJECTIVES = ["Classic", "Modern", "Relaxed", "Slim", "Vintage", "Essential", "Premium",
+                        "Everyday", "Tailored", "Oversized", "Lightweight", "Structured"]
+
+# Answers of the style questionnaire (frontend StyleQuestionnaire.js) with relative weights
+SYNTHETIC_PREFERENCES = {
+    "occasion": {"casual": 40, "work": 25, "formal": 15, "athletic": 10, "mixed": 10},
+    "style_influence": {"classic": 25, "trendy": 20, "bohemian": 10, "minimalist": 25, "vintage": 10, "streetwear": 10},
+    "fit_preference": {"loose": 20, "regular": 45, "fitted": 25, "mixed": 10},
+    "color_palette": {"neutrals": 40, "earth_tones": 20, "bold_colors": 15, "pastels": 10, "varied": 15},
+    "budget": {"budget": 30, "mid_range": 45, "premium": 15, "mixed": 10},
+    "pattern_preference": {"solids": 45, "subtle_patterns": 25, "bold_patterns": 10, "mixed": 20},
+    "comfort_importance": {"very_important": 35, "balanced": 50, "style_first": 15},
+}
+
+SYNTHETIC_PASSWORD = "benchmark-password"
+
+
+def _weighted(rng, weights):
+    return rng.choices(list(weights), weights=list(weights.values()))[0]
+
+
+def _price(rng, median):
+    # Log-normal around the department median, ending in .99
+    price = median * math.exp(rng.gauss(0, 0.6))
+    return max(4.99, round(price) - 0.01)
+
+
+def iter_synthetic_products(count, seed=0, start=0, now=None):
+    """Yield `count` synthetic products; product i is the same for a given seed whatever `start` is"""
+    now = now or datetime.datetime(2024, 1, 1)
+    departments = list(SYNTHETIC_DEPARTMENTS)
+    shares = [SYNTHETIC_DEPARTMENTS[d][0] for d in departments]
+
+    for i in range(start, start + count):
+        rng = random.Random(f"{seed}:product:{i}")
+        department = rng.choices(departments, weights=shares)[0]
+        _, median_price, subcategories, materials = SYNTHETIC_DEPARTMENTS[department]
+        subcategory = rng.choice(list(subcategories))
+        color = _weighted(rng, SYNTHETIC_COLORS)
+        material = _weighted(rng, materials)
+        occasions = {_weighted(rng, SYNTHETIC_OCCASIONS) for _ in range(rng.choice((1, 1, 2)))}
+        name = f"{rng.choice(SYNTHETIC_ADJECTIVES)} {color.title()} {material.title()} {subcategories[subcategory]}"
+
+        product = create_product(
+            name=name,
+            description=f"{name} for {' and '.join(sorted(occasions))} wear.",
+            price=_price(rng, median_price),
+            image_url=f"https://example.com/synthetic/{seed}/{i}.jpg",
+            categories=[department, *sorted(occasions), subcategory],
+            attributes={"color": color, "material": material, "gender": _weighted(rng, SYNTHETIC_GENDERS)}
+        )
+        product["sku"] = f"SYN-{seed}-{i:08d}"
+        product["created_at"] = now - datetime.timedelta(seconds=rng.randrange(365 * 24 * 3600))
+        product["updated_at"] = product["created_at"]
+        yield product
+
+
+def generate_synthetic_products(count, seed=0):
+    return list(iter_synthetic_products(count, seed))
+
+
+def iter_synthetic_users(count, seed=0, password_hash=None, start=0):
+    """
+    Yield (user, style profile) pairs with linked ids. Every user shares
+    password_hash (hash SYNTHETIC_PASSWORD once rather than per user).
+    """
+    for i in range(start, start + count):
+        rng = random.Random(f"{seed}:user:{i}")
+        user = create_user(f"synthetic{seed}_{i}", f"synthetic{seed}_{i}@example.com", password_hash)
+        user["_id"] = ObjectId()
+        preferences = {question: _weighted(rng, answers) for question, answers in SYNTHETIC_PREFERENCES.items()}
+        profile = create_style_profile(user_id=user["_id"], preferences=preferences)
+        profile["_id"] = ObjectId()
+        user["style_profile"] = profile["_id"]
+        yield user, profile
+
+
+def _batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def seed_synthetic_catalog(db, products=0, users=0, seed=0, batch_size=5000, password_hash=None, progress=None):
+    """Insert synthetic products and users in unordered batches. Returns (products, users) inserted"""
+    inserted_products = inserted_users = 0
+    for batch in _batches(iter_synthetic_products(products, seed), batch_size):
+        inserted_products += len(db.products.insert_many(batch, ordered=False).inserted_ids)
+        if progress:
+            progress("products", inserted_products, products)
+    for batch in _batches(iter_synthetic_users(users, seed, password_hash), batch_size):
+        db.users.insert_many([user for user, _ in batch], ordered=False)
+        db.style_profiles.insert_many([profile for _, profile in batch], ordered=False)
+        inserted_users += len(batch)
+        if progress:
+            progress("users", inserted_users, users)
+    return inserted_products, inserted_users
+
+
+if __name__ == "__main__":
+    import argparse
+    import os
+
+    from dotenv import load_dotenv
+    from flask_bcrypt import generate_password_hash
+    from pymongo import MongoClient
+
+    parser = argparse.ArgumentParser(description="Seed a synthetic catalog and users for load testing")
+    parser.add_argument("--products", type=int, default=10000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--drop", action="store_true", help="drop products, users and style profiles first")
+    args = parser.parse_args()
+
+    load_dotenv()
+    db = MongoClient(os.environ.get("MONGO_URI", "mongodb://localhost:27017/personashop")).get_default_database()
+    if args.drop:
+        for name in ("products", "users", "style_profiles", "user_recommendations"):
+            db.drop_collection(name)
+
+    password_hash = generate_password_hash(SYNTHETIC_PASSWORD, 4).decode("utf-8")
+    report = lambda kind, done, total: print(f"{kind}: {done:,}/{total:,}", end="\r" if done < total else "\n")
+    seed_synthetic_catalog(db, args.products, args.users, args.seed, args.batch_size, password_hash, report)
+    print(f"Users log in as synthetic{args.seed}_<n>@example.com / {SYNTHETIC_PASSWORD}")
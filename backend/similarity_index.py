@@ -0,0 +1,558 @@
+"""
+Local text-similarity index over the products collection.
+
+    python similarity_index.py build             # embed the whole catalog into a new snapshot
+    python similarity_index.py compact           # fold changes since the snapshot into a new one
+    python similarity_index.py similar <id>      # nearest neighbours of a product
+    python similarity_index.py search "<text>"   # products closest to free text
+
+Builds and compactions take an exclusive lock on <dir>/LOCK, so the CLI and
+the app's background threads never write snapshots concurrently.
+"""
+import contextlib
+import datetime
+import fcntl
+import json
+import logging
+import math
+import os
+import shutil
+import sys
+import threading
+import time
+import zlib
+from functools import lru_cache
+
+import numpy as np
+from bson.objectid import ObjectId
+
+from catalog_replica import changed_products
+from search_index import INDEX_PROJECTION, product_terms, tokenize
+
+# Width of the hashed embedding; a power of two keeps bucket and sign bits independent
+DEFAULT_DIMENSIONS = 1024
+
+# Bump whenever embedding changes, so older snapshots are rebuilt instead of loaded
+FEATURE_VERSION = 1
+
+# Products embedded per batch while building a snapshot
+BUILD_BATCH_SIZE = 5000
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=65536)
+def _bucket(term, dimensions):
+    """(column, sign) of a term; crc32 is stable across processes, unlike hash()"""
+    digest = zlib.crc32(term.encode('utf-8'))
+    return digest % dimensions, (1.0 if digest & 0x80000000 else -1.0)
+
+
+def embed(terms, dimensions=DEFAULT_DIMENSIONS):
+    """
+    Signed hashing-vectorizer embedding of {term: weight}, with sublinear
+    weights and unit length, so a dot product is the cosine similarity
+    """
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for term, weight in terms.items():
+        if weight > 0:
+            column, sign = _bucket(term, dimensions)
+            vector[column] += sign * (1.0 + math.log(weight))
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def embed_product(product, dimensions=DEFAULT_DIMENSIONS):
+    """Embedding of a product's name, description, categories and attributes (weighted as in search)"""
+    return embed(product_terms(product), dimensions)
+
+
+def embed_text(text, dimensions=DEFAULT_DIMENSIONS):
+    terms = {}
+    for term in tokenize(text or ''):
+        terms[term] = terms.get(term, 0.0) + 1.0
+    return embed(terms, dimensions)
+
+
+def profile_text(style_profile):
+    """Free text describing a style profile: its AI analysis, keywords and questionnaire answers"""
+    analysis = style_profile.get('ai_analysis') or {}
+    parts = [analysis.get('description') or '']
+    parts.extend(str(keyword) for keyword in analysis.get('keywords') or [])
+    for answer in (style_profile.get('preferences') or {}).values():
+        answers = answer if isinstance(answer, list) else [answer]
+        parts.extend(str(value).replace('_', ' ') for value in answers if isinstance(value, (str, int, float)))
+    return ' '.join(parts)
+
+
+def _top(scores, k):
+    """Indices of the k largest scores, best first"""
+    if k >= len(scores):
+        return np.argsort(-scores, kind='stable')
+    candidates = np.argpartition(-scores, k)[:k]
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+
+class SimilarityIndexUnavailable(Exception):
+    """Raised by queries while no snapshot has been loaded or built yet"""
+
+
+class SimilarityIndex:
+    """
+    Nearest-neighbour index of hashed product text embeddings.
+
+    The catalog is embedded into a snapshot directory (vectors, ids and
+    bucket document frequencies as .npy files) that is opened with
+    mmap_mode='r', so every worker process shares one page-cache copy.
+    Products changed since the snapshot are followed by `updated_at` into
+    a small in-memory delta that is searched alongside it, and the rows
+    they supersede are masked; deletions are masked by a periodic id
+    reconciliation. Neither needs a rebuild: compact() folds the delta
+    into a new snapshot once it grows past `compact_threshold` rows.
+    Without a `path` the snapshot is kept in memory.
+
+    In the app, start() leaves all of that to a daemon thread: it opens the
+    snapshot (and any newer one another process writes), follows the
+    collection, and builds a missing snapshot or compacts only when it gets
+    the lock file, so one worker does it while the others wait for the
+    result. Queries raise SimilarityIndexUnavailable until a snapshot is
+    loaded.
+    """
+
+    def __init__(self, collection, path=None, dimensions=DEFAULT_DIMENSIONS, refresh_interval=30,
+                 reconcile_interval=600, compact_threshold=5000, build_missing=True):
+        self.collection = collection
+        self.path = path
+        self.dimensions = dimensions
+        self.refresh_interval = refresh_interval
+        self.reconcile_interval = reconcile_interval
+        self.compact_threshold = compact_threshold
+        self.build_missing = build_missing
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._thread = None
+        self.snapshot = None
+        self._reset()
+
+    def _reset(self):
+        self._base = np.empty((0, self.dimensions), dtype=np.float32)
+        self._base_ids = []
+        self._base_row = {}
+        self._base_live = np.empty(0, dtype=bool)
+        self._delta = np.empty((0, self.dimensions), dtype=np.float32)
+        self._delta_ids = []
+        self._delta_row = {}
+        self._delta_live = np.empty(0, dtype=bool)
+        self._df = np.zeros(self.dimensions, dtype=np.float64)
+        self.watermark = None
+        self.last_refresh = 0.0
+        self.last_reconcile = 0.0
+
+    def __len__(self):
+        return int(self._base_live.sum() + self._delta_live.sum())
+
+    # Snapshots
+
+    def _current_file(self):
+        return os.path.join(self.path, 'CURRENT')
+
+    def _read_current(self):
+        """Name of the current snapshot, or None"""
+        try:
+            with open(self._current_file()) as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return None
+
+    @contextlib.contextmanager
+    def _maintenance_lock(self, blocking=True):
+        """Exclusive lock on <path>/LOCK while writing snapshots; yields False if another process holds it"""
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, 'LOCK'), 'w') as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _open(self, name):
+        """(meta, vectors, ids, df) of a snapshot, or None when it was built differently"""
+        snapshot = os.path.join(self.path, name)
+        with open(os.path.join(snapshot, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta['dimensions'] != self.dimensions or meta['feature_version'] != FEATURE_VERSION:
+            return None
+        # A build sizes the file before its scan; rows past `count` were never written
+        return (meta,
+                np.load(os.path.join(snapshot, 'vectors.npy'), mmap_mode='r')[:meta['count']],
+                np.load(os.path.join(snapshot, 'ids.npy')),
+                np.load(os.path.join(snapshot, 'df.npy')))
+
+    def load(self):
+        """Open the current snapshot. Returns False when there is none, or it was built differently"""
+        if not self.path:
+            return False
+        name = self._read_current()
+        if name is None:
+            return False
+        try:
+            opened = self._open(name)
+        except FileNotFoundError:
+            # Pruned by a compaction after CURRENT was read; CURRENT names its replacement by now
+            name = self._read_current()
+            opened = self._open(name)
+        if opened is None:
+            return False
+
+        meta, vectors, ids, df = opened
+        with self._lock:
+            self._reset()
+            self._base = vectors
+            self._base_ids = [ObjectId(raw.tobytes()) for raw in ids]
+            self._base_row = {product_id: row for row, product_id in enumerate(self._base_ids)}
+            self._base_live = np.ones(len(self._base_ids), dtype=bool)
+            self._df = df.astype(np.float64)
+            self.watermark = datetime.datetime.fromisoformat(meta['watermark']) if meta['watermark'] else None
+            self.last_refresh = self.last_reconcile = time.time()
+            self.snapshot = name
+            self._loaded = True
+        return True
+
+    def _live_rows(self):
+        """(ids, snapshot rows, delta rows) of every live product, snapshot rows first"""
+        base_rows = np.flatnonzero(self._base_live)
+        delta_rows = np.flatnonzero(self._delta_live)
+        ids = [self._base_ids[row] for row in base_rows] + [self._delta_ids[row] for row in delta_rows]
+        return ids, base_rows, delta_rows
+
+    def _create_snapshot(self, rows):
+        """(name, vectors memmap with room for `rows`) of a new snapshot directory"""
+        name = f"snapshot-{datetime.datetime.now():%Y%m%d%H%M%S%f}-{os.getpid()}"
+        snapshot = os.path.join(self.path, name)
+        os.makedirs(snapshot)
+        vectors = np.lib.format.open_memmap(os.path.join(snapshot, 'vectors.npy'), mode='w+',
+                                            dtype=np.float32, shape=(rows, self.dimensions))
+        return name, vectors
+
+    def _finish_snapshot(self, name, vectors, ids, df, watermark):
+        """Write the ids, df and metadata next to the filled vectors and make the snapshot current"""
+        snapshot = os.path.join(self.path, name)
+        vectors.flush()
+        np.save(os.path.join(snapshot, 'ids.npy'),
+                np.array([product_id.binary for product_id in ids], dtype='S12').view(np.uint8).reshape(-1, 12))
+        np.save(os.path.join(snapshot, 'df.npy'), df)
+        with open(os.path.join(snapshot, 'meta.json'), 'w') as f:
+            json.dump({
+                'dimensions': self.dimensions,
+                'feature_version': FEATURE_VERSION,
+                'count': len(ids),
+                'watermark': watermark.isoformat() if watermark else None,
+                'created_at': datetime.datetime.now().isoformat()
+            }, f)
+
+        # Switch atomically; processes still mapping an older snapshot keep reading it
+        temporary = f"{self._current_file()}.{os.getpid()}"
+        with open(temporary, 'w') as f:
+            f.write(name)
+        os.replace(temporary, self._current_file())
+        self._prune(keep={name})
+
+    def _prune(self, keep, retain=2):
+        """Remove older snapshots, keeping the newest `retain` (including the current one)"""
+        snapshots = sorted(entry for entry in os.listdir(self.path) if entry.startswith('snapshot-'))
+        for entry in snapshots[:-retain]:
+            if entry not in keep:
+                shutil.rmtree(os.path.join(self.path, entry), ignore_errors=True)
+
+    def build(self, blocking=True):
+        """
+        Embed the whole catalog into a new snapshot (or in memory without a
+        path). Returns False, without building, when blocking is False and
+        another process holds the lock.
+        """
+        if not self.path:
+            self._build()
+            return True
+        with self._maintenance_lock(blocking) as locked:
+            if locked:
+                self._build()
+            return locked
+
+    def _build(self):
+        started = datetime.datetime.now()
+        ids = []
+        blocks = []
+        df = np.zeros(self.dimensions, dtype=np.float64)
+        watermark = None
+        capacity = None
+        if self.path:
+            # Sized before the scan and filled a batch at a time, so one batch is all that is
+            # held in memory. Products added during the scan past that size come later in
+            # updated_at order; the first refresh picks them up from the watermark.
+            capacity = self.collection.count_documents({})
+            name, vectors = self._create_snapshot(capacity)
+
+        def store(batch):
+            block = self._embed_batch(batch, ids, df)
+            if capacity is None:
+                blocks.append(block)
+            else:
+                vectors[len(ids) - len(block):len(ids)] = block
+
+        batch = []
+        for product in changed_products(self.collection, projection=INDEX_PROJECTION):
+            if capacity is not None and len(ids) + len(batch) >= capacity:
+                break
+            batch.append(product)
+            if product.get('updated_at') and (watermark is None or product['updated_at'] > watermark):
+                watermark = product['updated_at']
+            if len(batch) >= BUILD_BATCH_SIZE:
+                store(batch)
+                batch = []
+        if batch:
+            store(batch)
+
+        if self.path:
+            self._finish_snapshot(name, vectors, ids, df, watermark)
+            self.load()
+        else:
+            with self._lock:
+                self._reset()
+                self._base = np.concatenate(blocks) if blocks else self._base
+                self._base_ids = ids
+                self._base_row = {product_id: row for row, product_id in enumerate(ids)}
+                self._base_live = np.ones(len(ids), dtype=bool)
+                self._df = df
+                self.watermark = watermark
+                self.last_refresh = self.last_reconcile = time.time()
+                self._loaded = True
+        logger.info("Similarity index built", extra={'products': len(ids),
+                                                     'seconds': (datetime.datetime.now() - started).total_seconds()})
+
+    def _embed_batch(self, products, ids, df):
+        block = np.stack([embed_product(product, self.dimensions) for product in products])
+        ids.extend(product['_id'] for product in products)
+        df += (block != 0).sum(axis=0)
+        return block
+
+    def compact(self, blocking=True):
+        """
+        Fold the delta and masked rows into a new snapshot. Queries keep
+        running on the current one while it is written. Returns False when
+        there is nothing to write to, or blocking is False and another
+        process holds the lock.
+        """
+        if not self.path:
+            return False
+        with self._maintenance_lock(blocking) as locked:
+            if not locked:
+                return False
+            with self._lock:
+                ids, base_rows, delta_rows = self._live_rows()
+                base, delta = self._base, self._delta[delta_rows]
+                df, watermark = self._df.copy(), self.watermark
+            # Changes made meanwhile are past the watermark, so the next refresh re-reads them
+            name, vectors = self._create_snapshot(len(ids))
+            for start in range(0, len(base_rows), BUILD_BATCH_SIZE):
+                vectors[start:start + BUILD_BATCH_SIZE] = base[base_rows[start:start + BUILD_BATCH_SIZE]]
+            vectors[len(base_rows):] = delta
+            self._finish_snapshot(name, vectors, ids, df, watermark)
+            self.load()
+            return True
+
+    # Incremental maintenance
+
+    def add(self, product):
+        """Embed (or re-embed) a single product into the delta"""
+        vector = embed_product(product, self.dimensions)
+        with self._lock:
+            # Re-reads of the watermark boundary usually bring unchanged text
+            current = self._vector(product['_id'])
+            if current is not None and np.array_equal(current, vector):
+                return
+            self.remove(product['_id'])
+            row = self._delta_row.get(product['_id'])
+            if row is None:
+                row = len(self._delta_ids)
+                if row == len(self._delta):
+                    capacity = max(64, 2 * len(self._delta))
+                    self._delta = np.concatenate([self._delta, np.zeros((capacity - row, self.dimensions), np.float32)])
+                    self._delta_live = np.concatenate([self._delta_live, np.zeros(capacity - row, dtype=bool)])
+                self._delta_ids.append(product['_id'])
+                self._delta_row[product['_id']] = row
+            self._delta[row] = vector
+            self._delta_live[row] = True
+            self._df += vector != 0
+
+    def _vector(self, product_id):
+        """Stored vector of a live product, or None"""
+        row = self._delta_row.get(product_id)
+        if row is not None and self._delta_live[row]:
+            return self._delta[row]
+        row = self._base_row.get(product_id)
+        if row is not None and self._base_live[row]:
+            return self._base[row]
+        return None
+
+    def remove(self, product_id):
+        """Mask a product wherever it is stored"""
+        with self._lock:
+            row = self._base_row.get(product_id)
+            if row is not None and self._base_live[row]:
+                self._base_live[row] = False
+                self._df -= self._base[row] != 0
+            row = self._delta_row.get(product_id)
+            if row is not None and self._delta_live[row]:
+                self._delta_live[row] = False
+                self._df -= self._delta[row] != 0
+
+    def refresh(self):
+        """Embed products changed since the last refresh, masking deleted ones now and then"""
+        products = list(changed_products(self.collection, self.watermark, INDEX_PROJECTION))
+        for product in products:
+            self.add(product)
+        with self._lock:
+            for product in products:
+                if product.get('updated_at') and (self.watermark is None or product['updated_at'] > self.watermark):
+                    self.watermark = product['updated_at']
+            self.last_refresh = time.time()
+        if time.time() - self.last_reconcile > self.reconcile_interval:
+            self.reconcile()
+
+    def reconcile(self):
+        """Mask products that no longer exist (one _id-only scan)"""
+        existing = {doc['_id'] for doc in self.collection.find({}, {'_id': 1})}
+        with self._lock:
+            ids, _, _ = self._live_rows()
+            for product_id in ids:
+                if product_id not in existing:
+                    self.remove(product_id)
+            self.last_reconcile = time.time()
+
+    # Background maintenance
+
+    def start(self):
+        """Load, follow and compact the index from a daemon thread"""
+        self._thread = threading.Thread(target=self._run, name='similarity-index', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.maintain()
+            except Exception:
+                logger.exception("Similarity index maintenance failed")
+            time.sleep(self.refresh_interval)
+
+    def maintain(self):
+        """
+        One maintenance pass: open a snapshot written since the last pass
+        (by this or another process); without any, build one if no other
+        process is; otherwise follow the collection and compact when due.
+        """
+        current = self._read_current() if self.path else None
+        if current is not None and current != self.snapshot and self.load():
+            return
+        if not self._loaded:
+            if self.build_missing:
+                self.build(blocking=False)
+            return
+        self.refresh()
+        if len(self._delta_ids) > self.compact_threshold:
+            self.compact(blocking=False)
+
+    def ensure_fresh(self):
+        """Without a background thread (e.g. the CLI): open or build the snapshot inline, then follow the collection"""
+        if self._thread is not None:
+            return
+        with self._lock:
+            if not self._loaded:
+                if not self.load():
+                    self.build()
+            elif time.time() - self.last_refresh > self.refresh_interval:
+                self.refresh()
+
+    # Queries
+
+    def _check_loaded(self):
+        if not self._loaded:
+            raise SimilarityIndexUnavailable('The similarity index has not been built yet')
+
+    def nearest(self, vector, k=10, exclude=()):
+        """[(product_id, similarity)] of the k most similar live products, best first"""
+        self.ensure_fresh()
+        with self._lock:
+            self._check_loaded()
+            excluded = set(exclude)
+            candidates = []
+            stores = ((self._base, self._base_ids, self._base_live),
+                      (self._delta[:len(self._delta_ids)], self._delta_ids, self._delta_live[:len(self._delta_ids)]))
+            for vectors, ids, live in stores:
+                if not len(ids):
+                    continue
+                scores = np.asarray(vectors @ vector, dtype=np.float32)
+                scores[~live] = -np.inf
+                for row in _top(scores, k + len(excluded)):
+                    if scores[row] > 0 and ids[row] not in excluded:
+                        candidates.append((ids[row], float(scores[row])))
+            candidates.sort(key=lambda item: item[1], reverse=True)
+            return [(product_id, round(score, 4)) for product_id, score in candidates[:k]]
+
+    def similar(self, product, k=10):
+        """Products whose text is closest to the given product document"""
+        return self.nearest(embed_product(product, self.dimensions), k, exclude=[product['_id']])
+
+    def search(self, text, k=10):
+        """
+        Products closest to free text (e.g. profile_text of a style profile).
+        Query buckets are weighted by inverse document frequency, so words
+        every product shares count less than distinctive ones.
+        """
+        vector = embed_text(text, self.dimensions)
+        self.ensure_fresh()
+        with self._lock:
+            self._check_loaded()
+            count = len(self)
+            vector = vector * (np.log((1.0 + count) / (1.0 + np.maximum(self._df, 0))) + 1.0).astype(np.float32)
+        norm = np.linalg.norm(vector)
+        return self.nearest(vector / norm, k) if norm else []
+
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+    db = MongoClient(os.environ.get('MONGO_URI', 'mongodb://localhost:27017/personashop')).get_default_database()
+    index = SimilarityIndex(
+        db.products,
+        path=os.environ.get('SIMILARITY_INDEX_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'similarity')),
+        dimensions=int(os.environ.get('SIMILARITY_DIMENSIONS', DEFAULT_DIMENSIONS))
+    )
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+
+    if command == 'build':
+        index.build()
+        print(f"Indexed {len(index)} products into {index.path}")
+    elif command == 'compact':
+        index.ensure_fresh()
+        index.refresh()
+        index.compact()
+        print(f"Compacted {len(index)} products into {index.path}")
+    elif command == 'similar' and len(sys.argv) > 2:
+        product = db.products.find_one({'_id': ObjectId(sys.argv[2])}, INDEX_PROJECTION)
+        if not product:
+            sys.exit('Product not found')
+        for product_id, score in index.similar(product):
+            print(f"{score:.4f} {product_id} {db.products.find_one({'_id': product_id}, {'name': 1}).get('name')}")
+    elif command == 'search' and len(sys.argv) > 2:
+        for product_id, score in index.search(' '.join(sys.argv[2:])):
+            print(f"{score:.4f} {product_id} {db.products.find_one({'_id': product_id}, {'name': 1}).get('name')}")
+    else:
+        print(__doc__)
+        sys.exit(2)
@@ -0,0 +1,182 @@
+"""
+Concurrency stress test for style profile saves against a local mongod.
+
+    python stress_profile_saves.py --users 200 --saves-per-user 8 --concurrency 32
+
+Every user's saves are issued back to back from a thread pool, so they
+overlap the way double-submits and parallel tabs do. Each mode runs on its
+own scratch collections (dropped afterwards):
+
+    legacy   find_one, then update_one or insert_one + users.update_one
+    upsert   style_profile.save_style_profile (find_one_and_update on the
+             unique user_id index)
+
+Reports save latency, MongoDB commands per save, users that ended up with
+more than one profile and users whose style_profile reference does not
+point at their profile. Exits 1 when the upsert mode violates
+one-profile-per-user.
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from bson.objectid import ObjectId
+from pymongo import ASCENDING, IndexModel, monitoring
+
+from indexes import INDEXES
+from models import create_style_profile
+from seed_data import SYNTHETIC_PREFERENCES
+from style_profile import save_style_profile, mock_style_analysis
+
+
+def legacy_save(profiles, users, user_id, preferences, ai_analysis):
+    """The save path before save_style_profile, kept for comparison"""
+    existing_profile = profiles.find_one({'user_id': user_id})
+    if existing_profile:
+        profiles.update_one(
+            {'_id': existing_profile['_id']},
+            {'$set': {'preferences': preferences, 'ai_analysis': ai_analysis, 'updated_at': datetime.datetime.now()}}
+        )
+        return existing_profile['_id'], False
+    result = profiles.insert_one(create_style_profile(user_id=user_id, preferences=preferences, ai_analysis=ai_analysis))
+    users.update_one({'_id': user_id}, {'$set': {'style_profile': result.inserted_id}})
+    return result.inserted_id, True
+
+
+MODES = {
+    'legacy': (legacy_save, [IndexModel([('user_id', ASCENDING)], name='user_id')]),
+    'upsert': (save_style_profile, INDEXES['style_profiles']),
+}
+
+
+class CommandCounter(monitoring.CommandListener):
+    """Counts commands sent by the client it is registered on"""
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        with self._lock:
+            self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def run(db, mode, users, saves_per_user, concurrency, seed=0, counter=None):
+    """Run one mode on scratch collections and return its report"""
+    save, indexes = MODES[mode]
+    profiles = db[f'stress_{mode}_style_profiles']
+    user_docs = db[f'stress_{mode}_users']
+    profiles.drop()
+    user_docs.drop()
+    profiles.create_indexes(indexes)
+
+    user_ids = [ObjectId() for _ in range(users)]
+    user_docs.insert_many([{'_id': user_id, 'style_profile': None} for user_id in user_ids])
+
+    rng = random.Random(seed)
+    calls = [
+        (user_id, {question: rng.choice(list(answers)) for question, answers in SYNTHETIC_PREFERENCES.items()})
+        for user_id in user_ids
+        for _ in range(saves_per_user)
+    ]
+    analysis = mock_style_analysis()
+
+    def timed(call):
+        started = time.perf_counter()
+        try:
+            save(profiles, user_docs, call[0], call[1], analysis)
+            ok = True
+        except Exception:
+            ok = False
+        return time.perf_counter() - started, ok
+
+    commands_before = counter.count if counter else 0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        outcomes = list(executor.map(timed, calls))
+    elapsed = time.perf_counter() - started
+    commands = (counter.count - commands_before) if counter else None
+
+    # One profile per user, and the user's reference pointing at it
+    per_user = {group['_id']: group['profile_ids'] for group in profiles.aggregate([
+        {'$group': {'_id': '$user_id', 'profile_ids': {'$push': '$_id'}}}
+    ])}
+    references = {user['_id']: user.get('style_profile') for user in user_docs.find({}, {'style_profile': 1})}
+    duplicated = sum(1 for profile_ids in per_user.values() if len(profile_ids) > 1)
+    missing = sum(1 for user_id in user_ids if user_id not in per_user)
+    dangling = sum(1 for user_id, profile_ids in per_user.items() if references.get(user_id) not in profile_ids)
+
+    profiles.drop()
+    user_docs.drop()
+
+    latencies = np.array([latency for latency, _ in outcomes]) * 1000
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {
+        'saves': len(calls),
+        'errors': sum(1 for _, ok in outcomes if not ok),
+        'throughput_sps': round(len(calls) / elapsed, 1),
+        'p50_ms': round(float(p50), 2),
+        'p95_ms': round(float(p95), 2),
+        'p99_ms': round(float(p99), 2),
+        'commands_per_save': round(commands / len(calls), 2) if commands is not None else None,
+        'profiles': sum(len(profile_ids) for profile_ids in per_user.values()),
+        'users_with_duplicates': duplicated,
+        'users_without_profile': missing,
+        'dangling_references': dangling,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--saves-per-user', type=int, default=8)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--mode', choices=['both', *MODES], default='both')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='write results to this JSON file')
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+
+    load_dotenv()
+    counter = CommandCounter()
+    client = MongoClient(os.environ.get('MONGO_URI', 'mongodb://localhost:27017/personashop'),
+                         maxPoolSize=max(args.concurrency, 10), event_listeners=[counter])
+    db = client.get_default_database()
+
+    modes = list(MODES) if args.mode == 'both' else [args.mode]
+    results = {mode: run(db, mode, args.users, args.saves_per_user, args.concurrency, args.seed, counter)
+               for mode in modes}
+
+    print(f"{'mode':8s} {'saves/s':>9s} {'p50':>9s} {'p95':>9s} {'p99':>9s} {'cmds':>5s} {'dupes':>6s} {'dangling':>9s} {'err':>5s}")
+    for mode, result in results.items():
+        print(f"{mode:8s} {result['throughput_sps']:9.1f} {result['p50_ms']:8.2f}ms {result['p95_ms']:8.2f}ms "
+              f"{result['p99_ms']:8.2f}ms {result['commands_per_save']:5.2f} {result['users_with_duplicates']:6d} "
+              f"{result['dangling_references']:9d} {result['errors']:5d}")
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump({'meta': vars(args), 'results': results}, f, indent=2)
+
+    upsert = results.get('upsert')
+    if upsert and (upsert['users_with_duplicates'] or upsert['users_without_profile']
+                   or upsert['dangling_references'] or upsert['errors']):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
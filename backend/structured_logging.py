@@ -0,0 +1,143 @@
+import atexit
+import copy
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import uuid
+
+from flask import g, has_request_context, request
+
+# LogRecord attributes that are not user-supplied `extra` fields
+RESERVED_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per record: standard fields, request id and any `extra` fields"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in RESERVED_ATTRIBUTES and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class RequestContextFilter(logging.Filter):
+    """Tag records made while handling a request with its request id"""
+
+    def filter(self, record):
+        if has_request_context() and 'request_id' in g:
+            record.request_id = g.request_id
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep only a fraction of records per level, e.g. {'DEBUG': 0.01}.
+    Levels without a rate (and anything at WARNING or above) are kept.
+    Kept records carry `sample_rate` so counts can be scaled back up.
+    """
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = {logging.getLevelName(level) if isinstance(level, str) else level: rate
+                      for level, rate in rates.items()}
+
+    def filter(self, record):
+        rate = self.rates.get(record.levelno)
+        if rate is None or record.levelno >= logging.WARNING or rate >= 1:
+            return True
+        if random.random() >= rate:
+            return False
+        record.sample_rate = rate
+        return True
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that only merges the message arguments and renders the
+    traceback on the calling thread; JSON encoding and the stream write
+    happen on the listener thread.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def parse_sample_rates(value):
+    """'DEBUG=0.01,INFO=0.5' -> {'DEBUG': 0.01, 'INFO': 0.5}"""
+    rates = {}
+    for item in filter(None, (part.strip() for part in (value or '').split(','))):
+        level, _, rate = item.partition('=')
+        rates[level.strip().upper()] = float(rate)
+    return rates
+
+
+def configure_logging(level=None, log_format=None, sample_rates=None, stream=None):
+    """
+    Route every log record through a queue to a background listener thread.
+    Defaults come from LOG_LEVEL (INFO), LOG_FORMAT (json|text) and
+    LOG_SAMPLE_RATES ('DEBUG=0.01,INFO=1'). Returns the started listener.
+    """
+    level = (level or os.environ.get('LOG_LEVEL', 'INFO')).upper()
+    log_format = log_format or os.environ.get('LOG_FORMAT', 'json')
+    if sample_rates is None:
+        sample_rates = parse_sample_rates(os.environ.get('LOG_SAMPLE_RATES'))
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    if log_format == 'json':
+        output.setFormatter(JSONFormatter())
+    else:
+        output.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s',
+                                              defaults={'request_id': '-'}))
+
+    log_queue = queue.SimpleQueue()
+    handler = DeferredQueueHandler(log_queue)
+    handler.addFilter(RequestContextFilter())
+    if sample_rates:
+        handler.addFilter(SamplingFilter(sample_rates))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    listener = logging.handlers.QueueListener(log_queue, output)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+def register_request_ids(app, header='X-Request-ID'):
+    """Give every request an id (the caller's, if it sent one) and echo it in the response"""
+
+    @app.before_request
+    def assign_request_id():
+        g.request_id = request.headers.get(header) or uuid.uuid4().hex
+
+    @app.after_request
+    def echo_request_id(response):
+        if 'request_id' in g:
+            response.headers[header] = g.request_id
+        return response
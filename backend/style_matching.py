@@ -0,0 +1,234 @@
+import datetime
+import threading
+import time
+
+import numpy as np
+
+# Style rules: a preference answer earns its weight when the product carries
+# any of the listed values for the given feature field
+STYLE_RULES = [
+    {
+        'preference': 'occasion',
+        'answer': 'formal',
+        'field': 'categories',
+        'values': ['formal', 'business'],
+        'weight': 25,
+        'reason': 'Matches your formal style preference'
+    },
+    {
+        'preference': 'occasion',
+        'answer': 'casual',
+        'field': 'categories',
+        'values': ['casual', 'everyday'],
+        'weight': 25,
+        'reason': 'Perfect for your casual style'
+    },
+    {
+        'preference': 'color_palette',
+        'answer': 'neutrals',
+        'field': 'color',
+        'values': ['black', 'white', 'gray', 'beige'],
+        'weight': 25,
+        'reason': 'Fits your neutral color palette'
+    },
+    {
+        'preference': 'color_palette',
+        'answer': 'earth_tones',
+        'field': 'color',
+        'values': ['brown', 'olive', 'rust'],
+        'weight': 25,
+        'reason': 'Complements your earth tone preference'
+    }
+]
+
+# Product attributes encoded as features next to categories
+ATTRIBUTE_FIELDS = ['color', 'material', 'gender']
+
+MAX_MATCH_SCORE = 100
+
+# Fields needed to build the feature index from the products collection
+INDEX_PROJECTION = {'categories': 1, 'attributes': 1, 'created_at': 1}
+
+
+def product_features(product):
+    """Return the (field, value) features of a product document"""
+    features = [('categories', c) for c in product.get('categories') or []]
+    attributes = product.get('attributes') or {}
+    for field in ATTRIBUTE_FIELDS:
+        if attributes.get(field):
+            features.append((field, attributes[field]))
+    return features
+
+
+class ProductFeatureIndex:
+    """
+    Products encoded as rows of a binary feature matrix so that a style
+    profile can be scored against every row in one matrix operation
+    """
+
+    def __init__(self, products):
+        self.vocabulary = {}
+        self.product_ids = []
+        self.row_by_id = {}
+        rows = []
+        cols = []
+        created_at = []
+
+        for row, product in enumerate(products):
+            self.product_ids.append(product['_id'])
+            self.row_by_id[product['_id']] = row
+            timestamp = product.get('created_at')
+            created_at.append(timestamp.timestamp() if isinstance(timestamp, datetime.datetime) else 0.0)
+            for feature in product_features(product):
+                col = self.vocabulary.setdefault(feature, len(self.vocabulary))
+                rows.append(row)
+                cols.append(col)
+
+        self.features = np.zeros((len(self.product_ids), len(self.vocabulary)), dtype=np.float32)
+        self.features[np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64)] = 1.0
+        self.created_at = np.asarray(created_at, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.product_ids)
+
+    def encode_preferences(self, preferences):
+        """
+        Turn style preferences into a feature x rule matrix, the weight of
+        each rule and its reason text
+        """
+        rules = [
+            rule for rule in STYLE_RULES
+            if preferences.get(rule['preference']) == rule['answer']
+        ]
+        rule_matrix = np.zeros((len(self.vocabulary), len(rules)), dtype=np.float32)
+        for i, rule in enumerate(rules):
+            for value in rule['values']:
+                col = self.vocabulary.get((rule['field'], value))
+                if col is not None:
+                    rule_matrix[col, i] = 1.0
+        weights = np.asarray([rule['weight'] for rule in rules], dtype=np.float32)
+        reasons = [rule['reason'] for rule in rules]
+        return rule_matrix, weights, reasons
+
+    def rows_for(self, product_ids):
+        """Map product ids to index rows, skipping ids that are not indexed"""
+        return np.asarray(
+            [self.row_by_id[pid] for pid in product_ids if pid in self.row_by_id],
+            dtype=np.int64
+        )
+
+    def score(self, preferences, rows=None):
+        """
+        Score the whole index, or only the given rows, against preferences.
+        Returns (rows, scores, hits, reasons) where hits[i, j] tells whether
+        row i satisfied the rule whose text is reasons[j].
+        """
+        # Indexing with every row would copy the whole matrix
+        features = self.features if rows is None else self.features[rows]
+        if rows is None:
+            rows = np.arange(len(self.product_ids), dtype=np.int64)
+        rule_matrix, weights, reasons = self.encode_preferences(preferences)
+        hits = (features @ rule_matrix) > 0
+        scores = np.minimum(hits @ weights, MAX_MATCH_SCORE)
+        return rows, scores, hits, reasons
+
+    def top_k(self, preferences, k, rows=None):
+        """
+        Return the k best (product_id, score, reasons) tuples, newest
+        products first among equal scores
+        """
+        rows, scores, hits, reasons = self.score(preferences, rows)
+        order = _top_order(scores, self.created_at[rows], k)
+        return [
+            (
+                self.product_ids[rows[i]],
+                int(scores[i]),
+                [reasons[j] for j in np.flatnonzero(hits[i])]
+            )
+            for i in order
+        ]
+
+
+def _top_order(scores, created_at, k):
+    """
+    Positions of the k best entries by score, then created_at, both
+    descending; the same as np.lexsort((-created_at, -scores))[:k] but
+    only the selected k are sorted
+    """
+    n = len(scores)
+    if k >= n:
+        return np.lexsort((-created_at, -scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    # Everything above the k-th best score, then the newest of those tied with it
+    threshold = np.partition(scores, n - k)[n - k]
+    above = np.flatnonzero(scores > threshold)
+    tied = np.flatnonzero(scores == threshold)
+    need = k - len(above)
+    if need < len(tied):
+        age = -created_at[tied]
+        cutoff = np.partition(age, need - 1)[need - 1]
+        # Equal timestamps at the cutoff keep their original order, as in a stable sort
+        tied = np.concatenate([tied[age < cutoff], tied[age == cutoff]])[:need]
+    chosen = np.sort(np.concatenate([above, tied]))
+    return chosen[np.lexsort((-created_at[chosen], -scores[chosen]))]
+
+
+def match_product(product, preferences):
+    """Score a single product document against style preferences"""
+    index = ProductFeatureIndex([product])
+    _, score, reasons = index.top_k(preferences, 1)[0]
+    return score, reasons
+
+
+# Cached catalog-wide index shared by request threads: (index, built_at, generation).
+# invalidate_catalog_index() bumps the generation, marking the cached index stale.
+_catalog_index = None
+_catalog_generation = 0
+_catalog_index_lock = threading.Lock()
+_catalog_build_lock = threading.Lock()
+
+
+def _cached_index(max_age):
+    """(cached index or None, whether it is fresh)"""
+    with _catalog_index_lock:
+        if _catalog_index is None:
+            return None, False
+        index, built_at, generation = _catalog_index
+        return index, generation == _catalog_generation and time.time() - built_at <= max_age
+
+
+def get_catalog_index(db, max_age=60, wait=False):
+    """
+    Return the feature index for the whole catalog, rebuilding it when older
+    than max_age seconds or invalidated. One thread rebuilds, outside the
+    lock readers take; the others keep using the previous index meanwhile,
+    unless there is none yet or `wait` asks for the rebuilt one.
+    """
+    global _catalog_index
+
+    index, fresh = _cached_index(max_age)
+    if fresh:
+        return index
+    if not _catalog_build_lock.acquire(blocking=wait or index is None):
+        return index
+    try:
+        index, fresh = _cached_index(max_age)
+        if fresh:
+            return index
+        with _catalog_index_lock:
+            generation = _catalog_generation
+        index = ProductFeatureIndex(db.products.find({}, INDEX_PROJECTION))
+        with _catalog_index_lock:
+            _catalog_index = (index, time.time(), generation)
+        return index
+    finally:
+        _catalog_build_lock.release()
+
+
+def invalidate_catalog_index():
+    """Force the next get_catalog_index call to rebuild from the database"""
+    global _catalog_generation
+
+    with _catalog_index_lock:
+        _catalog_generation += 1
@@ -1,13 +1,89 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from bson.objectid import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 import datetime
 import openai
+import logging
 import os
-import traceback
+from functools import wraps
+from analysis_jobs import QueueFull
+from openai_client import LLMUnavailable
+from identity import current_identity, invalidate_identity
+from models import create_style_profile
  
 # Initialize blueprint
 style_bp = Blueprint('style', __name__)
+
+logger = logging.getLogger(__name__)
+
+# Model used for style analysis; OPENAI_BASE_URL can point at any OpenAI-compatible server
+DEFAULT_OPENAI_MODEL = 'gpt-3.5-turbo'
+
+# Bump whenever create_style_prompt or the system message changes, so cached analyses are not reused
+PROMPT_VERSION = 'v1'
+
+# Admin-only endpoints require the X-Admin-Key header to match ADMIN_API_KEY
+def admin_required(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        admin_key = os.environ.get('ADMIN_API_KEY')
+        if not admin_key or request.headers.get('X-Admin-Key') != admin_key:
+            return jsonify({"error": "Admin access required"}), 403
+        return view(*args, **kwargs)
+    return wrapper
+ 
+# Placeholder analysis shown until the AI analysis is ready
+def mock_style_analysis():
+    return {
+        "description": "Your style combines formal and minimalist elements with neutral colors and subtle patterns. This creates a sophisticated, professional look that's perfect for work environments while maintaining versatility.",
+        "keywords": ["formal", "minimalist", "professional", "sophisticated", "versatile"],
+        "generated_at": datetime.datetime.now().isoformat()
+    }
+
+# Save a user's preferences and analysis with one atomic upsert on the unique user_id
+# index. The user's style_profile reference is written on every save, but only if it
+# does not already point at the profile, so a save interrupted between the two writes
+# is repaired by the next one. Returns (profile_id, created).
+def save_style_profile(profiles, users, user_id, preferences, ai_analysis):
+    new_profile = create_style_profile(user_id=user_id, preferences=preferences, ai_analysis=ai_analysis)
+    changes = {key: new_profile.pop(key) for key in ('preferences', 'ai_analysis', 'updated_at')}
+    del new_profile['user_id']  # comes from the filter on insert
+    new_profile['_id'] = ObjectId()
+    
+    for attempt in range(2):
+        try:
+            previous = profiles.find_one_and_update(
+                {'user_id': user_id},
+                {'$set': changes, '$setOnInsert': new_profile},
+                projection={'_id': 1},
+                upsert=True,
+                return_document=ReturnDocument.BEFORE
+            )
+            break
+        except DuplicateKeyError:
+            # A concurrent first save inserted the profile; the retry updates it
+            if attempt:
+                raise
+    
+    profile_id = previous['_id'] if previous is not None else new_profile['_id']
+    users.update_one(
+        {'_id': user_id, 'style_profile': {'$ne': profile_id}},
+        {'$set': {'style_profile': profile_id}}
+    )
+    return profile_id, previous is None
+
+# Format an analysis job for response
+def format_analysis_job(job):
+    return {
+        "job_id": job['_id'],
+        "status": job['status'],
+        "result": job.get('result'),
+        "error": job.get('error'),
+        "created_at": job['created_at'],
+        "updated_at": job['updated_at']
+    }
  
 # Create or update style profile
 @style_bp.route('/profile', methods=['POST'])
@@ -20,75 +96,113 @@ def create_or_update_profile():
         # Get profile data from request
         data = request.get_json()
         
-        print(f"Received style preferences: {data['preferences']}")
-        
         # Check if required fields are present
         if 'preferences' not in data:
             return jsonify({"error": "Missing preferences data"}), 400
         
-        # Get or create style profile
-        existing_profile = style_bp.mongo.db.style_profiles.find_one(
-            {'user_id': ObjectId(current_user_id)}
+        logger.debug("Received style preferences", extra={'preference_keys': sorted(data['preferences'])})
+        
+        # Reuse a cached analysis of identical preferences, otherwise save a mock
+        # analysis first and let the AI analysis replace it when its job completes
+        cached_analysis = style_bp.analysis_cache.get(
+            data['preferences'], os.environ.get('OPENAI_MODEL', DEFAULT_OPENAI_MODEL), PROMPT_VERSION
+        )
+        mock_analysis = cached_analysis or mock_style_analysis()
+        
+        # Create or update the profile in a single round trip
+        profile_id, _ = save_style_profile(
+            style_bp.mongo.db.style_profiles,
+            style_bp.mongo.db.users,
+            ObjectId(current_user_id),
+            data['preferences'],
+            mock_analysis
         )
         
-        # Generate a simple mock analysis first
-        mock_analysis = {
-            "description": "Your style combines formal and minimalist elements with neutral colors and subtle patterns. This creates a sophisticated, professional look that's perfect for work environments while maintaining versatility.",
-            "keywords": ["formal", "minimalist", "professional", "sophisticated", "versatile"],
-            "generated_at": datetime.datetime.now().isoformat()
-        }
+        # Drop the cached identity so the next request sees the new profile
+        invalidate_identity(current_user_id)
         
-        if existing_profile:
-            # Update existing profile
-            style_bp.mongo.db.style_profiles.update_one(
-                {'_id': existing_profile['_id']},
-                {'$set': {
-                    'preferences': data['preferences'],
-                    'ai_analysis': mock_analysis,
-                    'updated_at': datetime.datetime.now()
-                }}
-            )
-            profile_id = existing_profile['_id']
-        else:
-            # Create new profile
-            from models import create_style_profile
-            new_profile = create_style_profile(
-                user_id=ObjectId(current_user_id),
-                preferences=data['preferences'],
-                ai_analysis=mock_analysis
-            )
-            result = style_bp.mongo.db.style_profiles.insert_one(new_profile)
-            profile_id = result.inserted_id
-            
-            # Update user document with style profile reference
-            style_bp.mongo.db.users.update_one(
-                {'_id': ObjectId(current_user_id)},
-                {'$set': {'style_profile': profile_id}}
-            )
+        # Re-rank the user's materialized recommendations for the new preferences
+        style_bp.recommendations.refresh(ObjectId(current_user_id), data['preferences'])
+        
+        # Queue the AI analysis instead of waiting on the model here
+        analysis_job = None
+        if not cached_analysis:
+            try:
+                job, deduplicated = style_bp.analysis_jobs.submit(
+                    ObjectId(current_user_id), profile_id, data['preferences']
+                )
+                analysis_job = format_analysis_job(job)
+                analysis_job['deduplicated'] = deduplicated
+            except QueueFull:
+                pass
         
         return jsonify({
             "message": "Style profile saved successfully",
-            "profile_id": str(profile_id),
-            "ai_analysis": mock_analysis
+            "profile_id": profile_id,
+            "ai_analysis": mock_analysis,
+            "analysis_job": analysis_job
+        }), 202 if analysis_job else 200
+        
+    except Exception as e:
+        logger.exception("Error in create_or_update_profile")
+        return jsonify({"error": str(e)}), 500
+ 
+# Shared OpenAI client pool and circuit breaker state
+@style_bp.route('/llm-metrics', methods=['GET'])
+@admin_required
+def llm_metrics():
+    return jsonify({"metrics": style_bp.llm.metrics()}), 200
+ 
+# Analysis cache hit/miss counters
+@style_bp.route('/analysis-cache', methods=['GET'])
+@admin_required
+def analysis_cache_stats():
+    return jsonify({"stats": style_bp.analysis_cache.stats()}), 200
+ 
+# Invalidate cached analyses, optionally only those of one prompt version
+@style_bp.route('/analysis-cache', methods=['DELETE'])
+@admin_required
+def invalidate_analysis_cache():
+    try:
+        prompt_version = request.args.get('prompt_version', None)
+        removed = style_bp.analysis_cache.invalidate(prompt_version)
+        return jsonify({
+            "message": "Analysis cache invalidated",
+            "prompt_version": prompt_version,
+            "removed": removed
         }), 200
         
     except Exception as e:
-        print(f"Error in create_or_update_profile: {str(e)}")
-        traceback.print_exc()
+        logger.exception("Error in invalidate_analysis_cache")
         return jsonify({"error": str(e)}), 500
  
-# Get user's style profile
-@style_bp.route('/profile', methods=['GET'])
+# Get the status (and result) of an AI analysis job
+@style_bp.route('/analysis/<job_id>', methods=['GET'])
 @jwt_required()
-def get_profile():
+def get_analysis_job(job_id):
     try:
         # Get current user ID from JWT token
         current_user_id = get_jwt_identity()
         
-        # Find profile in database
-        profile = style_bp.mongo.db.style_profiles.find_one(
-            {'user_id': ObjectId(current_user_id)}
-        )
+        job = style_bp.analysis_jobs.get(ObjectId(job_id))
+        
+        # Users can only see their own jobs
+        if not job or job['user_id'] != ObjectId(current_user_id):
+            return jsonify({"error": "Analysis job not found"}), 404
+        
+        return jsonify({"job": format_analysis_job(job)}), 200
+        
+    except Exception as e:
+        logger.exception("Error in get_analysis_job")
+        return jsonify({"error": str(e)}), 500
+ 
+# Get user's style profile
+@style_bp.route('/profile', methods=['GET'])
+@jwt_required()
+def get_profile():
+    try:
+        # Profile loaded together with the user by the identity loader
+        profile = current_identity().style_profile
         
         if not profile:
             return jsonify({
@@ -96,58 +210,36 @@ def get_profile():
                 "has_profile": False
             }), 200
         
-        # Format for response
-        profile['_id'] = str(profile['_id'])
-        profile['user_id'] = str(profile['user_id'])
-        
-        # Convert datetime objects
-        if 'created_at' in profile:
-            profile['created_at'] = profile['created_at'].isoformat()
-        if 'updated_at' in profile:
-            profile['updated_at'] = profile['updated_at'].isoformat()
-        
         return jsonify({
             "profile": profile,
             "has_profile": True
         }), 200
         
     except Exception as e:
-        print(f"Error in get_profile: {str(e)}")
-        traceback.print_exc()
+        logger.exception("Error in get_profile")
         return jsonify({"error": str(e)}), 500
     
 @style_bp.route('/test-openai', methods=['GET'])
 def test_openai():
     """Test endpoint to diagnose OpenAI API issues"""
     try:
-        print("=== BEGINNING OPENAI TEST ===")
-        
-        # Check OpenAI version
-        print(f"OpenAI version: {openai.__version__}")
+        logger.info("Beginning OpenAI test", extra={'openai_version': openai.__version__})
         
         # Check for API key
         api_key = os.environ.get('OPENAI_API_KEY')
         if not api_key:
             return jsonify({"error": "OpenAI API key not found in environment variables"}), 400
-        print(f"API key found: {api_key[:5]}...{api_key[-4:]}")
-        
-        # Try creating a client
-        print("Creating OpenAI client...")
-        client = openai.OpenAI(api_key=api_key)
-        print("Client created successfully")
         
-        # Make a simple API call
-        print("Making test API call...")
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
+        # Make a simple API call through the shared client
+        response = style_bp.llm.chat_completion(
+            model=os.environ.get('OPENAI_MODEL', DEFAULT_OPENAI_MODEL),
             messages=[{"role": "user", "content": "Say hello"}],
             max_tokens=10
         )
-        print("API call successful!")
         
         # Try accessing the response
         content = response.choices[0].message.content
-        print(f"Response content: {content}")
+        logger.info("OpenAI test call succeeded")
         
         return jsonify({
             "success": True,
@@ -156,10 +248,7 @@ def test_openai():
         })
         
     except Exception as e:
-        print("==== ERROR IN OPENAI TEST ====")
-        print(f"Error type: {type(e).__name__}")
-        print(f"Error message: {str(e)}")
-        traceback.print_exc()
+        logger.exception("OpenAI test call failed", extra={'error_type': type(e).__name__})
         
         return jsonify({
             "success": False,
@@ -171,16 +260,6 @@ def test_openai():
 # Function to generate AI analysis of style preferences
 def generate_ai_analysis(preferences):
     try:
-        api_key = os.environ.get('OPENAI_API_KEY')
-        if not api_key:
-            raise ValueError("OpenAI API key not found")
-        
-        # Updated client initialization
-        client = openai.OpenAI(
-            api_key=api_key,
-            timeout=30.0  # Add timeout
-        )
-        
         # Updated message structure
         messages = [
             {
@@ -193,10 +272,10 @@ def generate_ai_analysis(preferences):
             }
         ]
         
-        # Make API call with error handling
+        # Make API call through the shared, rate-limited client
         try:
-            response = client.chat.completions.create(
-                model="gpt-3.5-turbo",
+            response = style_bp.llm.chat_completion(
+                model=os.environ.get('OPENAI_MODEL', DEFAULT_OPENAI_MODEL),
                 messages=messages,
                 max_tokens=500,
                 temperature=0.7,
@@ -212,18 +291,31 @@ def generate_ai_analysis(preferences):
             }
             
         except openai.APIError as e:
-            print(f"OpenAI API Error: {str(e)}")
+            logger.warning("OpenAI API error: %s", e)
             raise
             
+    except LLMUnavailable as e:
+        # Fail over to the mock analysis right away while the model is unavailable
+        fallback = mock_style_analysis()
+        fallback['error'] = str(e)
+        return fallback
     except Exception as e:
-        print(f"Error in generate_ai_analysis: {str(e)}")
-        traceback.print_exc()
+        logger.exception("Error in generate_ai_analysis")
         return {
             "description": "Unable to generate style analysis. Please try again later.",
             "error": str(e),
             "keywords": ["error"]
         }
  
+# Generate an AI analysis through the analysis cache
+def cached_ai_analysis(preferences):
+    return style_bp.analysis_cache.get_or_compute(
+        preferences,
+        os.environ.get('OPENAI_MODEL', DEFAULT_OPENAI_MODEL),
+        PROMPT_VERSION,
+        generate_ai_analysis
+    )
+ 
 # Helper function to create prompt from preferences
 def create_style_prompt(preferences):
     prompt = "Based on the following style preferences, provide a comprehensive analysis of this person's style profile:\n\n"
@@ -283,38 +375,24 @@ def test_profile_creation():
             "generated_at": datetime.datetime.now().isoformat()
         }
         
-        # Create a new profile directly
-        from models import create_style_profile
-        new_profile = create_style_profile(
-            user_id=ObjectId(current_user_id),
-            preferences=test_preferences,
-            ai_analysis=simple_analysis
-        )
-        
-        # Print for debugging
-        print("Created new profile object:")
-        print(new_profile)
-        
-        # Insert into database
-        result = style_bp.mongo.db.style_profiles.insert_one(new_profile)
-        profile_id = result.inserted_id
-        
-        # Update user document
-        style_bp.mongo.db.users.update_one(
-            {'_id': ObjectId(current_user_id)},
-            {'$set': {'style_profile': profile_id}}
+        # Save through the same upsert as real profiles, so repeated calls keep one profile
+        profile_id, _ = save_style_profile(
+            style_bp.mongo.db.style_profiles,
+            style_bp.mongo.db.users,
+            ObjectId(current_user_id),
+            test_preferences,
+            simple_analysis
         )
+        invalidate_identity(current_user_id)
         
         return jsonify({
             "success": True,
             "message": "Test profile created successfully",
-            "profile_id": str(profile_id)
+            "profile_id": profile_id
         })
         
     except Exception as e:
-        print("ERROR IN TEST PROFILE CREATION:")
-        print(str(e))
-        traceback.print_exc()
+        logger.exception("Error in test profile creation")
         
         return jsonify({
             "success": False,
@@ -0,0 +1,113 @@
+"""
+Upgrade path of ensure_indexes: a deployment that still has the non-unique
+style_profiles `user_id` index must end up with `user_id_unique` only.
+
+    python -m unittest test_indexes
+"""
+import unittest
+
+from pymongo.errors import OperationFailure
+
+from indexes import ensure_indexes, index_failures
+
+
+class FakeCollection:
+    """Just the index calls ensure_indexes makes, with MongoDB's same-key conflict"""
+
+    def __init__(self, indexes=None, duplicates=()):
+        self.indexes = {'_id_': {'key': [('_id', 1)]}}
+        self.indexes.update(indexes or {})
+        self.duplicates = list(duplicates)
+
+    def index_information(self):
+        return {name: dict(info) for name, info in self.indexes.items()}
+
+    def create_indexes(self, models):
+        for model in models:
+            document = model.document
+            key = list(document['key'].items())
+            for name, info in self.indexes.items():
+                if info['key'] == key and name != document['name']:
+                    raise OperationFailure(f"Index already exists with a different name: {name}", code=85)
+            if document.get('unique') and self.duplicates:
+                raise OperationFailure('E11000 duplicate key error', code=11000)
+            self.indexes[document['name']] = {
+                'key': key,
+                'unique': document.get('unique', False),
+                'sparse': document.get('sparse', False)
+            }
+
+    def drop_index(self, name):
+        if name not in self.indexes:
+            raise OperationFailure(f"index not found with name [{name}]", code=27)
+        del self.indexes[name]
+
+    def aggregate(self, pipeline, **kwargs):
+        return iter(self.duplicates)
+
+
+class FakeDatabase(dict):
+    def __missing__(self, name):
+        self[name] = FakeCollection()
+        return self[name]
+
+    def __getattr__(self, name):
+        return self[name]
+
+
+def legacy_database(duplicates=()):
+    """A database indexed the way user-005 deployed it"""
+    db = FakeDatabase()
+    db['style_profiles'] = FakeCollection({'user_id': {'key': [('user_id', 1)]}}, duplicates)
+    return db
+
+
+class RetiredIndexUpgradeTest(unittest.TestCase):
+
+    def test_replaces_same_key_retired_index(self):
+        db = legacy_database()
+        report = ensure_indexes(db)
+
+        self.assertEqual(index_failures(report), [])
+        self.assertEqual(report['style_profiles']['created'], ['user_id_unique'])
+        self.assertEqual(report['style_profiles']['dropped'], ['user_id'])
+        self.assertEqual(set(db['style_profiles'].indexes), {'_id_', 'user_id_unique'})
+        self.assertTrue(db['style_profiles'].indexes['user_id_unique']['unique'])
+
+    def test_converges_on_second_run(self):
+        db = legacy_database()
+        ensure_indexes(db)
+        report = ensure_indexes(db)
+
+        self.assertFalse(any(changes['created'] or changes['dropped'] or changes['failed']
+                             for changes in report.values()))
+
+    def test_keeps_retired_index_while_profiles_are_duplicated(self):
+        db = legacy_database(duplicates=[{'_id': 'user', 'profile_ids': ['a', 'b']}])
+        report = ensure_indexes(db)
+
+        self.assertEqual(report['style_profiles']['skipped'], ['user_id_unique'])
+        self.assertEqual(report['style_profiles']['dropped'], [])
+        self.assertIn('user_id', db['style_profiles'].indexes)
+
+    def test_restores_retired_index_when_the_build_fails(self):
+        db = legacy_database()
+        # Duplicates that appear after the prerequisite check passed
+        collection = db['style_profiles']
+        original = collection.create_indexes
+
+        def failing_unique(models):
+            if any(model.document.get('unique') for model in models):
+                raise OperationFailure('E11000 duplicate key error', code=11000)
+            original(models)
+
+        collection.create_indexes = failing_unique
+        report = ensure_indexes(db)
+
+        self.assertEqual([index for _, index, _ in index_failures(report)], ['user_id_unique'])
+        self.assertEqual(report['style_profiles']['dropped'], [])
+        self.assertEqual(collection.indexes['user_id']['key'], [('user_id', 1)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -72,8 +72,8 @@ function ShopPage() {
         // Update URL with new parameters
         navigate(`/shop?${params.toString()}`, { replace: true });
         
-        // Fetch products
-        const response = await axios.get(`http://localhost:5001/api/products/list?${params.toString()}`);
+        // Fetch products (the grid only renders the card fields)
+        const response = await axios.get(`http://localhost:5001/api/products/list?${params.toString()}&view=card`);
         
         setProducts(response.data.products);
         setTotalPages(response.data.total_pages);
@@ -251,6 +251,7 @@ function ShopPage() {
                 <option value="price">Price</option>
                 <option value="name">Name</option>
                 <option value="created_at">Newest</option>
+                <option value="relevance">Relevance</option>
               </select>
               <select
                 value={sortOrder}
@@ -1,4 +1,10 @@
-import React, { createContext, useState, useContext, useEffect } from 'react';
+import React, { createContext, useState, useContext, useEffect, useRef } from 'react';
+
+import axios from 'axios';
+
+import { useAuth } from './AuthContext';
+ 
+const CART_API = 'http://localhost:5001/api/cart';
  
 // Create context
 
@@ -6,6 +12,10 @@ const CartContext = createContext();
  
 export const CartProvider = ({ children }) => {
 
+  const { token } = useAuth();
+
+  const previousToken = useRef(token);
+
   // Initialize cart from localStorage or empty array
 
   const [cartItems, setCartItems] = useState(() => {
@@ -16,13 +26,95 @@ export const CartProvider = ({ children }) => {
 
   });
 
-  // Update localStorage whenever cart changes
+  // Guests keep their cart in localStorage; signed-in users' carts live on the server
+
+  useEffect(() => {
+
+    if (!token) {
+
+      localStorage.setItem('cart', JSON.stringify(cartItems));
+
+    }
+
+  }, [cartItems, token]);
+
+  // On login, merge the guest cart into the server cart; on logout, start an empty guest cart
 
   useEffect(() => {
 
-    localStorage.setItem('cart', JSON.stringify(cartItems));
+    const hadToken = previousToken.current;
+
+    previousToken.current = token;
+
+    if (!token) {
+
+      if (hadToken) {
+
+        setCartItems([]);
+
+      }
+
+      return;
+
+    }
+
+    const loadServerCart = async () => {
+
+      try {
+
+        const savedCart = JSON.parse(localStorage.getItem('cart') || '[]');
+
+        const headers = { Authorization: `Bearer ${token}` };
+
+        const response = savedCart.length
+
+          ? await axios.post(`${CART_API}/merge`, {
+
+              items: savedCart.map(item => ({ product_id: item._id, quantity: item.quantity }))
+
+            }, { headers })
 
-  }, [cartItems]);
+          : await axios.get(CART_API, { headers });
+
+        localStorage.removeItem('cart');
+
+        setCartItems(response.data.cart.items);
+
+      } catch (err) {
+
+        console.error('Failed to load cart:', err);
+
+      }
+
+    };
+
+    loadServerCart();
+
+  }, [token]);
+
+  // Apply a change on the server and adopt the cart it returns
+
+  const syncCart = async (request) => {
+
+    if (!token) {
+
+      return;
+
+    }
+
+    try {
+
+      const response = await request({ headers: { Authorization: `Bearer ${token}` } });
+
+      setCartItems(response.data.cart.items);
+
+    } catch (err) {
+
+      console.error('Failed to update cart:', err);
+
+    }
+
+  };
 
   // Add item to cart
 
@@ -60,6 +152,8 @@ export const CartProvider = ({ children }) => {
 
     });
 
+    syncCart(config => axios.post(`${CART_API}/items`, { product_id: product._id, quantity }, config));
+
   };
 
   // Remove item from cart
@@ -68,6 +162,8 @@ export const CartProvider = ({ children }) => {
 
     setCartItems(prevItems => prevItems.filter(item => item._id !== productId));
 
+    syncCart(config => axios.delete(`${CART_API}/items/${productId}`, config));
+
   };
 
   // Update item quantity
@@ -92,6 +188,8 @@ export const CartProvider = ({ children }) => {
 
     );
 
+    syncCart(config => axios.put(`${CART_API}/items/${productId}`, { quantity }, config));
+
   };
 
   // Clear cart
@@ -100,6 +198,8 @@ export const CartProvider = ({ children }) => {
 
     setCartItems([]);
 
+    syncCart(config => axios.delete(CART_API, config));
+
   };
 
   // Calculate total price
@@ -119,6 +219,7 @@ export const CartProvider = ({ children }) => {
   };
 
   return (
+
 <CartContext.Provider value={{
 
       cartItems,
@@ -138,6 +239,7 @@ export const CartProvider = ({ children }) => {
     }}>
 
       {children}
+
 </CartContext.Provider>
 
   );
@@ -148,4 +250,4 @@ export const CartProvider = ({ children }) => {
 
 export const useCart = () => useContext(CartContext);
  
-export default CartContext;
\ No newline at end of file
+export default CartContext;